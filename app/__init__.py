@@ -2,6 +2,7 @@ import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from app import motor
 
 app = Flask(__name__)
 
@@ -17,36 +18,33 @@ if not database_uri:
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'una-clave-secreta-de-desarrollo')
 app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool, WAL, timeouts y cachés según el motor (ver app/motor.py).
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = motor.opciones_motor(database_uri)
+# Métricas por petición (ver app/metricas.py); desactivadas salvo METRICAS=1.
+app.config['METRICAS_ACTIVAS'] = os.environ.get('METRICAS') == '1'
+app.config['METRICAS_UMBRAL_LENTO_MS'] = int(os.environ.get('METRICAS_UMBRAL_LENTO_MS', 500))
+app.config['METRICAS_TOKEN'] = os.environ.get('METRICAS_TOKEN')
+# Caché del HTML de la agenda (ver app/fragmentos.py): 'memoria', 'sqlite' o 'ninguno'.
+app.config['AGENDA_CACHE'] = os.environ.get('AGENDA_CACHE', 'memoria')
+app.config['AGENDA_CACHE_ENTRADAS'] = int(os.environ.get('AGENDA_CACHE_ENTRADAS', 256))
+app.config['AGENDA_CACHE_RUTA'] = os.environ.get('AGENDA_CACHE_RUTA')
+# Canales SSE de la agenda abiertos a la vez por worker (ver app/eventos_agenda.py y
+# gunicorn.conf.py); 0 los desactiva y la agenda se refresca sólo por sondeo.
+app.config['AGENDA_SSE_CANALES'] = int(os.environ.get('AGENDA_SSE_CANALES', 0))
 
 db = SQLAlchemy(app)
+with app.app_context():
+    motor.instalar(db.engine)
 login = LoginManager(app)
 
 login.login_view = 'login'
 login.login_message = 'Por favor, inicia sesión para acceder a esta página.'
 login.login_message_category = 'info'
 
-from app import routes, models
+from app import routes, models, resumen, busqueda, metricas
+metricas.instalar(app)
 
-# --- INICIO: NUEVO BLOQUE PARA CREAR EL PRIMER ADMIN ---
-# Esta sección se ejecuta después de que la app y la DB están inicializadas.
-with app.app_context():
-    # Nos aseguramos de que todas las tablas estén creadas.
-    db.create_all()
-
-    # Buscamos si ya existe algún usuario.
-    if not models.Recepcionista.query.first():
-        print("La base de datos de usuarios está vacía. Creando usuario administrador por defecto...")
-        
-        # Leemos las credenciales desde las Variables de Entorno.
-        admin_user = os.environ.get('DEFAULT_ADMIN_USER')
-        admin_pass = os.environ.get('DEFAULT_ADMIN_PASS')
-
-        if admin_user and admin_pass:
-            admin = models.Recepcionista(username=admin_user, is_admin=True)
-            admin.set_password(admin_pass)
-            db.session.add(admin)
-            db.session.commit()
-            print(f"Usuario administrador '{admin_user}' creado con éxito.")
-        else:
-            print("ADVERTENCIA: No se encontraron las variables de entorno DEFAULT_ADMIN_USER o DEFAULT_ADMIN_PASS. No se pudo crear el admin.")
-# --- FIN: NUEVO BLOQUE ---
\ No newline at end of file
+# El esquema y el primer administrador no se preparan al importar (cada
+# worker de gunicorn y cada comando `flask` lo pagaría y los workers
+# competirían por el DDL): se hace una vez por despliegue con
+# `flask init-db` y `flask crear-admin-inicial` (ver run.py).
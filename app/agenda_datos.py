@@ -0,0 +1,101 @@
+# =================================================================
+# ACCESO A DATOS DE LA AGENDA
+# =================================================================
+# Cada vista de la agenda carga sus citas, bloqueos y disponibilidades
+# con un número fijo de consultas, trayendo las relaciones que usan las
+# plantillas (cliente, tratamiento, gabinete, terapeuta, agendado_por)
+# en la misma consulta para evitar una carga perezosa por cita.
+from collections import defaultdict
+from datetime import timedelta
+
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.archivo import fuente_citas, es_archivada
+from app.models import Cita, BloqueoHorario, Disponibilidad
+from app.ocupacion import Intervalos
+
+
+def citas_en_rango(inicio, fin):
+    """Devuelve las citas que empiezan en [inicio, fin] con sus relaciones ya cargadas
+    (también las archivadas si el rango es viejo, marcadas con `archivada`)."""
+    cita = fuente_citas(inicio)
+    filas = (db.session.query(cita, es_archivada(cita))
+             .options(joinedload(cita.cliente), joinedload(cita.tratamiento), joinedload(cita.gabinete),
+                      joinedload(cita.terapeuta), joinedload(cita.agendado_por))
+             .filter(cita.fecha_hora_inicio.between(inicio, fin))
+             .order_by(cita.fecha_hora_inicio)
+             .all())
+    for c, archivada in filas:
+        if archivada:
+            c.archivada = True
+    return [c for c, _ in filas]
+
+
+def bloqueos_en_rango(inicio, fin):
+    """Devuelve los bloqueos que empiezan en [inicio, fin] con su terapeuta ya cargado."""
+    return (BloqueoHorario.query
+            .options(joinedload(BloqueoHorario.terapeuta))
+            .filter(BloqueoHorario.fecha_hora_inicio.between(inicio, fin))
+            .order_by(BloqueoHorario.fecha_hora_inicio)
+            .all())
+
+
+def eventos_en_rango(inicio, fin):
+    """Citas y bloqueos del rango en una sola lista ordenada por hora de inicio (2 consultas)."""
+    return sorted(citas_en_rango(inicio, fin) + bloqueos_en_rango(inicio, fin), key=lambda e: e.fecha_hora_inicio)
+
+
+def disponibilidades_por_terapeuta(fecha):
+    """Agrupa por terapeuta todas las disponibilidades de una fecha (1 consulta)."""
+    por_terapeuta = defaultdict(list)
+    for d in Disponibilidad.query.filter_by(fecha=fecha).order_by(Disponibilidad.hora_inicio).all():
+        por_terapeuta[d.terapeuta_id].append(d)
+    return por_terapeuta
+
+
+def horarios_por_terapeuta(fecha):
+    """{terapeuta_id: Intervalos} con la disponibilidad fusionada de una fecha (1 consulta)."""
+    return {tid: Intervalos.de_disponibilidades(lista) for tid, lista in disponibilidades_por_terapeuta(fecha).items()}
+
+
+def horarios_en_rango(desde, hasta):
+    """{fecha: {terapeuta_id: Intervalos}} para las fechas en [desde, hasta) (1 consulta)."""
+    por_fecha = defaultdict(lambda: defaultdict(list))
+    consulta = (Disponibilidad.query.filter(Disponibilidad.fecha >= desde, Disponibilidad.fecha < hasta)
+                .order_by(Disponibilidad.fecha, Disponibilidad.hora_inicio))
+    for d in consulta.all():
+        por_fecha[d.fecha][d.terapeuta_id].append(d)
+    return {fecha: {tid: Intervalos.de_disponibilidades(lista) for tid, lista in por_terapeuta.items()}
+            for fecha, por_terapeuta in por_fecha.items()}
+
+
+def rango_de_vista(vista, fecha_dt):
+    """(inicio, fin) que muestra cada vista: el día, la semana de lunes a domingo, o las
+    semanas completas que cubren el mes."""
+    inicio = fecha_dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if vista == 'mes':
+        primero = inicio.replace(day=1)
+        siguiente = (primero + timedelta(days=32)).replace(day=1)
+        inicio = primero - timedelta(days=primero.weekday())
+        return inicio, siguiente + timedelta(days=(7 - siguiente.weekday()) % 7)
+    if vista == 'semana':
+        inicio -= timedelta(days=inicio.weekday())
+        return inicio, inicio + timedelta(days=7)
+    return inicio, inicio + timedelta(days=1)
+
+
+def dias_de_rango(inicio, fin):
+    return [(inicio + timedelta(days=i)).date() for i in range((fin - inicio).days)]
+
+
+CAMPOS_EVENTO = ['tipo', 'id', 'terapeuta_id', 'inicio', 'fin', 'titulo', 'tratamiento', 'gabinete', 'estado']
+
+
+def evento_compacto(evento):
+    """Lista con los valores de CAMPOS_EVENTO, para las respuestas JSON de la agenda."""
+    inicio, fin = evento.fecha_hora_inicio.isoformat(timespec='minutes'), evento.fecha_hora_fin.isoformat(timespec='minutes')
+    if isinstance(evento, Cita):
+        return ['cita', evento.id, evento.terapeuta_id, inicio, fin, evento.cliente.nombre,
+                evento.tratamiento.nombre, evento.gabinete.nombre, evento.estado]
+    return ['bloqueo', evento.id, evento.terapeuta_id, inicio, fin, evento.titulo, None, None, None]
@@ -0,0 +1,84 @@
+# =================================================================
+# ANALÍTICA: AGREGACIONES EN SQL
+# =================================================================
+# Conteos e ingresos calculados con GROUP BY en la base de datos, en
+# lugar de cargar cada Cita y recorrerla en Python. Los ingresos se
+# cuentan sólo para citas 'Finalizada', con el precio del tratamiento.
+# Los totales por día/terapeuta/gabinete/tratamiento/estado se leen de
+# ResumenDiario (ver app/resumen.py); los rangos son de días completos.
+from collections import namedtuple
+
+from sqlalchemy import select, func, case
+
+from app import db
+from app.archivo import fuente_citas
+from app.models import Cliente, Tratamiento, Terapeuta, Gabinete, ResumenDiario
+
+FilaIngresos = namedtuple('FilaIngresos', ['etiqueta', 'citas', 'finalizadas', 'ingresos'])
+ValorCliente = namedtuple('ValorCliente', ['cliente_id', 'nombre', 'citas_finalizadas', 'total_gastado'])
+
+DIMENSIONES = {'terapeuta': Terapeuta, 'tratamiento': Tratamiento, 'gabinete': Gabinete, 'dia': None}
+
+
+def _finalizadas_e_ingresos(cita):
+    es_finalizada = cita.estado == 'Finalizada'
+    return (func.coalesce(func.sum(case((es_finalizada, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((es_finalizada, func.coalesce(Tratamiento.precio, 0)), else_=0)), 0))
+
+
+def _en_rango(consulta, cita, inicio, fin):
+    if inicio is not None:
+        consulta = consulta.where(cita.fecha_hora_inicio >= inicio)
+    if fin is not None:
+        consulta = consulta.where(cita.fecha_hora_inicio < fin)
+    return consulta
+
+
+def _dias_en_rango(consulta, inicio, fin):
+    return consulta.where(ResumenDiario.fecha >= inicio.date(), ResumenDiario.fecha < fin.date())
+
+
+def resumen_estados(inicio, fin):
+    """Cantidad de citas por estado entre los días [inicio, fin): {'Agendada': 3, 'Finalizada': 5, ...}."""
+    consulta = _dias_en_rango(select(ResumenDiario.estado, func.sum(ResumenDiario.cantidad)), inicio, fin)
+    return {estado: int(cantidad) for estado, cantidad in db.session.execute(consulta.group_by(ResumenDiario.estado))}
+
+
+def ingresos_por(dimension, inicio, fin):
+    """Citas, finalizadas e ingresos agrupados por terapeuta, tratamiento, gabinete o día."""
+    modelo = DIMENSIONES[dimension]
+    finalizada = ResumenDiario.estado == 'Finalizada'
+    ingresos = func.sum(case((finalizada, ResumenDiario.ingresos), else_=0))
+    if modelo is None:
+        etiqueta = ResumenDiario.fecha
+        agrupar = [etiqueta]
+    else:
+        etiqueta = modelo.nombre
+        agrupar = [modelo.id, modelo.nombre]
+    consulta = select(etiqueta, func.sum(ResumenDiario.cantidad), func.sum(case((finalizada, ResumenDiario.cantidad), else_=0)), ingresos)
+    if modelo is not None:
+        consulta = consulta.join(modelo, getattr(ResumenDiario, f'{dimension}_id') == modelo.id)
+    consulta = _dias_en_rango(consulta, inicio, fin).group_by(*agrupar).order_by(etiqueta if modelo is None else ingresos.desc())
+    return [FilaIngresos(str(e), int(c), int(f), float(i)) for e, c, f, i in db.session.execute(consulta)]
+
+
+def valor_cliente(cliente_id):
+    """(citas_finalizadas, total_gastado) de un cliente en todo su historial."""
+    cita = fuente_citas()
+    finalizadas, ingresos = _finalizadas_e_ingresos(cita)
+    consulta = (select(finalizadas, ingresos)
+                .join(Tratamiento, cita.tratamiento_id == Tratamiento.id)
+                .where(cita.cliente_id == cliente_id))
+    finalizadas, total = db.session.execute(consulta).one()
+    return int(finalizadas), float(total)
+
+
+def clientes_mas_valiosos(inicio=None, fin=None, limite=10):
+    """Clientes ordenados por lo gastado (valor de vida si no se indica rango)."""
+    cita = fuente_citas(inicio)
+    finalizadas, ingresos = _finalizadas_e_ingresos(cita)
+    consulta = (select(Cliente.id, Cliente.nombre, finalizadas, ingresos)
+                .join(cita, cita.cliente_id == Cliente.id)
+                .join(Tratamiento, cita.tratamiento_id == Tratamiento.id))
+    consulta = _en_rango(consulta, cita, inicio, fin).group_by(Cliente.id, Cliente.nombre).order_by(ingresos.desc()).limit(limite)
+    return [ValorCliente(i, n, int(f), float(t)) for i, n, f, t in db.session.execute(consulta)]
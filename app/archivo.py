@@ -0,0 +1,133 @@
+# =================================================================
+# ARCHIVO DE CITAS HISTÓRICAS
+# =================================================================
+# Las citas finalizadas o canceladas de hace más de DIAS_CALIENTES días
+# se mueven de la tabla cita a cita_historica con `flask archivar-citas`.
+# Así la tabla que consultan en cada reserva los conflictos, los huecos
+# y los itinerarios (que sólo miran hacia adelante) queda chica.
+#
+# Quien necesita el historial completo (detalle del cliente, reportes,
+# analítica, resumen) o un rango que puede ser viejo (agenda, calendario)
+# pide la tabla con fuente_citas(desde): si el rango empieza dentro de
+# la ventana caliente es Cita tal cual; si no, un alias de Cita sobre
+# UNION ALL de las dos tablas, con las mismas columnas y relaciones.
+# Las citas archivadas son de sólo lectura: es_archivada() las distingue
+# en la consulta para que la agenda no muestre Editar/Eliminar, y las
+# rutas de edición dan 404 porque sólo buscan en cita.
+#
+# Los ids no pueden repetirse entre las dos tablas: en SQLite la tabla
+# cita usa AUTOINCREMENT (asegurar_ids_crecientes migra una base vieja
+# desde `flask init-db`); en PostgreSQL la secuencia nunca retrocede.
+#
+# El movimiento se hace con INSERT .. SELECT y DELETE, sin pasar por el
+# ORM, así que ResumenDiario no cambia (las citas siguen existiendo) y
+# las versiones de los días movidos se incrementan a mano.
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, insert, delete, union_all, exists, func, inspect, literal, text
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.cambios_agenda import clave_dia
+from app.models import Cita, CitaHistorica, EventoAgenda
+from app.versiones import incrementar
+
+ESTADOS_ARCHIVABLES = ('Finalizada', 'Cancelada')
+DIAS_CALIENTES = 90
+
+_COLUMNAS = [columna.name for columna in Cita.__table__.columns]
+
+
+def limite_caliente():
+    """Inicio de la ventana caliente: lo anterior puede estar archivado."""
+    hoy = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return hoy - timedelta(days=DIAS_CALIENTES)
+
+
+def fuente_citas(desde=None):
+    """Cita, o un alias de Cita sobre cita + cita_historica si `desde` (None = todo el historial)
+    cae antes de la ventana caliente."""
+    if desde is not None and desde >= limite_caliente():
+        return Cita
+    todas = union_all(select(*(Cita.__table__.c[n] for n in _COLUMNAS), literal(False).label('archivada')),
+                      select(*(CitaHistorica.__table__.c[n] for n in _COLUMNAS), literal(True).label('archivada'))
+                      ).subquery('cita_todas')
+    return aliased(Cita, todas, name='cita_todas')
+
+
+def es_archivada(cita):
+    """Columna que indica si cada fila de `cita` (lo devuelto por fuente_citas) viene de cita_historica."""
+    if cita is Cita:
+        return literal(False)
+    return inspect(cita).selectable.c.archivada
+
+
+def _tiene_autoincrement(conexion):
+    sql = conexion.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'cita'")).scalar()
+    return sql is not None and 'AUTOINCREMENT' in sql.upper()
+
+
+def asegurar_ids_crecientes():
+    """En SQLite, rehace la tabla cita con AUTOINCREMENT si todavía no lo tiene y deja su secuencia por
+    encima de todo id ya usado (en cita, cita_historica o evento_agenda). Devuelve True si la migró."""
+    conexion = db.session.connection()
+    if conexion.dialect.name != 'sqlite':
+        return False
+    migrada = False
+    if not _tiene_autoincrement(conexion):
+        columnas = ', '.join(_COLUMNAS)
+        conexion.execute(text('ALTER TABLE cita RENAME TO cita_sin_autoincrement'))
+        for indice in Cita.__table__.indexes:
+            conexion.execute(text(f'DROP INDEX IF EXISTS {indice.name}'))
+        Cita.__table__.create(conexion)
+        conexion.execute(text(f'INSERT INTO cita ({columnas}) SELECT {columnas} FROM cita_sin_autoincrement'))
+        conexion.execute(text('DROP TABLE cita_sin_autoincrement'))
+        migrada = True
+    usados = [conexion.execute(select(func.max(columna))).scalar() or 0
+              for columna in (Cita.id, CitaHistorica.id, EventoAgenda.cita_id)]
+    secuencia = conexion.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'cita'")).scalar() or 0
+    if max(usados) > secuencia:
+        conexion.execute(text("DELETE FROM sqlite_sequence WHERE name = 'cita'"))
+        conexion.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('cita', :seq)"), {'seq': max(usados)})
+    db.session.commit()
+    return migrada
+
+
+def hay_historicas(**filtros):
+    """True si hay citas archivadas con esos valores (p. ej. cliente_id=3)."""
+    condiciones = [getattr(CitaHistorica, campo) == valor for campo, valor in filtros.items()]
+    return db.session.query(exists().where(*condiciones)).scalar()
+
+
+def _meses(desde, hasta):
+    inicio = desde.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while inicio < hasta:
+        siguiente = (inicio + timedelta(days=32)).replace(day=1)
+        yield inicio, min(siguiente, hasta)
+        inicio = siguiente
+
+
+def archivar(antes_de):
+    """Mueve a cita_historica las citas finalizadas o canceladas que empiezan antes de
+    `antes_de`, un mes por transacción. Devuelve la cantidad de citas movidas."""
+    if antes_de > limite_caliente():
+        raise ValueError(f'Sólo se archivan citas anteriores a los últimos {DIAS_CALIENTES} días.')
+    conexion = db.session.connection()
+    if conexion.dialect.name == 'sqlite' and not _tiene_autoincrement(conexion):
+        raise ValueError('La tabla cita todavía reutiliza ids: correr `flask init-db` antes de archivar.')
+    primera = db.session.execute(select(Cita.fecha_hora_inicio).where(Cita.estado.in_(ESTADOS_ARCHIVABLES))
+                                 .order_by(Cita.fecha_hora_inicio).limit(1)).scalar()
+    total = 0
+    if primera is None:
+        return total
+    for inicio, fin in _meses(primera, antes_de):
+        condicion = (Cita.estado.in_(ESTADOS_ARCHIVABLES), Cita.fecha_hora_inicio >= inicio, Cita.fecha_hora_inicio < fin)
+        conexion = db.session.connection()
+        dias = {f.date() for f in conexion.execute(select(Cita.fecha_hora_inicio).where(*condicion)).scalars()}
+        if dias:
+            conexion.execute(insert(CitaHistorica.__table__).from_select(
+                _COLUMNAS, select(*(Cita.__table__.c[n] for n in _COLUMNAS)).where(*condicion)))
+            total += conexion.execute(delete(Cita.__table__).where(*condicion)).rowcount
+            incrementar(conexion, [clave_dia(dia) for dia in dias])
+        db.session.commit()
+    return total
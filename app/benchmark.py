@@ -0,0 +1,458 @@
+# =================================================================
+# BENCHMARK DE RUTAS
+# =================================================================
+# Recorre las rutas principales con el cliente de pruebas de Flask sobre
+# la base configurada (idealmente llena con `flask generar-datos`) y mide,
+# por escenario: latencia (mín., p50, p95, máx.), consultas SQL por
+# petición y pico de memoria de Python (tracemalloc, en una pasada aparte
+# para no distorsionar las latencias). El resultado se guarda en JSON y
+# puede compararse con una corrida anterior (comando `flask benchmark`).
+#
+# Además, consultas_agenda_temporal() arma una base temporal con pocas
+# citas, cuenta las consultas de cada vista de la agenda sin caché,
+# agrega muchas más citas en los mismos días y vuelve a contar: la
+# cantidad no debe crecer con las citas (si crece, `flask benchmark`
+# termina con error). Corre con en_base_temporal(), descrita abajo.
+#
+# concurrencia_sqlite() mide aparte el rendimiento de SQLite con varios
+# hilos leyendo y escribiendo, con y sin el perfil de app/motor.py
+# (comando `flask benchmark-concurrencia`).
+#
+# doble_reserva() es la prueba de estrés de app/reservas.py: varios hilos
+# reservan a la vez los mismos terapeutas y gabinetes en un día libre y al
+# final cuenta las citas superpuestas, que deben ser cero (comandos
+# `flask doble-reserva` y `flask benchmark-concurrencia`). Como crea y
+# borra citas, corre con en_base_temporal(): otro proceso de `flask` con
+# DATABASE_URL apuntando a un SQLite temporal con datos sintéticos.
+import json
+import os
+import platform
+import random
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, event, func, text, and_, or_, delete
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import aliased
+
+from app import app, db
+from app.models import Recepcionista, Cliente, Cita, Disponibilidad, BloqueoHorario
+from app.catalogos import catalogos
+from app.cambios_agenda import clave_dia
+from app.huecos import buscar_huecos, HORIZONTE_MAXIMO
+from app.versiones import incrementar
+from app.reservas import reservar_cita
+from app import fragmentos, motor
+
+RUN_PY = os.path.join(os.path.dirname(app.root_path), 'run.py')
+TOLERANCIA = 0.2
+FILAS_CARGA_MASIVA = 10000
+
+
+class _ContadorConsultas:
+    def __init__(self):
+        self.total = 0
+
+    def __call__(self, *args):
+        self.total += 1
+
+
+def _fecha_con_mas_citas():
+    fila = (db.session.query(func.date(Cita.fecha_hora_inicio), func.count())
+            .group_by(func.date(Cita.fecha_hora_inicio)).order_by(func.count().desc()).first())
+    return datetime.strptime(str(fila[0]), '%Y-%m-%d').date() if fila else date.today()
+
+
+def _escenarios(cliente_web):
+    """Lista de (nombre, función que hace una petición y devuelve la respuesta, función de limpieza o None)."""
+    dia = _fecha_con_mas_citas()
+    fecha, mes = dia.isoformat(), (dia - timedelta(days=30)).isoformat()
+    trimestre = (dia - timedelta(days=90)).isoformat()
+    escenarios = [
+        ('agenda_grilla_diaria', lambda: cliente_web.get(f'/agenda?fecha={fecha}&vista=grilla_diaria'), None),
+        ('agenda_vista_columnas', lambda: cliente_web.get(f'/agenda?fecha={fecha}&vista=vista_columnas'), None),
+        ('agenda_semana', lambda: cliente_web.get(f'/agenda?fecha={fecha}&vista=semana'), None),
+        ('agenda_mes', lambda: cliente_web.get(f'/agenda?fecha={fecha}&vista=mes'), None),
+        ('dashboard', lambda: cliente_web.get('/dashboard'), None),
+        ('reporte_excel', lambda: cliente_web.post('/reportes', data={'fecha_inicio': mes, 'fecha_fin': fecha, 'formato': 'excel'}), None),
+        ('reporte_csv', lambda: cliente_web.post('/reportes', data={'fecha_inicio': mes, 'fecha_fin': fecha, 'formato': 'csv'}), None),
+        ('ocupacion_trimestre', lambda: cliente_web.get(f'/analitica/ocupacion?fecha_inicio={trimestre}&fecha_fin={fecha}'), None),
+    ]
+
+    # El cliente con más citas es el peor caso para la ficha del cliente.
+    fila = db.session.query(Cita.cliente_id, func.count()).group_by(Cita.cliente_id).order_by(func.count().desc()).first()
+    cliente = db.session.get(Cliente, fila[0]) if fila else Cliente.query.first()
+    if cliente:
+        busqueda = cliente.nombre.split()[0][:4]
+        escenarios += [('buscar_clientes', lambda: cliente_web.get(f'/clientes?q={busqueda}'), None),
+                       ('detalle_cliente', lambda: cliente_web.get(f'/cliente/{cliente.id}'), None)]
+
+    catalogo = catalogos()
+    hoy = date.today()
+    if catalogo.tratamientos:
+        # Búsqueda por defecto (dos semanas) y el peor caso: el tratamiento más largo en todo el
+        # horizonte permitido, con el límite máximo de resultados.
+        largo = max(catalogo.tratamientos, key=lambda t: t.duracion)
+        hasta_huecos = (hoy + timedelta(days=HORIZONTE_MAXIMO - 1)).isoformat()
+        escenarios += [
+            ('huecos_dos_semanas', lambda: cliente_web.get(f'/api/huecos?tratamiento_id={catalogo.tratamientos[0].id}'), None),
+            ('huecos_horizonte_maximo', lambda: cliente_web.get(f'/api/huecos?tratamiento_id={largo.id}&desde={hoy.isoformat()}'
+                                                                f'&hasta={hasta_huecos}&limite=50'), None),
+        ]
+    huecos = (buscar_huecos(catalogo.tratamientos[0].duracion, catalogo.terapeutas, catalogo.gabinetes, hoy,
+                            hoy + timedelta(days=13), limite=1) if catalogo.tratamientos else [])
+    if cliente and huecos:
+        # Cada repetición agenda en el mismo hueco libre y la limpieza borra la cita creada por la
+        # misma ruta que la agenda, que publica el evento 'eliminada' para los canales abiertos.
+        h = huecos[0]
+        datos_cita = {'terapeuta_id': h.terapeuta.id, 'gabinete_id': h.gabinete.id,
+                      'tratamiento_id': catalogo.tratamientos[0].id, 'cliente_id': cliente.id,
+                      'fecha': h.inicio.strftime('%Y-%m-%d'), 'hora': h.inicio.strftime('%H:%M')}
+
+        def nueva_cita():
+            return cliente_web.post('/citas/nueva', data=datos_cita)
+
+        ultimo_id = db.session.query(func.max(Cita.id)).scalar() or 0
+
+        def borrar_creadas():
+            for (cita_id,) in db.session.query(Cita.id).filter(Cita.id > ultimo_id).all():
+                cliente_web.post(f'/citas/eliminar/{cita_id}').close()
+
+        escenarios.append(('nueva_cita', nueva_cita, borrar_creadas))
+
+    if catalogo.terapeutas:
+        # Unas FILAS_CARGA_MASIVA disponibilidades (todos los terapeutas, todos los días) en fechas
+        # posteriores a las cargadas; la limpieza las borra con un DELETE, como las inserta la carga.
+        dias = -(-FILAS_CARGA_MASIVA // len(catalogo.terapeutas))
+        desde = (db.session.query(func.max(Disponibilidad.fecha)).scalar() or hoy) + timedelta(days=1)
+        hasta = desde + timedelta(days=dias - 1)
+        datos_carga = {'tipo': 'disponibilidad', 'form_type': 'patron',
+                       'terapeuta_ids': [t.id for t in catalogo.terapeutas], 'dias_semana': list(range(7)),
+                       'desde': desde.isoformat(), 'hasta': hasta.isoformat(), 'hora_inicio': '09:00', 'hora_fin': '18:00'}
+
+        def carga_masiva():
+            return cliente_web.post('/configuracion/horarios/carga_masiva', data=datos_carga)
+
+        def borrar_carga():
+            conexion = db.session.connection()
+            conexion.execute(delete(Disponibilidad.__table__).where(Disponibilidad.fecha.between(desde, hasta)))
+            incrementar(conexion, [clave_dia(desde + timedelta(days=i)) for i in range(dias)])
+            db.session.commit()
+
+        escenarios.append(('carga_masiva_10k', carga_masiva, borrar_carga))
+    return escenarios
+
+
+def _medir(escenario, repeticiones):
+    nombre, peticion, limpiar = escenario
+    contador = _ContadorConsultas()
+    latencias, consultas, estados = [], [], set()
+    event.listen(Engine, 'before_cursor_execute', contador)
+    try:
+        for _ in range(repeticiones):
+            contador.total = 0
+            inicio = time.perf_counter()
+            respuesta = peticion()
+            respuesta.get_data()
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            consultas.append(contador.total)
+            estados.add(respuesta.status_code)
+            respuesta.close()
+            if limpiar:
+                limpiar()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', contador)
+
+    tracemalloc.start()
+    try:
+        peticion().get_data()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    if limpiar:
+        limpiar()
+
+    latencias.sort()
+    return {
+        'latencia_ms': {'min': round(latencias[0], 2), 'p50': round(statistics.median(latencias), 2),
+                        'p95': round(latencias[min(len(latencias) - 1, int(0.95 * len(latencias)))], 2),
+                        'max': round(latencias[-1], 2)},
+        'consultas': max(consultas),
+        'memoria_pico_kb': round(pico / 1024, 1),
+        'estados_http': sorted(estados),
+    }
+
+
+def consultas_agenda(cliente_web):
+    """Consultas de cada vista de la agenda, renderizada sin caché, en el día con más citas:
+    {vista: {'fecha', 'citas_del_dia', 'consultas'}}."""
+    dia = _fecha_con_mas_citas()
+    citas = db.session.query(func.count(Cita.id)).filter(func.date(Cita.fecha_hora_inicio) == dia.isoformat()).scalar()
+    contador = _ContadorConsultas()
+    resultado = {}
+    # Sin backend de fragmentos cada petición vuelve a consultar y renderizar la vista.
+    backend_anterior, fragmentos._backend = fragmentos._backend, False
+    event.listen(Engine, 'before_cursor_execute', contador)
+    try:
+        for vista in ('grilla_diaria', 'vista_columnas', 'semana', 'mes'):
+            contador.total = 0
+            cliente_web.get(f'/agenda?fecha={dia.isoformat()}&vista={vista}').close()
+            resultado[vista] = {'fecha': dia.isoformat(), 'citas_del_dia': citas, 'consultas': contador.total}
+    finally:
+        event.remove(Engine, 'before_cursor_execute', contador)
+        fragmentos._backend = backend_anterior
+    return resultado
+
+
+def consultas_que_crecen(resultado):
+    """Vistas de la agenda que hacen más consultas con muchas citas que con pocas."""
+    pocas, muchas = resultado['consultas_agenda']['pocas_citas'], resultado['consultas_agenda']['muchas_citas']
+    return [f"{vista}: {pocas[vista]['consultas']} consultas con {pocas[vista]['citas_del_dia']} citas, "
+            f"{muchas[vista]['consultas']} con {muchas[vista]['citas_del_dia']}"
+            for vista in pocas if muchas[vista]['consultas'] > pocas[vista]['consultas']]
+
+
+def cliente_autenticado(usuario=None):
+    """Cliente de pruebas de Flask con la sesión iniciada como `usuario` (por defecto, el primer administrador)."""
+    admin = (Recepcionista.query.filter_by(username=usuario).first() if usuario
+             else Recepcionista.query.filter_by(is_admin=True).first())
+    if admin is None:
+        raise ValueError('No hay un usuario administrador para autenticar el benchmark.')
+    cliente_web = app.test_client()
+    with cliente_web.session_transaction() as sesion:
+        sesion['_user_id'] = str(admin.id)
+        sesion['_fresh'] = True
+    return cliente_web
+
+
+def ejecutar(repeticiones=10, usuario=None, informar=print):
+    """Corre todos los escenarios y devuelve el resultado como dict serializable a JSON."""
+    cliente_web = cliente_autenticado(usuario)
+    resultado = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'motor': db.engine.dialect.name,
+        'python': platform.python_version(),
+        'repeticiones': repeticiones,
+        'volumen': {'citas': Cita.query.count(), 'clientes': Cliente.query.count(),
+                    'disponibilidades': Disponibilidad.query.count(), 'bloqueos': BloqueoHorario.query.count()},
+        'escenarios': {},
+    }
+    for escenario in _escenarios(cliente_web):
+        medicion = _medir(escenario, repeticiones)
+        resultado['escenarios'][escenario[0]] = medicion
+        informar(f"{escenario[0]:<24} p50 {medicion['latencia_ms']['p50']:>9.1f} ms  "
+                 f"p95 {medicion['latencia_ms']['p95']:>9.1f} ms  {medicion['consultas']:>4} consultas  "
+                 f"{medicion['memoria_pico_kb']:>9.1f} KB")
+    return resultado
+
+
+def comparar(anterior, actual, tolerancia=TOLERANCIA):
+    """Lista de regresiones: escenarios cuyo p50, consultas o memoria crecieron más que la tolerancia."""
+    regresiones = []
+    for nombre, medicion in actual['escenarios'].items():
+        previa = anterior.get('escenarios', {}).get(nombre)
+        if not previa:
+            continue
+        for etiqueta, antes, ahora in (('p50 (ms)', previa['latencia_ms']['p50'], medicion['latencia_ms']['p50']),
+                                       ('consultas', previa['consultas'], medicion['consultas']),
+                                       ('memoria (KB)', previa['memoria_pico_kb'], medicion['memoria_pico_kb'])):
+            if antes and ahora > antes * (1 + tolerancia):
+                regresiones.append(f'{nombre}: {etiqueta} {antes} -> {ahora}')
+    return regresiones
+
+
+def guardar(resultado, ruta):
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+
+
+def _carga_concurrente(engine, hilos, segundos, proporcion_escrituras):
+    """Hilos que leen y escriben sin pausa durante `segundos`. Devuelve (operaciones, errores)."""
+    with engine.begin() as conexion:
+        conexion.exec_driver_sql('CREATE TABLE prueba (id INTEGER PRIMARY KEY, terapeuta_id INTEGER, dato TEXT)')
+        conexion.exec_driver_sql('CREATE INDEX ix_prueba_terapeuta ON prueba (terapeuta_id)')
+    totales = {'operaciones': 0, 'errores': 0}
+    cerrojo = threading.Lock()
+    fin = time.perf_counter() + segundos
+
+    def trabajar(semilla):
+        azar = random.Random(semilla)
+        operaciones = errores = 0
+        while time.perf_counter() < fin:
+            try:
+                with engine.connect() as conexion:
+                    if azar.random() < proporcion_escrituras:
+                        conexion.exec_driver_sql('BEGIN IMMEDIATE')
+                        conexion.execute(text('INSERT INTO prueba (terapeuta_id, dato) VALUES (:t, :d)'),
+                                         {'t': azar.randrange(30), 'd': 'x' * 200})
+                        conexion.commit()
+                    else:
+                        conexion.execute(text('SELECT count(*), max(id) FROM prueba WHERE terapeuta_id = :t'),
+                                         {'t': azar.randrange(30)}).all()
+                operaciones += 1
+            except Exception:
+                errores += 1
+        with cerrojo:
+            totales['operaciones'] += operaciones
+            totales['errores'] += errores
+
+    trabajadores = [threading.Thread(target=trabajar, args=(i,)) for i in range(hilos)]
+    for t in trabajadores:
+        t.start()
+    for t in trabajadores:
+        t.join()
+    return totales['operaciones'], totales['errores']
+
+
+def concurrencia_sqlite(hilos=8, segundos=5, proporcion_escrituras=0.25, informar=print):
+    """Compara operaciones por segundo en un archivo SQLite temporal con las opciones
+    por defecto de SQLAlchemy y con el perfil de app/motor.py."""
+    resultado = {'hilos': hilos, 'segundos': segundos, 'proporcion_escrituras': proporcion_escrituras, 'modos': {}}
+    with tempfile.TemporaryDirectory() as carpeta:
+        for modo in ('por_defecto', 'perfil'):
+            uri = 'sqlite:///' + os.path.join(carpeta, f'{modo}.db')
+            opciones = motor.opciones_motor(uri) if modo == 'perfil' else {}
+            engine = create_engine(uri, pool_size=hilos, **opciones)
+            if modo == 'perfil':
+                event.listen(engine, 'connect', motor._pragmas_sqlite)
+            try:
+                operaciones, errores = _carga_concurrente(engine, hilos, segundos, proporcion_escrituras)
+            finally:
+                engine.dispose()
+            resultado['modos'][modo] = {'operaciones_por_segundo': round(operaciones / segundos, 1), 'errores': errores}
+            informar(f'{modo:<12} {operaciones / segundos:>10.1f} op/s  {errores:>5} errores')
+    return resultado
+
+
+def _solapamientos(desde, hasta):
+    """Pares de citas del rango que comparten terapeuta o gabinete y se superponen."""
+    otra = aliased(Cita)
+    return (db.session.query(func.count()).select_from(Cita)
+            .join(otra, and_(Cita.id < otra.id,
+                             or_(Cita.terapeuta_id == otra.terapeuta_id, Cita.gabinete_id == otra.gabinete_id),
+                             Cita.fecha_hora_inicio < otra.fecha_hora_fin, otra.fecha_hora_inicio < Cita.fecha_hora_fin))
+            .filter(Cita.fecha_hora_inicio >= desde, Cita.fecha_hora_inicio < hasta,
+                    otra.fecha_hora_inicio >= desde, otra.fecha_hora_inicio < hasta).scalar())
+
+
+def doble_reserva(hilos=8, intentos=25, informar=print):
+    """Varios hilos reservan con reservar_cita() horarios superpuestos de dos terapeutas y dos
+    gabinetes en un día sin datos; devuelve los totales y cuántas citas quedaron superpuestas.
+    Al terminar borra las citas y disponibilidades que creó."""
+    catalogo = catalogos()
+    terapeutas = [t.id for t in catalogo.terapeutas[:2]]
+    gabinetes = [g.id for g in catalogo.gabinetes[:2]]
+    clientes = [c.id for c in Cliente.query.order_by(Cliente.id).limit(hilos)]
+    if not (terapeutas and gabinetes and clientes and catalogo.tratamientos):
+        raise ValueError('Hacen falta terapeutas, gabinetes, tratamientos y clientes (ver `flask generar-datos`).')
+    tratamiento = catalogo.tratamientos[0].id
+
+    # Un día posterior a todo lo cargado: las citas que haya ahí al final son de la prueba.
+    ultimo = max([db.session.query(func.max(Cita.fecha_hora_inicio)).scalar() or datetime.now(),
+                  datetime.combine(db.session.query(func.max(Disponibilidad.fecha)).scalar() or date.today(), datetime.min.time()),
+                  db.session.query(func.max(BloqueoHorario.fecha_hora_fin)).scalar() or datetime.now()])
+    desde = datetime.combine(ultimo.date() + timedelta(days=1), datetime.min.time())
+    hasta = desde + timedelta(days=1)
+    disponibilidades = [Disponibilidad(terapeuta_id=t, fecha=desde.date(), hora_inicio=datetime.min.time(),
+                                       hora_fin=datetime.max.time().replace(microsecond=0)) for t in terapeutas]
+    db.session.add_all(disponibilidades)
+    db.session.commit()
+
+    totales = {'reservadas': 0, 'rechazadas': 0, 'errores': 0}
+    cerrojo = threading.Lock()
+    largada = threading.Barrier(hilos)
+
+    def reservar(numero):
+        azar = random.Random(numero)
+        cuenta = dict.fromkeys(totales, 0)
+        with app.app_context():
+            largada.wait()
+            for _ in range(intentos):
+                # Citas de una hora que empiezan cada 15 minutos entre las 9 y las 12.
+                inicio = desde + timedelta(hours=9, minutes=15 * azar.randrange(13))
+                try:
+                    cita, _ = reservar_cita(azar.choice(terapeutas), azar.choice(gabinetes), clientes[numero % len(clientes)],
+                                            tratamiento, inicio, inicio + timedelta(hours=1))
+                    cuenta['reservadas' if cita is not None else 'rechazadas'] += 1
+                except OperationalError:
+                    db.session.rollback()
+                    cuenta['errores'] += 1
+            db.session.remove()
+        with cerrojo:
+            for clave, valor in cuenta.items():
+                totales[clave] += valor
+
+    trabajadores = [threading.Thread(target=reservar, args=(i,)) for i in range(hilos)]
+    inicio = time.perf_counter()
+    for t in trabajadores:
+        t.start()
+    for t in trabajadores:
+        t.join()
+    segundos = time.perf_counter() - inicio
+
+    resultado = dict(totales, hilos=hilos, intentos=hilos * intentos, segundos=round(segundos, 2),
+                     solapamientos=_solapamientos(desde, hasta))
+    # Se borra con el ORM para que ResumenDiario descuente las citas.
+    for cita in Cita.query.filter(Cita.fecha_hora_inicio >= desde, Cita.fecha_hora_inicio < hasta).all():
+        db.session.delete(cita)
+    for disponibilidad in disponibilidades:
+        db.session.delete(disponibilidad)
+    db.session.commit()
+    informar(f"doble reserva  {resultado['intentos']} intentos en {resultado['segundos']} s: "
+             f"{resultado['reservadas']} reservadas, {resultado['rechazadas']} rechazadas por conflicto, "
+             f"{resultado['errores']} errores, {resultado['solapamientos']} solapamientos")
+    return resultado
+
+
+def en_base_temporal(*comandos, **variables):
+    """Corre en orden los comandos `flask` dados (listas de argumentos), cada uno en otro proceso y
+    sobre un SQLite temporal que se borra al terminar, así no tocan la base configurada ni los cachés
+    de este proceso. `variables` se agregan al entorno. Devuelve la salida de cada comando; si uno
+    falla lanza RuntimeError."""
+    with tempfile.TemporaryDirectory() as carpeta:
+        entorno = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(carpeta, 'benchmark.db'), AGENDA_CACHE='ninguno',
+                       **variables)
+        salidas = []
+        for argumentos in comandos:
+            proceso = subprocess.run([sys.executable, '-m', 'flask', '--app', RUN_PY, *argumentos], env=entorno,
+                                     cwd=os.path.dirname(RUN_PY), capture_output=True, text=True)
+            if proceso.returncode != 0:
+                raise RuntimeError(f"`flask {' '.join(argumentos)}` terminó con error:\n{proceso.stdout}{proceso.stderr}")
+            salidas.append(proceso.stdout)
+        return salidas
+
+
+def doble_reserva_temporal(hilos=8, intentos=25):
+    """Corre `flask doble-reserva` sobre una base temporal con datos sintéticos; devuelve su salida."""
+    return en_base_temporal(
+        ['init-db'],
+        ['generar-datos', '--terapeutas', '4', '--gabinetes', '3', '--tratamientos', '3', '--clientes', str(hilos), '--dias', '7'],
+        ['doble-reserva', '--en-esta-base', '--hilos', str(hilos), '--intentos', str(intentos)],
+    )[-1]
+
+
+def consultas_agenda_temporal(informar=print):
+    """consultas_agenda() en una base temporal, primero con pocas citas y después con muchas más en
+    los mismos días: {'pocas_citas': {...}, 'muchas_citas': {...}}."""
+    generar = ['generar-datos', '--terapeutas', '6', '--gabinetes', '4', '--tratamientos', '6', '--clientes', '200',
+               '--dias', '14']
+    salidas = en_base_temporal(
+        ['init-db'], ['crear-admin-inicial'],
+        generar + ['--ocupacion', '0.15'], ['consultas-agenda'],
+        generar + ['--ocupacion', '0.9', '--semilla', '7'], ['consultas-agenda'],
+        DEFAULT_ADMIN_USER='benchmark', DEFAULT_ADMIN_PASS=secrets.token_hex(8),
+    )
+    resultado = {'pocas_citas': json.loads(salidas[3]), 'muchas_citas': json.loads(salidas[5])}
+    for vista, pocas in resultado['pocas_citas'].items():
+        muchas = resultado['muchas_citas'][vista]
+        informar(f"consultas {vista:<14} {pocas['consultas']:>4} ({pocas['citas_del_dia']} citas)  "
+                 f"{muchas['consultas']:>4} ({muchas['citas_del_dia']} citas)")
+    return resultado
@@ -0,0 +1,136 @@
+# =================================================================
+# BÚSQUEDA DE CLIENTES
+# =================================================================
+# Cada Cliente guarda su nombre normalizado (minúsculas, sin acentos) y
+# su teléfono sólo con dígitos. Sobre esas columnas:
+#   - PostgreSQL: índices GIN con pg_trgm, que aceleran LIKE '%texto%'.
+#   - SQLite: tabla virtual FTS5 con tokenizador trigram (cliente_fts),
+#     sincronizada con triggers.
+# Las búsquedas de menos de 3 caracteres (que los trigramas no cubren)
+# siguen buscando el texto en cualquier parte, con LIKE '%texto%'.
+import re
+import sqlite3
+import unicodedata
+
+from sqlalchemy import event, inspect, text, column, or_
+
+from app import db
+from app.models import Cliente
+
+LIMITE_SUGERENCIAS = 10
+_fts_disponible = None
+
+
+def normalizar(texto):
+    """Minúsculas, sin acentos y con espacios simples: 'José  Núñez' -> 'jose nunez'."""
+    if not texto:
+        return ''
+    sin_acentos = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(sin_acentos.lower().split())
+
+
+def solo_digitos(texto):
+    return re.sub(r'\D', '', texto or '')
+
+
+@event.listens_for(Cliente.nombre, 'set')
+def _al_cambiar_nombre(cliente, valor, anterior, iniciador):
+    cliente.nombre_normalizado = normalizar(valor)
+
+
+@event.listens_for(Cliente.telefono, 'set')
+def _al_cambiar_telefono(cliente, valor, anterior, iniciador):
+    cliente.telefono_digitos = solo_digitos(valor)
+
+
+def _escapar_like(valor):
+    # '%' y '_' del texto buscado son literales, no comodines de LIKE.
+    return valor.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _contiene(columna, valor):
+    return columna.like(f'%{_escapar_like(valor)}%', escape='\\')
+
+
+def _usa_fts():
+    global _fts_disponible
+    if _fts_disponible is None:
+        _fts_disponible = db.engine.dialect.name == 'sqlite' and inspect(db.engine).has_table('cliente_fts')
+    return _fts_disponible
+
+
+def _frase_fts(valor):
+    return '"' + valor.replace('"', '""') + '"'
+
+
+def buscar_clientes(q):
+    """Query de Cliente filtrada por nombre o teléfono (sin ordenar, para paginar o limitar)."""
+    nombre, digitos = normalizar(q), solo_digitos(q)
+    query = Cliente.query
+    if not nombre and not digitos:
+        return query
+    if len(nombre) >= 3 or len(digitos) >= 3:
+        if db.engine.dialect.name == 'postgresql':
+            condiciones = [_contiene(Cliente.nombre_normalizado, nombre)] if nombre else []
+            if len(digitos) >= 3:
+                condiciones.append(_contiene(Cliente.telefono_digitos, digitos))
+            return query.filter(or_(*condiciones))
+        if _usa_fts():
+            terminos = [t for t in (nombre, digitos) if len(t) >= 3]
+            ids = text('SELECT rowid FROM cliente_fts WHERE cliente_fts MATCH :expresion').bindparams(
+                expresion=' OR '.join(_frase_fts(t) for t in terminos)).columns(column('rowid'))
+            return query.filter(Cliente.id.in_(ids))
+    condiciones = [_contiene(Cliente.nombre_normalizado, nombre)] if nombre else []
+    if digitos:
+        condiciones.append(_contiene(Cliente.telefono_digitos, digitos))
+    return query.filter(or_(*condiciones))
+
+
+def sugerencias(q, limite=LIMITE_SUGERENCIAS):
+    """Los primeros `limite` clientes que coinciden con q, para el autocompletado."""
+    return buscar_clientes(q).order_by(Cliente.nombre).limit(limite).all()
+
+
+def preparar_busqueda():
+    """Agrega y rellena las columnas de búsqueda en bases existentes y crea los índices
+    de texto del motor (pg_trgm en PostgreSQL, FTS5 en SQLite). Es idempotente."""
+    global _fts_disponible
+    columnas = {c['name'] for c in inspect(db.engine).get_columns('cliente')}
+    with db.engine.begin() as conexion:
+        for nombre, tipo in (('nombre_normalizado', 'VARCHAR(100)'), ('telefono_digitos', 'VARCHAR(20)')):
+            if nombre not in columnas:
+                conexion.execute(text(f'ALTER TABLE cliente ADD COLUMN {nombre} {tipo}'))
+                conexion.execute(text(f'CREATE INDEX IF NOT EXISTS ix_cliente_{nombre} ON cliente ({nombre})'))
+        pendientes = conexion.execute(text(
+            'SELECT id, nombre, telefono FROM cliente WHERE nombre_normalizado IS NULL OR telefono_digitos IS NULL')).all()
+        if pendientes:
+            conexion.execute(text('UPDATE cliente SET nombre_normalizado = :n, telefono_digitos = :t WHERE id = :id'),
+                             [{'id': i, 'n': normalizar(n), 't': solo_digitos(t)} for i, n, t in pendientes])
+
+        if conexion.dialect.name == 'postgresql':
+            conexion.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+            conexion.execute(text('CREATE INDEX IF NOT EXISTS ix_cliente_nombre_trgm ON cliente USING gin (nombre_normalizado gin_trgm_ops)'))
+            conexion.execute(text('CREATE INDEX IF NOT EXISTS ix_cliente_telefono_trgm ON cliente USING gin (telefono_digitos gin_trgm_ops)'))
+        elif conexion.dialect.name == 'sqlite' and sqlite3.sqlite_version_info >= (3, 34):
+            # El tokenizador trigram está disponible desde SQLite 3.34.
+            existia = conexion.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'cliente_fts'")).first()
+            conexion.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS cliente_fts USING fts5("
+                "nombre_normalizado, telefono_digitos, content='cliente', content_rowid='id', tokenize='trigram')"))
+            conexion.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS cliente_fts_ai AFTER INSERT ON cliente BEGIN "
+                "INSERT INTO cliente_fts(rowid, nombre_normalizado, telefono_digitos) "
+                "VALUES (new.id, new.nombre_normalizado, new.telefono_digitos); END"))
+            conexion.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS cliente_fts_ad AFTER DELETE ON cliente BEGIN "
+                "INSERT INTO cliente_fts(cliente_fts, rowid, nombre_normalizado, telefono_digitos) "
+                "VALUES ('delete', old.id, old.nombre_normalizado, old.telefono_digitos); END"))
+            conexion.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS cliente_fts_au AFTER UPDATE ON cliente BEGIN "
+                "INSERT INTO cliente_fts(cliente_fts, rowid, nombre_normalizado, telefono_digitos) "
+                "VALUES ('delete', old.id, old.nombre_normalizado, old.telefono_digitos); "
+                "INSERT INTO cliente_fts(rowid, nombre_normalizado, telefono_digitos) "
+                "VALUES (new.id, new.nombre_normalizado, new.telefono_digitos); END"))
+            if not existia or pendientes:
+                conexion.execute(text("INSERT INTO cliente_fts(cliente_fts) VALUES ('rebuild')"))
+    _fts_disponible = None
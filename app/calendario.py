@@ -0,0 +1,118 @@
+# =================================================================
+# CALENDARIO SEMANAL Y MENSUAL
+# =================================================================
+# Las vistas de semana y mes leen sólo las columnas que muestran (tuplas,
+# no objetos ORM) en dos consultas acotadas al rango y con los filtros de
+# terapeuta, gabinete y tratamiento aplicados en el SQL.
+#   - Semana: en una pasada por los eventos (ya ordenados por inicio) se
+#     agrupan, por día, los que se solapan en la grilla en una misma
+#     celda con rowspan. Un evento fuera de la grilla de 30 minutos
+#     (10:15) cae en la franja que lo contiene en lugar de perderse.
+#   - Mes: semanas completas de lunes a domingo con los eventos de cada
+#     día; cada celda muestra hasta LIMITE_POR_DIA y un enlace al día.
+import heapq
+from collections import namedtuple, defaultdict
+from datetime import timedelta
+from operator import attrgetter
+
+from app import db
+from app.archivo import fuente_citas, es_archivada
+from app.models import Cliente, BloqueoHorario
+from app.ocupacion import NUM_FRANJAS, franjas_solapadas, minutos_evento
+
+LIMITE_POR_DIA = 6
+
+FiltroAgenda = namedtuple('FiltroAgenda', ['terapeuta_id', 'gabinete_id', 'tratamiento_id'])
+SIN_FILTRO = FiltroAgenda(None, None, None)
+
+# `titulo` es el nombre del cliente en las citas y el título en los bloqueos.
+EventoCalendario = namedtuple('EventoCalendario', ['tipo', 'id', 'fecha_hora_inicio', 'fecha_hora_fin', 'terapeuta_id',
+                                                   'gabinete_id', 'tratamiento_id', 'cliente_id', 'titulo', 'telefono',
+                                                   'estado', 'archivada'])
+
+# Celda de la vista semanal: los eventos que se solapan en la grilla y las filas que ocupan.
+Celda = namedtuple('Celda', ['filas', 'eventos'])
+OCULTA = 'oculta'
+
+
+def eventos_calendario(inicio, fin, filtro=SIN_FILTRO):
+    """Citas y bloqueos que empiezan en [inicio, fin), ordenados por inicio (2 consultas como máximo)."""
+    cita = fuente_citas(inicio)
+    citas = (db.session.query(cita.id, cita.fecha_hora_inicio, cita.fecha_hora_fin, cita.terapeuta_id, cita.gabinete_id,
+                              cita.tratamiento_id, cita.cliente_id, Cliente.nombre, Cliente.telefono, cita.estado,
+                              es_archivada(cita))
+             .join(Cliente, cita.cliente_id == Cliente.id)
+             .filter(cita.fecha_hora_inicio >= inicio, cita.fecha_hora_inicio < fin))
+    for columna, valor in ((cita.terapeuta_id, filtro.terapeuta_id), (cita.gabinete_id, filtro.gabinete_id),
+                           (cita.tratamiento_id, filtro.tratamiento_id)):
+        if valor:
+            citas = citas.filter(columna == valor)
+    citas = [EventoCalendario('cita', *fila) for fila in citas.order_by(cita.fecha_hora_inicio, cita.id)]
+
+    # Los bloqueos son del terapeuta: no tienen gabinete ni tratamiento.
+    if filtro.gabinete_id or filtro.tratamiento_id:
+        return citas
+    bloqueos = (db.session.query(BloqueoHorario.id, BloqueoHorario.fecha_hora_inicio, BloqueoHorario.fecha_hora_fin,
+                                 BloqueoHorario.terapeuta_id, BloqueoHorario.titulo)
+                .filter(BloqueoHorario.fecha_hora_inicio >= inicio, BloqueoHorario.fecha_hora_inicio < fin))
+    if filtro.terapeuta_id:
+        bloqueos = bloqueos.filter(BloqueoHorario.terapeuta_id == filtro.terapeuta_id)
+    bloqueos = [EventoCalendario('bloqueo', i, desde, hasta, tid, None, None, None, titulo, None, None, False)
+                for i, desde, hasta, tid, titulo in bloqueos.order_by(BloqueoHorario.fecha_hora_inicio, BloqueoHorario.id)]
+    return list(heapq.merge(citas, bloqueos, key=attrgetter('fecha_hora_inicio')))
+
+
+def _franjas(evento):
+    """Franjas [a, b) que ocupa el evento en la grilla, siempre al menos una."""
+    a, b = franjas_solapadas(*minutos_evento(evento))
+    a = min(a, NUM_FRANJAS - 1)
+    return a, max(b, a + 1)
+
+
+def grilla_semanal(inicio_semana, eventos):
+    """Filas de la vista semanal: grilla[franja][día] es una Celda, OCULTA (la cubre una
+    celda de arriba) o None (vacía). `eventos` debe venir ordenado por inicio."""
+    grilla = [[None] * 7 for _ in range(NUM_FRANJAS)]
+    abiertas = {}  # día -> [a, b, eventos] del grupo que se está armando
+
+    def cerrar(dia):
+        a, b, lista = abiertas.pop(dia)
+        grilla[a][dia] = Celda(b - a, lista)
+        for franja in range(a + 1, b):
+            grilla[franja][dia] = OCULTA
+
+    for evento in eventos:
+        dia = (evento.fecha_hora_inicio.date() - inicio_semana).days
+        a, b = _franjas(evento)
+        grupo = abiertas.get(dia)
+        if grupo is not None and a < grupo[1]:
+            grupo[1] = max(grupo[1], b)
+            grupo[2].append(evento)
+            continue
+        if grupo is not None:
+            cerrar(dia)
+        abiertas[dia] = [a, b, [evento]]
+    for dia in list(abiertas):
+        cerrar(dia)
+    return grilla
+
+
+def semanas_del_mes(inicio, fin, eventos):
+    """[[(fecha, eventos del día), ... 7 días], ...] para las semanas de [inicio, fin)."""
+    por_dia = defaultdict(list)
+    for evento in eventos:
+        por_dia[evento.fecha_hora_inicio.date()].append(evento)
+    dias = [(inicio + timedelta(days=i)).date() for i in range((fin - inicio).days)]
+    return [[(fecha, por_dia.get(fecha, [])) for fecha in dias[i:i + 7]] for i in range(0, len(dias), 7)]
+
+
+def compacto(evento, catalogo):
+    """Lista con los valores de CAMPOS_EVENTO (ver agenda_datos) para las respuestas JSON."""
+    inicio = evento.fecha_hora_inicio.isoformat(timespec='minutes')
+    fin = evento.fecha_hora_fin.isoformat(timespec='minutes')
+    if evento.tipo == 'bloqueo':
+        return ['bloqueo', evento.id, evento.terapeuta_id, inicio, fin, evento.titulo, None, None, None]
+    tratamiento = catalogo.tratamientos_por_id.get(evento.tratamiento_id)
+    gabinete = catalogo.gabinetes_por_id.get(evento.gabinete_id)
+    return ['cita', evento.id, evento.terapeuta_id, inicio, fin, evento.titulo,
+            tratamiento.nombre if tratamiento else None, gabinete.nombre if gabinete else None, evento.estado]
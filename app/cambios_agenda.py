@@ -0,0 +1,73 @@
+# =================================================================
+# CONTADOR DE CAMBIOS POR DÍA DE AGENDA
+# =================================================================
+# Cada alta, cambio o baja de Cita, BloqueoHorario o Disponibilidad
+# incrementa, en la misma transacción, la versión 'agenda:AAAA-MM-DD' de
+# los días afectados (el día anterior y el nuevo si la cita se movió).
+# Con esas versiones se arman ETags baratos para la API de la agenda y las
+# claves del caché de fragmentos. Como las vistas muestran el nombre y el
+# teléfono del cliente, cambiarlos incrementa además CLAVE_CLIENTES.
+import hashlib
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.models import Cita, BloqueoHorario, Disponibilidad, Cliente
+from app.versiones import incrementar, versiones_actuales
+
+CLAVE_CLIENTES = 'agenda:clientes'
+_CAMPO_FECHA = {Cita: 'fecha_hora_inicio', BloqueoHorario: 'fecha_hora_inicio', Disponibilidad: 'fecha'}
+
+
+def clave_dia(fecha):
+    return f'agenda:{fecha.isoformat()}'
+
+
+def _como_fecha(valor):
+    return valor.date() if hasattr(valor, 'date') else valor
+
+
+def _fechas_de(obj, incluir_anteriores):
+    campo = _CAMPO_FECHA[type(obj)]
+    valores = [getattr(obj, campo)]
+    if incluir_anteriores:
+        valores += inspect(obj).attrs[campo].history.deleted
+    return {_como_fecha(v) for v in valores if v is not None}
+
+
+def dias_modificados(session):
+    """Fechas cuya agenda cambia con lo pendiente de guardar en la sesión."""
+    fechas = set()
+    for obj in session.new:
+        if type(obj) in _CAMPO_FECHA:
+            fechas |= _fechas_de(obj, False)
+    for obj in session.deleted:
+        if type(obj) in _CAMPO_FECHA:
+            fechas |= _fechas_de(obj, True)
+    for obj in session.dirty:
+        if type(obj) in _CAMPO_FECHA and session.is_modified(obj, include_collections=False):
+            fechas |= _fechas_de(obj, True)
+    return fechas
+
+
+def _cambian_datos_de_cliente(session):
+    return any(isinstance(obj, Cliente) and any(inspect(obj).attrs[campo].history.has_changes()
+                                                for campo in ('nombre', 'telefono'))
+               for obj in session.dirty)
+
+
+@event.listens_for(Session, 'before_flush')
+def _incrementar_dias(session, flush_context, instances):
+    claves = [clave_dia(f) for f in dias_modificados(session)]
+    if _cambian_datos_de_cliente(session):
+        claves.append(CLAVE_CLIENTES)
+    if claves:
+        incrementar(session.connection(), claves)
+
+
+def version_de_dias(fechas, *extras):
+    """Huella corta de las versiones de varios días y de los datos de clientes (más otros
+    valores, p. ej. la vista)."""
+    versiones = versiones_actuales([*(clave_dia(f) for f in fechas), CLAVE_CLIENTES])
+    huella = '|'.join([*(f'{k}={v}' for k, v in sorted(versiones.items())), *map(str, extras)])
+    return hashlib.sha1(huella.encode()).hexdigest()[:16]
@@ -0,0 +1,232 @@
+# =================================================================
+# CARGA MASIVA DE DISPONIBILIDADES Y BLOQUEOS
+# =================================================================
+# Las filas llegan de un patrón semanal (terapeutas × días de la semana
+# dentro de un rango de fechas) o de un archivo CSV/XLSX. Todo se valida
+# en memoria, incluidos los solapamientos dentro del lote y contra lo ya
+# guardado, y sólo si no hay errores se insertan todas las filas con un
+# único INSERT de varias filas en una sola transacción.
+#
+# El INSERT masivo no pasa por los eventos de sesión del ORM, así que aquí
+# se incrementan a mano las versiones por día de la agenda (app/cambios_agenda.py).
+import csv
+import io
+import zipfile
+from collections import defaultdict, namedtuple
+from datetime import datetime, date, time, timedelta
+
+from sqlalchemy import insert
+
+from app import db
+from app.models import Disponibilidad, BloqueoHorario
+from app.catalogos import catalogos
+from app.cambios_agenda import clave_dia
+from app.versiones import incrementar
+from app.reservas import bloquear_recursos
+
+TIPOS = ('disponibilidad', 'bloqueo')
+DIAS_SEMANA = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
+MAXIMO_ERRORES = 20
+
+# Una fila ya validada; `titulo` sólo se usa en los bloqueos.
+Horario = namedtuple('Horario', ['linea', 'terapeuta_id', 'fecha', 'hora_inicio', 'hora_fin', 'titulo'])
+
+
+class ErrorCarga(Exception):
+    """Errores de validación del lote; no se guardó ninguna fila."""
+
+    def __init__(self, errores):
+        super().__init__(f'{len(errores)} errores en la carga')
+        self.errores = errores
+
+
+# --- Entrada de datos ---
+
+def filas_de_patron(terapeuta_ids, desde, hasta, dias_semana, hora_inicio, hora_fin, titulo=None):
+    """Una fila por terapeuta y por fecha de [desde, hasta] cuyo día de la semana (0 = lunes) esté en dias_semana."""
+    dias_semana = set(dias_semana)
+    filas = []
+    for i in range((hasta - desde).days + 1):
+        fecha = desde + timedelta(days=i)
+        if fecha.weekday() in dias_semana:
+            filas += [{'terapeuta_id': tid, 'fecha': fecha, 'hora_inicio': hora_inicio, 'hora_fin': hora_fin,
+                       'titulo': titulo} for tid in terapeuta_ids]
+    return filas
+
+
+def _normalizar_encabezado(valor):
+    return str(valor or '').strip().lower().replace(' ', '_')
+
+
+def filas_de_archivo(archivo, nombre):
+    """Lee un CSV (coma o punto y coma) o un XLSX con columnas terapeuta_id o terapeuta,
+    fecha, hora_inicio, hora_fin y, para bloqueos, titulo."""
+    if nombre.lower().endswith('.xlsx'):
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+        try:
+            hoja = load_workbook(archivo, read_only=True, data_only=True).active
+            filas = hoja.iter_rows(values_only=True)
+            encabezados = [_normalizar_encabezado(v) for v in next(filas, ())]
+            return [dict(zip(encabezados, fila)) for fila in filas if any(v not in (None, '') for v in fila)]
+        except (zipfile.BadZipFile, InvalidFileException, KeyError, OSError):
+            # Un archivo renombrado o dañado no es un ZIP/XLSX válido.
+            raise ErrorCarga(['Archivo XLSX inválido.'])
+    texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+    muestra = texto.read(4096)
+    texto.seek(0)
+    try:
+        dialecto = csv.Sniffer().sniff(muestra, delimiters=',;')
+    except csv.Error:
+        dialecto = csv.excel
+    lector = csv.DictReader(texto, dialect=dialecto)
+    lector.fieldnames = [_normalizar_encabezado(v) for v in lector.fieldnames or []]
+    return [fila for fila in lector if any(fila.values())]
+
+
+# --- Validación ---
+
+def _a_fecha(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    texto = str(valor).strip()
+    for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            pass
+    raise ValueError(f"fecha inválida '{texto}'")
+
+
+def _a_hora(valor):
+    if isinstance(valor, datetime):
+        return valor.time()
+    if isinstance(valor, time):
+        return valor
+    texto = str(valor).strip()
+    for formato in ('%H:%M', '%H:%M:%S'):
+        try:
+            return datetime.strptime(texto, formato).time()
+        except ValueError:
+            pass
+    raise ValueError(f"hora inválida '{texto}'")
+
+
+def _terapeuta_de(fila, por_id, por_nombre):
+    if fila.get('terapeuta_id') not in (None, ''):
+        tid = int(fila['terapeuta_id'])
+        if tid not in por_id:
+            raise ValueError(f'no existe el terapeuta {tid}')
+        return tid
+    nombre = str(fila.get('terapeuta') or '').strip().lower()
+    if nombre not in por_nombre:
+        raise ValueError(f"no existe el terapeuta '{fila.get('terapeuta')}'")
+    return por_nombre[nombre]
+
+
+def _existentes(tipo, terapeuta_ids, desde, hasta):
+    """{(terapeuta_id, fecha): [(inicio, fin), ...]} ya guardados en el rango (1 consulta)."""
+    existentes = defaultdict(list)
+    if tipo == 'disponibilidad':
+        consulta = db.session.query(Disponibilidad.terapeuta_id, Disponibilidad.fecha,
+                                    Disponibilidad.hora_inicio, Disponibilidad.hora_fin).filter(
+            Disponibilidad.terapeuta_id.in_(terapeuta_ids), Disponibilidad.fecha.between(desde, hasta))
+        for tid, fecha, inicio, fin in consulta:
+            existentes[(tid, fecha)].append((inicio, fin))
+    else:
+        consulta = db.session.query(BloqueoHorario.terapeuta_id, BloqueoHorario.fecha_hora_inicio,
+                                    BloqueoHorario.fecha_hora_fin).filter(
+            BloqueoHorario.terapeuta_id.in_(terapeuta_ids),
+            BloqueoHorario.fecha_hora_inicio >= datetime.combine(desde, time.min),
+            BloqueoHorario.fecha_hora_inicio < datetime.combine(hasta + timedelta(days=1), time.min))
+        for tid, inicio, fin in consulta:
+            existentes[(tid, inicio.date())].append((inicio.time(), fin.time()))
+    return existentes
+
+
+def validar(tipo, filas):
+    """Convierte y valida las filas. Devuelve la lista de Horario o lanza ErrorCarga.
+
+    Los intervalos de un mismo terapeuta y día no pueden solaparse entre sí
+    ni con los ya guardados (turnos contiguos, como 9-13 y 13-18, sí valen).
+    """
+    if tipo not in TIPOS:
+        raise ErrorCarga([f"Tipo de carga desconocido: '{tipo}'."])
+    catalogo = catalogos()
+    por_nombre = {t.nombre.strip().lower(): t.id for t in catalogo.terapeutas}
+    horarios, errores = [], []
+    for linea, fila in enumerate(filas, start=1):
+        try:
+            titulo = str(fila.get('titulo') or '').strip() or None
+            horario = Horario(linea, _terapeuta_de(fila, catalogo.terapeutas_por_id, por_nombre), _a_fecha(fila.get('fecha')),
+                              _a_hora(fila.get('hora_inicio')), _a_hora(fila.get('hora_fin')), titulo)
+            if horario.hora_fin <= horario.hora_inicio:
+                raise ValueError('la hora de fin debe ser posterior a la de inicio')
+            if tipo == 'bloqueo' and not titulo:
+                raise ValueError('falta el motivo (titulo) del bloqueo')
+            horarios.append(horario)
+        except (ValueError, TypeError) as e:
+            errores.append(f'Fila {linea}: {e}.')
+    if not horarios and not errores:
+        errores.append('No hay filas para cargar.')
+    if errores:
+        raise ErrorCarga(errores[:MAXIMO_ERRORES])
+
+    existentes = _existentes(tipo, {h.terapeuta_id for h in horarios},
+                             min(h.fecha for h in horarios), max(h.fecha for h in horarios))
+    por_dia = defaultdict(list)
+    for h in horarios:
+        por_dia[(h.terapeuta_id, h.fecha)].append((h.hora_inicio, h.hora_fin, h.linea))
+    for (tid, fecha), intervalos in por_dia.items():
+        intervalos += [(inicio, fin, None) for inicio, fin in existentes.get((tid, fecha), ())]
+        intervalos.sort(key=lambda i: (i[0], i[1]))
+        for (_, fin_a, linea_a), (inicio_b, _, linea_b) in zip(intervalos, intervalos[1:]):
+            if inicio_b < fin_a and (linea_a, linea_b) != (None, None):
+                if None in (linea_a, linea_b):
+                    motivo = f'Fila {linea_a or linea_b}: se solapa con un horario ya guardado'
+                else:
+                    motivo = f'Filas {linea_a} y {linea_b}: se solapan entre sí'
+                errores.append(f'{motivo} ({catalogo.terapeutas_por_id[tid].nombre}, {fecha.strftime("%d/%m/%Y")}).')
+    if errores:
+        raise ErrorCarga(errores[:MAXIMO_ERRORES])
+    return horarios
+
+
+# --- Inserción ---
+
+def insertar(tipo, horarios):
+    """Inserta los horarios validados en una sola transacción. Devuelve cuántos se guardaron."""
+    if tipo == 'disponibilidad':
+        modelo = Disponibilidad
+        filas = [{'terapeuta_id': h.terapeuta_id, 'fecha': h.fecha, 'hora_inicio': h.hora_inicio,
+                  'hora_fin': h.hora_fin} for h in horarios]
+    else:
+        modelo = BloqueoHorario
+        filas = [{'terapeuta_id': h.terapeuta_id, 'titulo': h.titulo,
+                  'fecha_hora_inicio': datetime.combine(h.fecha, h.hora_inicio),
+                  'fecha_hora_fin': datetime.combine(h.fecha, h.hora_fin)} for h in horarios]
+    try:
+        db.session.execute(insert(modelo), filas)
+        incrementar(db.session.connection(), [clave_dia(f) for f in {h.fecha for h in horarios}])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(filas)
+
+
+def cargar(tipo, filas):
+    """Valida e inserta un lote completo; lanza ErrorCarga sin guardar nada si algo falla."""
+    # Se bloquean los terapeutas (el lote aún no está validado, así que todos)
+    # para que otra carga no intercale filas entre la comprobación de
+    # solapamientos y el INSERT.
+    terapeuta_ids = [t.id for t in catalogos().terapeutas]
+    bloquear_recursos(terapeuta_ids)
+    try:
+        horarios = validar(tipo, filas)
+    except ErrorCarga:
+        db.session.rollback()
+        raise
+    return insertar(tipo, horarios)
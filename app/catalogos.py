@@ -0,0 +1,67 @@
+# =================================================================
+# CACHÉ DE CATÁLOGOS (terapeutas, gabinetes, tratamientos)
+# =================================================================
+# Los catálogos cambian pocas veces al mes, así que cada worker guarda
+# una copia en memoria (tuplas inmutables, no objetos ORM) junto con la
+# versión 'catalogos' de ContadorCambios. Cualquier alta, baja o cambio
+# de Terapeuta, Gabinete o Tratamiento incrementa esa versión en la misma
+# transacción, y cada worker recarga su copia en la siguiente petición.
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models import Terapeuta, Gabinete, Tratamiento
+from app.versiones import incrementar, version_actual
+
+CLAVE = 'catalogos'
+
+TerapeutaRef = namedtuple('TerapeutaRef', ['id', 'nombre', 'especialidad'])
+GabineteRef = namedtuple('GabineteRef', ['id', 'nombre', 'descripcion'])
+TratamientoRef = namedtuple('TratamientoRef', ['id', 'nombre', 'duracion', 'precio'])
+
+
+class Catalogos:
+    version = None
+
+    def __init__(self, terapeutas, gabinetes, tratamientos):
+        self.terapeutas = terapeutas
+        self.gabinetes = gabinetes
+        self.tratamientos = tratamientos
+        self.terapeutas_por_id = {t.id: t for t in terapeutas}
+        self.gabinetes_por_id = {g.id: g for g in gabinetes}
+        self.tratamientos_por_id = {t.id: t for t in tratamientos}
+
+
+_cache = (None, None)  # (versión, Catalogos)
+
+
+def _cargar():
+    return Catalogos(
+        [TerapeutaRef(t.id, t.nombre, t.especialidad) for t in Terapeuta.query.order_by(Terapeuta.nombre).all()],
+        [GabineteRef(g.id, g.nombre, g.descripcion) for g in Gabinete.query.order_by(Gabinete.nombre).all()],
+        [TratamientoRef(t.id, t.nombre, t.duracion, t.precio) for t in Tratamiento.query.order_by(Tratamiento.nombre).all()],
+    )
+
+
+def catalogos():
+    """Catálogos vigentes; sólo consulta la versión salvo que otro worker los haya cambiado."""
+    global _cache
+    # Se lee la versión antes que los datos: si cambian en el medio, la
+    # próxima petición verá una versión nueva y volverá a cargar.
+    version = version_actual(CLAVE)
+    version_guardada, datos = _cache
+    if datos is None or version_guardada != version:
+        datos = _cargar()
+        datos.version = version
+        _cache = (version, datos)
+    return datos
+
+
+@event.listens_for(Session, 'before_flush')
+def _invalidar_si_cambian(session, flush_context, instances):
+    modelos = (Terapeuta, Gabinete, Tratamiento)
+    cambiados = [*session.new, *session.deleted,
+                 *(obj for obj in session.dirty if session.is_modified(obj, include_collections=False))]
+    if any(isinstance(obj, modelos) for obj in cambiados):
+        incrementar(session.connection(), [CLAVE])
@@ -0,0 +1,72 @@
+# =================================================================
+# DETECCIÓN DE CONFLICTOS DE AGENDA
+# =================================================================
+# Servicio compartido por nueva_cita y editar_cita. Resuelve las cinco
+# comprobaciones (disponibilidad, bloqueos, terapeuta, gabinete y
+# cliente) con una consulta por tipo de recurso, apoyándose en los
+# índices compuestos (recurso, fecha_hora_inicio, fecha_hora_fin).
+from collections import namedtuple
+from datetime import timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+
+from app.models import Cita, BloqueoHorario, Disponibilidad
+from app.ocupacion import Intervalos, minuto_del_dia
+
+# Ningún evento dura más de un día (citas y bloqueos se crean dentro de
+# una misma fecha). Acotar el inicio por abajo permite que la búsqueda
+# por índice recorra sólo un día, sin importar el tamaño de la tabla.
+VENTANA_MAXIMA = timedelta(days=1)
+
+# tipo: 'disponibilidad', 'bloqueo', 'terapeuta', 'gabinete' o 'cliente'.
+# bloqueante: si es False el conflicto es sólo una advertencia.
+Conflicto = namedtuple('Conflicto', ['tipo', 'mensaje', 'bloqueante', 'evento'])
+
+
+def solapa(modelo, inicio, fin):
+    return [modelo.fecha_hora_inicio < fin, modelo.fecha_hora_fin > inicio,
+            modelo.fecha_hora_inicio > inicio - VENTANA_MAXIMA]
+
+
+def hay_disponibilidad(terapeuta_id, inicio, fin):
+    """True si la disponibilidad del terapeuta, fusionada, cubre el intervalo completo.
+
+    Así una cita de 12:30 a 13:30 entra en dos turnos contiguos de 09-13 y 13-17.
+    """
+    disponibilidades = Disponibilidad.query.filter_by(terapeuta_id=terapeuta_id, fecha=inicio.date()).all()
+    minuto_inicio = minuto_del_dia(inicio)
+    minuto_fin = minuto_inicio + int((fin - inicio).total_seconds() // 60)
+    return Intervalos.de_disponibilidades(disponibilidades).cubre(minuto_inicio, minuto_fin)
+
+
+def detectar_conflictos(terapeuta_id, gabinete_id, cliente_id, inicio, fin, excluir_cita_id=None):
+    """Devuelve la lista de conflictos (Conflicto) para agendar una cita en [inicio, fin)."""
+    conflictos = []
+
+    if not hay_disponibilidad(terapeuta_id, inicio, fin):
+        conflictos.append(Conflicto('disponibilidad', 'El terapeuta no tiene disponibilidad definida para ese horario.', True, None))
+
+    bloqueo = BloqueoHorario.query.filter(BloqueoHorario.terapeuta_id == terapeuta_id, *solapa(BloqueoHorario, inicio, fin)).first()
+    if bloqueo:
+        conflictos.append(Conflicto('bloqueo', f'El horario seleccionado está bloqueado por: "{bloqueo.titulo}".', True, bloqueo))
+
+    # Una sola consulta para los tres recursos; cada rama del OR usa su propio índice.
+    query = Cita.query.options(joinedload(Cita.gabinete)).filter(
+        or_(Cita.terapeuta_id == terapeuta_id, Cita.gabinete_id == gabinete_id, Cita.cliente_id == cliente_id),
+        *solapa(Cita, inicio, fin))
+    if excluir_cita_id is not None:
+        query = query.filter(Cita.id != excluir_cita_id)
+    citas = query.all()
+
+    cita_terapeuta = next((c for c in citas if c.terapeuta_id == terapeuta_id), None)
+    if cita_terapeuta:
+        conflictos.append(Conflicto('terapeuta', 'El terapeuta ya tiene otra cita en ese horario.', True, cita_terapeuta))
+    cita_gabinete = next((c for c in citas if c.gabinete_id == gabinete_id), None)
+    if cita_gabinete:
+        conflictos.append(Conflicto('gabinete', f'Error: El gabinete "{cita_gabinete.gabinete.nombre}" ya está ocupado.', True, cita_gabinete))
+    cita_cliente = next((c for c in citas if c.cliente_id == cliente_id), None)
+    if cita_cliente:
+        conflictos.append(Conflicto('cliente', 'Advertencia: El cliente ya tiene otra cita en un horario similar.', False, cita_cliente))
+
+    return conflictos
@@ -0,0 +1,155 @@
+# =================================================================
+# GENERADOR DE DATOS SINTÉTICOS
+# =================================================================
+# Llena la base con un spa ficticio pero creíble, para medir rendimiento
+# con volúmenes reales (comando `flask generar-datos`). Con la misma
+# semilla se obtienen siempre los mismos datos.
+#   - Terapeutas con turnos de 09-13 y 14-20, seis días por semana.
+#   - Citas que respetan disponibilidad, bloqueos, terapeuta y gabinete
+#     (la ocupación del día se lleva como máscara de bits por recurso).
+#   - Estados según la fecha: las pasadas, en su mayoría finalizadas.
+# Se inserta por lotes con INSERT de varias filas, así que al final se
+# reconstruye el resumen diario y se incrementan las versiones de caché,
+# que en el uso normal mantienen los eventos del ORM.
+import random
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import insert, func
+
+from app import db
+from app.models import Terapeuta, Gabinete, Tratamiento, Cliente, Cita, Disponibilidad, BloqueoHorario
+from app.busqueda import normalizar, solo_digitos
+from app.cambios_agenda import clave_dia
+from app.versiones import incrementar
+
+TAMANO_LOTE = 5000
+PASO = 30
+TURNOS = ((9 * 60, 13 * 60), (14 * 60, 20 * 60))
+NOMBRES = ['Ana', 'Lucía', 'María', 'Sofía', 'Valentina', 'Camila', 'Martina', 'Florencia', 'Julieta', 'Agustina',
+           'Juan', 'Martín', 'Santiago', 'Nicolás', 'Diego', 'Federico', 'Pablo', 'Andrés', 'Joaquín', 'Matías']
+APELLIDOS = ['González', 'Rodríguez', 'Fernández', 'López', 'Martínez', 'Pérez', 'García', 'Sánchez', 'Romero', 'Díaz',
+             'Núñez', 'Álvarez', 'Silva', 'Pereira', 'Suárez', 'Méndez', 'Castro', 'Acosta', 'Ramos', 'Olivera']
+ESPECIALIDADES = ['Masajes', 'Cosmetología', 'Estética corporal', 'Reflexología']
+TRATAMIENTOS = [('Masaje descontracturante', 60, 1800), ('Masaje relajante', 60, 1600), ('Piedras calientes', 90, 2400),
+                ('Limpieza facial', 45, 1200), ('Facial hidratante', 60, 1500), ('Reflexología podal', 45, 1100),
+                ('Drenaje linfático', 60, 1700), ('Exfoliación corporal', 45, 1300), ('Envoltura de algas', 75, 2100),
+                ('Manicura spa', 30, 700), ('Pedicura spa', 45, 900), ('Masaje en pareja', 90, 3600)]
+MEMBRESIAS = ['Huésped', 'Día de Spa', 'Mensual', 'Anual']
+
+
+def _insertar(modelo, filas):
+    for i in range(0, len(filas), TAMANO_LOTE):
+        db.session.execute(insert(modelo), filas[i:i + TAMANO_LOTE])
+
+
+def _ids(modelo, desde_id):
+    return [i for (i,) in db.session.query(modelo.id).filter(modelo.id > desde_id).order_by(modelo.id)]
+
+
+def _mascara(inicio, fin):
+    return ((1 << ((fin - inicio) // PASO)) - 1) << (inicio // PASO)
+
+
+def generar(terapeutas=30, gabinetes=15, tratamientos=12, clientes=5000, dias=730, ocupacion=0.6, semilla=42,
+            hasta=None, informar=print):
+    """Genera los datos y devuelve {nombre de tabla: filas insertadas}.
+
+    Las citas van desde `dias` antes de `hasta` (por defecto, dentro de 60 días) hasta esa fecha.
+    """
+    azar = random.Random(semilla)
+    hasta = hasta or date.today() + timedelta(days=60)
+    desde = hasta - timedelta(days=dias)
+    hoy = datetime.now()
+    ultimo = {m: db.session.query(func.coalesce(func.max(m.id), 0)).scalar()
+              for m in (Terapeuta, Gabinete, Tratamiento, Cliente)}
+
+    _insertar(Terapeuta, [{'nombre': f'{azar.choice(NOMBRES)} {azar.choice(APELLIDOS)}',
+                           'especialidad': azar.choice(ESPECIALIDADES)} for _ in range(terapeutas)])
+    # Los nombres de gabinete son únicos: se numeran a partir de los ya existentes.
+    _insertar(Gabinete, [{'nombre': f'Gabinete {ultimo[Gabinete] + i + 1}', 'descripcion': None}
+                         for i in range(gabinetes)])
+    filas_tratamientos = []
+    for i in range(tratamientos):
+        nombre, duracion, precio = TRATAMIENTOS[i % len(TRATAMIENTOS)]
+        vuelta = i // len(TRATAMIENTOS)
+        filas_tratamientos.append({'nombre': f'{nombre} {vuelta + 1}' if vuelta else nombre,
+                                   'duracion': duracion, 'precio': precio})
+    _insertar(Tratamiento, filas_tratamientos)
+    filas_clientes = []
+    for i in range(clientes):
+        nombre = f'{azar.choice(NOMBRES)} {azar.choice(APELLIDOS)} {azar.choice(APELLIDOS)}'
+        telefono = f'09{ultimo[Cliente] + i + 1:07d}'
+        filas_clientes.append({'nombre': nombre, 'telefono': telefono, 'email': None,
+                               'tipo_membresia': azar.choice(MEMBRESIAS), 'vencimiento_membresia': None,
+                               'nombre_normalizado': normalizar(nombre), 'telefono_digitos': solo_digitos(telefono)})
+    _insertar(Cliente, filas_clientes)
+    terapeuta_ids, gabinete_ids = _ids(Terapeuta, ultimo[Terapeuta]), _ids(Gabinete, ultimo[Gabinete])
+    cliente_ids = _ids(Cliente, ultimo[Cliente])
+    catalogo_tratamientos = [(t.id, t.duracion) for t in Tratamiento.query.filter(Tratamiento.id > ultimo[Tratamiento])]
+    informar(f'Catálogos: {terapeutas} terapeutas, {gabinetes} gabinetes, {tratamientos} tratamientos, {clientes} clientes.')
+
+    disponibilidades, bloqueos, citas = [], [], []
+    totales = {'cita': 0, 'disponibilidad': 0, 'bloqueo_horario': 0}
+    for d in range(dias):
+        fecha = desde + timedelta(days=d)
+        base = datetime.combine(fecha, time.min)
+        ocupado_gabinete = dict.fromkeys(gabinete_ids, 0)
+        for tid in terapeuta_ids:
+            if (fecha.weekday() + tid) % 7 == 0:
+                continue  # un día libre por semana, distinto para cada terapeuta
+            ocupado = 0
+            for inicio, fin in TURNOS:
+                disponibilidades.append({'terapeuta_id': tid, 'fecha': fecha,
+                                         'hora_inicio': time(inicio // 60, inicio % 60), 'hora_fin': time(fin // 60, fin % 60)})
+            if azar.random() < 0.03:
+                inicio = azar.choice([10, 11, 15, 16]) * 60
+                bloqueos.append({'terapeuta_id': tid, 'titulo': azar.choice(['Capacitación', 'Trámite', 'Reunión']),
+                                 'fecha_hora_inicio': base + timedelta(minutes=inicio),
+                                 'fecha_hora_fin': base + timedelta(minutes=inicio + 60)})
+                ocupado |= _mascara(inicio, inicio + 60)
+            for inicio_turno, fin_turno in TURNOS:
+                momento = inicio_turno
+                while momento < fin_turno:
+                    tratamiento_id, duracion = azar.choice(catalogo_tratamientos)
+                    fin = momento + -(-duracion // PASO) * PASO
+                    if fin > fin_turno or azar.random() > ocupacion:
+                        momento += PASO
+                        continue
+                    bits = _mascara(momento, fin)
+                    gabinete = next((g for g in azar.sample(gabinete_ids, len(gabinete_ids))
+                                     if not ocupado_gabinete[g] & bits), None)
+                    if ocupado & bits or gabinete is None:
+                        momento += PASO
+                        continue
+                    ocupado |= bits
+                    ocupado_gabinete[gabinete] |= bits
+                    inicio_cita = base + timedelta(minutes=momento)
+                    if inicio_cita > hoy:
+                        estado = azar.choices(['Agendada', 'Confirmada'], [3, 1])[0]
+                    else:
+                        estado = azar.choices(['Finalizada', 'Cancelada'], [9, 1])[0]
+                    citas.append({'fecha_hora_inicio': inicio_cita, 'fecha_hora_fin': inicio_cita + timedelta(minutes=duracion),
+                                  'estado': estado, 'cliente_id': azar.choice(cliente_ids), 'terapeuta_id': tid,
+                                  'gabinete_id': gabinete, 'tratamiento_id': tratamiento_id, 'recepcionista_id': None})
+                    momento = fin
+        if len(citas) >= TAMANO_LOTE * 4:
+            _volcar(totales, citas, disponibilidades, bloqueos)
+            informar(f'  hasta {fecha.isoformat()}: {totales["cita"]} citas')
+    _volcar(totales, citas, disponibilidades, bloqueos)
+
+    incrementar(db.session.connection(), ['catalogos'] + [clave_dia(desde + timedelta(days=d)) for d in range(dias)])
+    db.session.commit()
+
+    from app.resumen import reconstruir_resumen
+    reconstruir_resumen()
+    totales.update({'terapeuta': terapeutas, 'gabinete': gabinetes, 'tratamiento': tratamientos, 'cliente': clientes})
+    return totales
+
+
+def _volcar(totales, citas, disponibilidades, bloqueos):
+    """Inserta lo acumulado, suma los totales y vacía las listas."""
+    for modelo, clave, filas in ((Cita, 'cita', citas), (Disponibilidad, 'disponibilidad', disponibilidades),
+                                 (BloqueoHorario, 'bloqueo_horario', bloqueos)):
+        _insertar(modelo, filas)
+        totales[clave] += len(filas)
+        filas.clear()
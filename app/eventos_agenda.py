@@ -0,0 +1,146 @@
+# =================================================================
+# CANAL DE EVENTOS DE LA AGENDA (Server-Sent Events)
+# =================================================================
+# Las rutas que modifican citas llaman a publicar() después del commit.
+# Cada evento se guarda en la tabla EventoAgenda, que hace de intermediario
+# entre workers: cualquier worker que tenga un canal SSE abierto lee de
+# ahí los eventos nuevos de los días que muestra.
+#   - PostgreSQL: además se envía NOTIFY, y los canales esperan con LISTEN
+#     en lugar de consultar la tabla a intervalos.
+#   - SQLite: los canales consultan la tabla cada INTERVALO_SONDEO segundos.
+# Un canal abierto retiene un hilo del worker (y en PostgreSQL una
+# conexión propia fuera del pool), así que sólo se abren con los workers
+# gthread de gunicorn.conf.py y hasta AGENDA_SSE_CANALES por worker. Sin
+# lugar (o con el valor 0, el de workers síncronos) la ruta responde 204:
+# EventSource no reintenta y la página sigue con el sondeo por ETag.
+# Cada canal es una consulta larga (long-poll) que se cierra sola tras
+# DURACION_MAXIMA segundos. EventSource se reconecta a los RECONEXION ms
+# y sigue desde el último id con Last-Event-ID; el canal envía su id de
+# partida al abrirse para que no se pierda lo publicado entre conexiones.
+import json
+import select
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, text
+
+from app import app, db
+from app.models import EventoAgenda
+from app.agenda_datos import evento_compacto
+
+CANAL_NOTIFY = 'agenda_eventos'
+INTERVALO_SONDEO = 1
+LATIDO = 15
+DURACION_MAXIMA = 25
+RECONEXION = 1000
+RETENCION = timedelta(days=1)
+
+_canales = None
+_cerrojo_canales = threading.Lock()
+
+
+def publicar(tipo, cita, fecha_anterior=None):
+    """Registra un cambio ya confirmado de la cita y avisa a los canales abiertos.
+
+    `tipo` es 'creada', 'editada', 'eliminada' o 'estado'. Si la cita se movió
+    de día, el día anterior recibe un evento 'eliminada'. Un fallo al publicar
+    no deshace la operación: sólo se registra en el log.
+    """
+    try:
+        fecha = cita.fecha_hora_inicio.date()
+        datos = None if tipo == 'eliminada' else json.dumps(evento_compacto(cita))
+        ahora = datetime.utcnow()
+        db.session.add(EventoAgenda(fecha=fecha, tipo=tipo, cita_id=cita.id, datos=datos, creado=ahora))
+        if fecha_anterior is not None and fecha_anterior != fecha:
+            db.session.add(EventoAgenda(fecha=fecha_anterior, tipo='eliminada', cita_id=cita.id, creado=ahora))
+        EventoAgenda.query.filter(EventoAgenda.creado < ahora - RETENCION).delete(synchronize_session=False)
+        if db.session.connection().dialect.name == 'postgresql':
+            db.session.execute(text('SELECT pg_notify(:canal, :fecha)'),
+                               {'canal': CANAL_NOTIFY, 'fecha': fecha.isoformat()})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        app.logger.exception('No se pudo publicar el evento de agenda')
+
+
+def reservar_canal():
+    """True si este worker tiene lugar para otro canal; quien lo obtiene llama a liberar_canal() al cerrarlo."""
+    global _canales
+    maximo = app.config['AGENDA_SSE_CANALES']
+    if maximo <= 0:
+        return False
+    with _cerrojo_canales:
+        if _canales is None:
+            _canales = threading.BoundedSemaphore(maximo)
+    return _canales.acquire(blocking=False)
+
+
+def liberar_canal():
+    _canales.release()
+
+
+def ultimo_id():
+    return db.session.query(func.max(EventoAgenda.id)).scalar() or 0
+
+
+class _EsperaSondeo:
+    def esperar(self, segundos):
+        time.sleep(min(segundos, INTERVALO_SONDEO))
+
+    def cerrar(self):
+        pass
+
+
+class _EsperaListen:
+    """Conexión propia (fuera del pool) que espera NOTIFY con select()."""
+
+    def __init__(self):
+        self.conexion = db.engine.raw_connection()
+        self.conexion.detach()
+        self.dbapi = self.conexion.dbapi_connection
+        self.dbapi.autocommit = True
+        with self.dbapi.cursor() as cursor:
+            cursor.execute(f'LISTEN {CANAL_NOTIFY}')
+
+    def esperar(self, segundos):
+        if select.select([self.dbapi], [], [], segundos)[0]:
+            self.dbapi.poll()
+            self.dbapi.notifies.clear()
+
+    def cerrar(self):
+        self.conexion.close()
+
+
+def _formato_sse(evento):
+    datos = {'tipo': evento.tipo, 'cita_id': evento.cita_id, 'fecha': evento.fecha.isoformat(),
+             'evento': json.loads(evento.datos) if evento.datos else None}
+    return f'id: {evento.id}\ndata: {json.dumps(datos)}\n\n'
+
+
+def flujo_eventos(desde, hasta, despues_de=None):
+    """Generador SSE con los eventos de las fechas en [desde, hasta) posteriores al id `despues_de`."""
+    if despues_de is None:
+        despues_de = ultimo_id()
+    espera = _EsperaListen() if db.engine.dialect.name == 'postgresql' else _EsperaSondeo()
+    fin = time.monotonic() + DURACION_MAXIMA
+    ultimo_envio = time.monotonic()
+    try:
+        yield f'retry: {RECONEXION}\nid: {despues_de}\n\n'
+        while time.monotonic() < fin:
+            eventos = (EventoAgenda.query
+                       .filter(EventoAgenda.fecha >= desde, EventoAgenda.fecha < hasta, EventoAgenda.id > despues_de)
+                       .order_by(EventoAgenda.id).all())
+            # Cierra la transacción de lectura para ver lo que confirmen otros workers.
+            db.session.rollback()
+            for evento in eventos:
+                despues_de = evento.id
+                yield _formato_sse(evento)
+            if eventos or time.monotonic() - ultimo_envio >= LATIDO:
+                if not eventos:
+                    yield ': latido\n\n'
+                ultimo_envio = time.monotonic()
+            espera.esperar(max(0, min(LATIDO, fin - time.monotonic())))
+    finally:
+        espera.cerrar()
+        db.session.remove()
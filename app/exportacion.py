@@ -0,0 +1,120 @@
+# =================================================================
+# EXPORTACIÓN DE REPORTES POR STREAMING
+# =================================================================
+# Los reportes se leen con un único SELECT con joins, por lotes
+# (yield_per), sin hidratar objetos Cita. El CSV se envía a medida que
+# se genera y el XLSX se escribe con openpyxl en modo write-only a un
+# archivo temporal, así la memoria no depende del rango de fechas.
+import csv
+import tempfile
+from datetime import datetime
+from io import StringIO
+
+from flask import Response, send_file, stream_with_context
+from sqlalchemy import select, func, or_, and_, exists
+
+from app import db
+from app.archivo import fuente_citas
+from app.models import Cliente, Tratamiento, Terapeuta, Gabinete, Recepcionista
+
+COLUMNAS = ['Fecha', 'Hora', 'Cliente', 'Teléfono Cliente', 'Tratamiento', 'Duración (min)', 'Terapeuta', 'Gabinete', 'Estado', 'Agendado Por']
+TAMANO_LOTE = 1000
+TAMANO_PAGINA = 100
+
+
+def consulta_reporte(inicio, fin, cita=None):
+    """SELECT con joins de todas las columnas del reporte para las citas entre inicio y fin
+    (incluidas las archivadas; `cita` es la fuente devuelta por fuente_citas)."""
+    if cita is None:
+        cita = fuente_citas(inicio)
+    return (select(cita.fecha_hora_inicio, Cliente.nombre, Cliente.telefono, Tratamiento.nombre, Tratamiento.duracion,
+                   Terapeuta.nombre, Gabinete.nombre, cita.estado, func.coalesce(Recepcionista.username, 'Sistema'))
+            .join(Cliente, cita.cliente_id == Cliente.id)
+            .join(Tratamiento, cita.tratamiento_id == Tratamiento.id)
+            .join(Terapeuta, cita.terapeuta_id == Terapeuta.id)
+            .join(Gabinete, cita.gabinete_id == Gabinete.id)
+            .outerjoin(Recepcionista, cita.recepcionista_id == Recepcionista.id)
+            .where(cita.fecha_hora_inicio.between(inicio, fin))
+            .order_by(cita.fecha_hora_inicio, cita.id))
+
+
+def hay_citas(inicio, fin):
+    cita = fuente_citas(inicio)
+    return db.session.query(exists().where(cita.fecha_hora_inicio.between(inicio, fin))).scalar()
+
+
+def filas_reporte(inicio, fin):
+    """Genera las filas del reporte (en el orden de COLUMNAS), leyendo de a TAMANO_LOTE."""
+    resultado = db.session.execute(consulta_reporte(inicio, fin).execution_options(yield_per=TAMANO_LOTE))
+    for fecha_hora, *resto in resultado:
+        yield _formatear(fecha_hora, resto)
+
+
+def _formatear(fecha_hora, resto):
+    return [fecha_hora.strftime('%Y-%m-%d'), fecha_hora.strftime('%H:%M'), *resto]
+
+
+def pagina_reporte(inicio, fin, despues=None, limite=TAMANO_PAGINA):
+    """Una página del reporte con paginación por clave (fecha_hora_inicio, id).
+
+    `despues` es el cursor devuelto por la página anterior. Devuelve
+    (filas, cursor_siguiente); el cursor es None en la última página.
+    """
+    cita = fuente_citas(inicio)
+    consulta = consulta_reporte(inicio, fin, cita).add_columns(cita.id)
+    if despues:
+        fecha_cursor, id_cursor = despues
+        consulta = consulta.where(or_(cita.fecha_hora_inicio > fecha_cursor,
+                                      and_(cita.fecha_hora_inicio == fecha_cursor, cita.id > id_cursor)))
+    resultado = db.session.execute(consulta.limit(limite)).all()
+    filas = [_formatear(fecha_hora, resto[:-1]) for fecha_hora, *resto in resultado]
+    siguiente = None
+    if len(resultado) == limite:
+        siguiente = (resultado[-1][0], resultado[-1][-1])
+    return filas, siguiente
+
+
+def codificar_cursor(cursor):
+    return f'{cursor[0].isoformat()}_{cursor[1]}' if cursor else None
+
+
+def decodificar_cursor(texto):
+    if not texto:
+        return None
+    fecha_hora, id_cita = texto.rsplit('_', 1)
+    return datetime.fromisoformat(fecha_hora), int(id_cita)
+
+
+def respuesta_csv(inicio, fin, nombre='reporte_citas.csv'):
+    """Respuesta HTTP que envía el CSV por partes mientras se lee la base."""
+    def generar():
+        buffer = StringIO()
+        escritor = csv.writer(buffer)
+        buffer.write('\ufeff')  # BOM para que Excel reconozca UTF-8
+        escritor.writerow(COLUMNAS)
+        for i, fila in enumerate(filas_reporte(inicio, fin), 1):
+            escritor.writerow(fila)
+            if i % TAMANO_LOTE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(stream_with_context(generar()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={nombre}'})
+
+
+def respuesta_excel(inicio, fin, nombre='reporte_citas.xlsx'):
+    """Escribe el XLSX en modo write-only a un archivo temporal y lo envía."""
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet('Reporte Citas')
+    hoja.append(COLUMNAS)
+    for fila in filas_reporte(inicio, fin):
+        hoja.append(fila)
+    archivo = tempfile.TemporaryFile(suffix='.xlsx')
+    libro.save(archivo)
+    archivo.seek(0)
+    return send_file(archivo, download_name=nombre, as_attachment=True,
+                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
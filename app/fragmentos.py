@@ -0,0 +1,123 @@
+# =================================================================
+# CACHÉ DE FRAGMENTOS DE LA AGENDA
+# =================================================================
+# El HTML de cada vista de la agenda se guarda con una clave que incluye
+# la versión de los días que muestra (ver version_de_dias en
+# cambios_agenda.py): cualquier cambio de Cita, BloqueoHorario o
+# Disponibilidad de esos días, de un catálogo o de los datos de un
+# cliente cambia la clave, así que nunca hace falta invalidar a mano; las
+# entradas viejas simplemente dejan de pedirse y se descartan.
+#
+# AGENDA_CACHE elige dónde se guardan:
+#   - 'memoria' (por defecto): un LRU en cada worker.
+#   - 'sqlite': un archivo SQLite compartido por todos los workers de la
+#     máquina (AGENDA_CACHE_RUTA; por defecto uno por base de datos en el
+#     directorio temporal), sin depender de un servicio externo. Si se
+#     recrea la base desde cero hay que borrar ese archivo, porque las
+#     versiones vuelven a empezar.
+#   - 'ninguno': siempre se vuelve a generar.
+# Un fallo del caché nunca rompe la agenda: se registra y se genera el HTML.
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+from app import app
+
+
+class MemoriaLRU:
+    def __init__(self, max_entradas):
+        self.max_entradas = max_entradas
+        self.entradas = OrderedDict()
+        self.cerrojo = threading.Lock()
+
+    def obtener(self, clave):
+        with self.cerrojo:
+            html = self.entradas.get(clave)
+            if html is not None:
+                self.entradas.move_to_end(clave)
+            return html
+
+    def guardar(self, clave, html):
+        with self.cerrojo:
+            self.entradas[clave] = html
+            self.entradas.move_to_end(clave)
+            while len(self.entradas) > self.max_entradas:
+                self.entradas.popitem(last=False)
+
+
+class ArchivoSQLite:
+    """Caché en un archivo SQLite; al pasar de max_entradas se borran las más viejas."""
+
+    def __init__(self, ruta, max_entradas):
+        self.ruta = ruta
+        self.max_entradas = max_entradas
+        self.local = threading.local()
+
+    def _conexion(self):
+        conexion = getattr(self.local, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=2, isolation_level=None)
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('PRAGMA synchronous=NORMAL')
+            conexion.execute('CREATE TABLE IF NOT EXISTS fragmento (clave TEXT PRIMARY KEY, html TEXT NOT NULL, creado REAL NOT NULL)')
+            conexion.execute('CREATE INDEX IF NOT EXISTS ix_fragmento_creado ON fragmento (creado)')
+            self.local.conexion = conexion
+        return conexion
+
+    def obtener(self, clave):
+        fila = self._conexion().execute('SELECT html FROM fragmento WHERE clave = ?', (clave,)).fetchone()
+        return fila[0] if fila else None
+
+    def guardar(self, clave, html):
+        conexion = self._conexion()
+        conexion.execute('INSERT OR REPLACE INTO fragmento (clave, html, creado) VALUES (?, ?, ?)', (clave, html, time.time()))
+        conexion.execute('DELETE FROM fragmento WHERE clave IN '
+                         '(SELECT clave FROM fragmento ORDER BY creado DESC LIMIT -1 OFFSET ?)', (self.max_entradas,))
+
+
+_backend = None
+_cerrojo = threading.Lock()
+
+
+def backend():
+    """El backend configurado en AGENDA_CACHE (None si está desactivado), creado una vez por worker."""
+    global _backend
+    if _backend is None:
+        with _cerrojo:
+            if _backend is None:
+                tipo, max_entradas = app.config['AGENDA_CACHE'], app.config['AGENDA_CACHE_ENTRADAS']
+                if tipo == 'sqlite':
+                    ruta = app.config['AGENDA_CACHE_RUTA'] or os.path.join(
+                        tempfile.gettempdir(),
+                        'spa-agenda-' + hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12] + '.db')
+                    _backend = ArchivoSQLite(ruta, max_entradas)
+                elif tipo == 'memoria':
+                    _backend = MemoriaLRU(max_entradas)
+                else:
+                    _backend = False
+    return _backend or None
+
+
+def fragmento(clave, generar):
+    """HTML guardado con `clave`; si no está, lo genera con generar() y lo guarda."""
+    cache = backend()
+    html = None
+    if cache is not None:
+        try:
+            html = cache.obtener(clave)
+        except Exception:
+            app.logger.exception('No se pudo leer el caché de fragmentos')
+    if html is None:
+        html = str(generar())
+        if cache is not None:
+            try:
+                cache.guardar(clave, html)
+            except Exception:
+                app.logger.exception('No se pudo guardar en el caché de fragmentos')
+    return Markup(html)
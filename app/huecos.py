@@ -0,0 +1,127 @@
+# =================================================================
+# BÚSQUEDA DE HUECOS LIBRES
+# =================================================================
+# Devuelve las primeras combinaciones (terapeuta, gabinete, inicio) en las
+# que cabe un tratamiento dentro de un rango de fechas. Se hacen tres
+# consultas para todo el rango (disponibilidades, bloqueos y citas) y el
+# resto se calcula en memoria, día por día:
+#   1. Por terapeuta: disponibilidad fusionada menos citas y bloqueos, con
+#      un barrido lineal sobre intervalos ordenados (Intervalos.menos).
+#   2. Por gabinete: el día completo menos sus citas.
+#   3. Los inicios posibles de todos los terapeutas se ordenan y, para cada
+#      uno, se busca el primer gabinete libre con bisect (Intervalos.cubre).
+# Las reglas son las de detectar_conflictos: cualquier cita ocupa al
+# terapeuta y al gabinete, y la cita de un cliente no impide agendar.
+from collections import defaultdict, namedtuple
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import or_
+
+from app import db
+from app.models import Cita, BloqueoHorario, Disponibilidad
+from app.ocupacion import Intervalos, minuto_del_dia
+
+PASO_HUECOS = 15
+HORIZONTE_MAXIMO = 31
+LIMITE_HUECOS = 10
+
+Hueco = namedtuple('Hueco', ['inicio', 'fin', 'terapeuta', 'gabinete'])
+
+_DIA_COMPLETO = Intervalos([(0, 24 * 60)])
+
+
+def _minutos(inicio, fin):
+    minuto = minuto_del_dia(inicio)
+    return minuto, minuto + int((fin - inicio).total_seconds() // 60)
+
+
+def _cargar(terapeuta_ids, gabinete_ids, desde, hasta):
+    """Intervalos por (recurso, fecha) del rango [desde, hasta] en tres consultas."""
+    disponibles, ocupado_terapeuta, ocupado_gabinete = (defaultdict(list) for _ in range(3))
+    inicio_rango, fin_rango = datetime.combine(desde, time.min), datetime.combine(hasta + timedelta(days=1), time.min)
+
+    for tid, fecha, hora_inicio, hora_fin in db.session.query(
+            Disponibilidad.terapeuta_id, Disponibilidad.fecha, Disponibilidad.hora_inicio, Disponibilidad.hora_fin).filter(
+            Disponibilidad.terapeuta_id.in_(terapeuta_ids), Disponibilidad.fecha.between(desde, hasta)):
+        disponibles[(tid, fecha)].append((minuto_del_dia(hora_inicio), minuto_del_dia(hora_fin)))
+
+    for tid, inicio, fin in db.session.query(
+            BloqueoHorario.terapeuta_id, BloqueoHorario.fecha_hora_inicio, BloqueoHorario.fecha_hora_fin).filter(
+            BloqueoHorario.terapeuta_id.in_(terapeuta_ids),
+            BloqueoHorario.fecha_hora_inicio >= inicio_rango, BloqueoHorario.fecha_hora_inicio < fin_rango):
+        ocupado_terapeuta[(tid, inicio.date())].append(_minutos(inicio, fin))
+
+    for tid, gid, inicio, fin in db.session.query(
+            Cita.terapeuta_id, Cita.gabinete_id, Cita.fecha_hora_inicio, Cita.fecha_hora_fin).filter(
+            or_(Cita.terapeuta_id.in_(terapeuta_ids), Cita.gabinete_id.in_(gabinete_ids)),
+            Cita.fecha_hora_inicio >= inicio_rango, Cita.fecha_hora_inicio < fin_rango):
+        if tid in terapeuta_ids:
+            ocupado_terapeuta[(tid, inicio.date())].append(_minutos(inicio, fin))
+        if gid in gabinete_ids:
+            ocupado_gabinete[(gid, inicio.date())].append(_minutos(inicio, fin))
+
+    return disponibles, ocupado_terapeuta, ocupado_gabinete
+
+
+def _libres_del_dia(datos, fecha, terapeuta_ids, gabinete_ids):
+    disponibles, ocupado_terapeuta, ocupado_gabinete = datos
+    libres_terapeuta = {tid: Intervalos(disponibles[(tid, fecha)]).menos(Intervalos(ocupado_terapeuta.get((tid, fecha), ())))
+                        for tid in terapeuta_ids if disponibles.get((tid, fecha))}
+    libres_gabinete = {gid: _DIA_COMPLETO.menos(Intervalos(ocupado_gabinete.get((gid, fecha), ()))) for gid in gabinete_ids}
+    return libres_terapeuta, libres_gabinete
+
+
+def libres_por_recurso(fecha, terapeuta_ids, gabinete_ids):
+    """({terapeuta_id: Intervalos}, {gabinete_id: Intervalos}) con el tiempo libre de una fecha (3 consultas).
+
+    Un terapeuta sin disponibilidad ese día no aparece en el primer diccionario.
+    """
+    terapeuta_ids, gabinete_ids = set(terapeuta_ids), set(gabinete_ids)
+    return _libres_del_dia(_cargar(terapeuta_ids, gabinete_ids, fecha, fecha), fecha, terapeuta_ids, gabinete_ids)
+
+
+def _inicios(libres, duracion, minimo):
+    """Inicios alineados a PASO_HUECOS en los que cabe `duracion` dentro de algún tramo libre."""
+    for inicio, fin in libres:
+        primero = max(inicio, minimo)
+        primero += -primero % PASO_HUECOS
+        yield from range(primero, fin - duracion + 1, PASO_HUECOS)
+
+
+def buscar_huecos(duracion, terapeutas, gabinetes, desde, hasta, limite=LIMITE_HUECOS, ahora=None):
+    """Los primeros `limite` huecos (Hueco) de `duracion` minutos entre las fechas desde y hasta (inclusive).
+
+    `terapeutas` y `gabinetes` son los candidatos, en el orden de preferencia
+    para desempatar huecos que empiezan a la misma hora. No se proponen
+    horarios anteriores a `ahora`.
+    """
+    if not terapeutas or not gabinetes or duracion <= 0:
+        return []
+    ahora = ahora or datetime.now()
+    terapeuta_ids, gabinete_ids = {t.id for t in terapeutas}, {g.id for g in gabinetes}
+    datos = _cargar(terapeuta_ids, gabinete_ids, desde, hasta)
+
+    huecos = []
+    for dia in range((hasta - desde).days + 1):
+        fecha = desde + timedelta(days=dia)
+        if fecha < ahora.date():
+            continue
+        minimo = minuto_del_dia(ahora) if fecha == ahora.date() else 0
+        libres_terapeuta, libres_gabinete = _libres_del_dia(datos, fecha, terapeuta_ids, gabinete_ids)
+        candidatos = []
+        for orden, t in enumerate(terapeutas):
+            if t.id in libres_terapeuta:
+                candidatos += [(inicio, orden) for inicio in _inicios(libres_terapeuta[t.id], duracion, minimo)]
+        if not candidatos:
+            continue
+        candidatos.sort()
+        gabinetes_libres = [(g, libres_gabinete[g.id]) for g in gabinetes]
+        base = datetime.combine(fecha, time.min)
+        for inicio, orden in candidatos:
+            gabinete = next((g for g, libres in gabinetes_libres if libres.cubre(inicio, inicio + duracion)), None)
+            if gabinete is not None:
+                huecos.append(Hueco(base + timedelta(minutes=inicio), base + timedelta(minutes=inicio + duracion),
+                                    terapeutas[orden], gabinete))
+                if len(huecos) >= limite:
+                    return huecos
+    return huecos
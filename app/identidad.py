@@ -0,0 +1,131 @@
+# =================================================================
+# IDENTIDAD DEL USUARIO EN SESIÓN (sin consultar la base en cada petición)
+# =================================================================
+# Al iniciar sesión se guardan en la sesión de Flask (cookie firmada) el
+# id, el username, is_admin y la versión 'usuarios' de ContadorCambios.
+# El user_loader arma la identidad desde ahí mientras esa versión siga
+# vigente; si falta o es vieja, lee el usuario una vez y la renueva.
+#   - Cualquier alta, baja o cambio de Recepcionista incrementa la versión
+#     en la misma transacción (como los catálogos).
+#   - Cada worker guarda la versión vigente durante TTL_VERSION segundos,
+#     así que consulta la base como mucho una vez por intervalo y no una
+#     por petición. El worker que hizo el cambio lo ve al instante; los
+#     demás, a lo sumo TTL_VERSION segundos después.
+#   - Ese margen no vale para los permisos: admin_required (y con él las
+#     rutas que cambian usuarios) vuelve a leer is_admin de la base con
+#     es_admin(), así que quitarle el rol a alguien rige desde ya.
+#   - Sin datos en la sesión (p. ej. al volver con la cookie "recordarme")
+#     se usa un LRU de identidades por worker antes de ir a la base.
+import threading
+import time
+from collections import OrderedDict
+
+from flask import session
+from flask_login import UserMixin, user_logged_in, user_logged_out
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import app, db
+from app.models import Recepcionista
+from app.versiones import incrementar, version_actual
+
+CLAVE = 'usuarios'
+CLAVE_SESION = 'identidad'
+TTL_VERSION = 5
+TAMANO_LRU = 256
+
+
+class Identidad(UserMixin):
+    """Lo que las rutas y plantillas usan de current_user, sin el objeto ORM."""
+
+    def __init__(self, id, username, is_admin):
+        self.id = id
+        self.username = username
+        self.is_admin = is_admin
+
+
+_version = (0.0, None)  # (vence, versión)
+_identidades = OrderedDict()  # id -> (versión, Identidad)
+_cerrojo = threading.Lock()
+
+
+def version_usuarios():
+    """Versión 'usuarios' vigente; sólo consulta la base si la guardada venció."""
+    global _version
+    vence, version = _version
+    if version is None or time.monotonic() >= vence:
+        version = version_actual(CLAVE)
+        _version = (time.monotonic() + TTL_VERSION, version)
+    return version
+
+
+def es_admin(identidad):
+    """is_admin leído de la base (False si el usuario ya no existe)."""
+    return bool(db.session.query(Recepcionista.is_admin).filter(Recepcionista.id == identidad.id).scalar())
+
+
+def _recordar(identidad, version):
+    with _cerrojo:
+        _identidades[identidad.id] = (version, identidad)
+        _identidades.move_to_end(identidad.id)
+        while len(_identidades) > TAMANO_LRU:
+            _identidades.popitem(last=False)
+
+
+def _guardar_en_sesion(usuario, version):
+    session[CLAVE_SESION] = {'id': usuario.id, 'username': usuario.username,
+                             'is_admin': bool(usuario.is_admin), 'version': version}
+
+
+def cargar_usuario(id):
+    """user_loader: Identidad del usuario `id`, o None si ya no existe."""
+    id = int(id)
+    version = version_usuarios()
+    datos = session.get(CLAVE_SESION)
+    if datos and datos['id'] == id and datos['version'] == version:
+        return Identidad(id, datos['username'], datos['is_admin'])
+    with _cerrojo:
+        guardada = _identidades.get(id)
+    if guardada and guardada[0] == version:
+        identidad = guardada[1]
+    else:
+        usuario = db.session.get(Recepcionista, id)
+        if usuario is None:
+            session.pop(CLAVE_SESION, None)
+            return None
+        identidad = Identidad(usuario.id, usuario.username, bool(usuario.is_admin))
+        _recordar(identidad, version)
+    _guardar_en_sesion(identidad, version)
+    return identidad
+
+
+@user_logged_in.connect_via(app)
+def _al_iniciar_sesion(sender, user, **extra):
+    _guardar_en_sesion(user, version_usuarios())
+
+
+@user_logged_out.connect_via(app)
+def _al_cerrar_sesion(sender, user, **extra):
+    session.pop(CLAVE_SESION, None)
+
+
+@event.listens_for(Session, 'before_flush')
+def _invalidar_si_cambian(session, flush_context, instances):
+    cambiados = [*session.new, *session.deleted,
+                 *(obj for obj in session.dirty if session.is_modified(obj, include_collections=False))]
+    if any(isinstance(obj, Recepcionista) for obj in cambiados):
+        incrementar(session.connection(), [CLAVE])
+        session.info['usuarios_cambiados'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _olvidar_version(session):
+    # Este worker deja de confiar en la versión guardada en cuanto confirma el cambio.
+    global _version
+    if session.info.pop('usuarios_cambiados', False):
+        _version = (0.0, None)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_marca(session):
+    session.info.pop('usuarios_cambiados', None)
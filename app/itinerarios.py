@@ -0,0 +1,131 @@
+# =================================================================
+# RESERVA DE ITINERARIOS (varios tratamientos seguidos)
+# =================================================================
+# Un cliente de "Día de Spa" reserva varios tratamientos uno detrás de
+# otro. Todo ocurre en una sola transacción, con los recursos bloqueados
+# como en reservar_cita:
+#   1. Como los pasos van seguidos, el horario de cada uno se conoce antes
+#      de asignarle recursos. Con el tiempo libre del día (tres consultas,
+#      libres_por_recurso) se eligen los candidatos: los terapeutas y
+#      gabinetes libres en el horario de algún paso. Sólo esos se bloquean
+#      y se vuelve a leer su tiempo libre ya con el cerrojo tomado; a uno
+#      que se libere entretanto simplemente no se lo considera.
+#   2. Cada tratamiento empieza cuando termina el anterior y se le asigna
+#      el primer terapeuta y gabinete libres, prefiriendo los del paso
+#      anterior. Como los pasos no se solapan en el tiempo, lo asignado en
+#      uno nunca quita lugar a otro y basta con elegir paso a paso.
+#   3. Si algún paso no tiene lugar no se guarda nada; si todos lo tienen,
+#      se guardan todas las citas con un único commit.
+# Un itinerario debe terminar el mismo día en que empieza: las
+# disponibilidades son por fecha y no cruzan la medianoche.
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from app import db
+from app.models import Cita
+from app.catalogos import catalogos
+from app.conflictos import Conflicto, solapa
+from app.huecos import libres_por_recurso
+from app.ocupacion import minuto_del_dia
+from app.reservas import bloquear_recursos
+
+# Un tratamiento del itinerario; terapeuta_id y gabinete_id son opcionales (None = cualquiera).
+Paso = namedtuple('Paso', ['tratamiento_id', 'terapeuta_id', 'gabinete_id'])
+
+
+def _preferidos(recursos, fijo, anterior):
+    """Ids candidatos en orden: el fijado por el usuario o, si no, el del paso anterior primero."""
+    if fijo:
+        return [fijo]
+    ids = [r.id for r in recursos]
+    return [anterior] + [i for i in ids if i != anterior] if anterior in ids else ids
+
+
+def tramos(pasos, inicio):
+    """(tratamiento, inicio, fin) de cada paso, uno a continuación del otro."""
+    tratamientos = catalogos().tratamientos_por_id
+    resultado, momento = [], inicio
+    for paso in pasos:
+        tratamiento = tratamientos[paso.tratamiento_id]
+        fin = momento + timedelta(minutes=tratamiento.duracion)
+        resultado.append((tratamiento, momento, fin))
+        momento = fin
+    return resultado
+
+
+def _minutos(inicio, momento, fin):
+    desde = minuto_del_dia(momento) + (momento.date() - inicio.date()).days * 24 * 60
+    return desde, desde + int((fin - momento).total_seconds() // 60)
+
+
+def _candidatos(pasos, inicio, libres, campo):
+    """Ids de `libres` que algún paso podría usar: libres en su horario y, si el paso fija el recurso
+    (`campo` es 'terapeuta_id' o 'gabinete_id'), sólo el fijado."""
+    ids = set()
+    for paso, (_, momento, fin) in zip(pasos, tramos(pasos, inicio)):
+        desde, hasta = _minutos(inicio, momento, fin)
+        fijo = getattr(paso, campo)
+        ids.update(i for i, l in libres.items() if (not fijo or i == fijo) and l.cubre(desde, hasta))
+    return sorted(ids)
+
+
+def planificar(pasos, inicio, libres_terapeuta, libres_gabinete):
+    """Asigna terapeuta y gabinete a cada paso. Devuelve (asignaciones, conflictos).
+
+    Cada asignación es (tratamiento, terapeuta_id, gabinete_id, inicio, fin).
+    """
+    catalogo = catalogos()
+    asignaciones, conflictos = [], []
+    terapeuta_anterior = gabinete_anterior = None
+    for paso, (tratamiento, momento, fin) in zip(pasos, tramos(pasos, inicio)):
+        desde, hasta = _minutos(inicio, momento, fin)
+        terapeuta_id = next((t for t in _preferidos(catalogo.terapeutas, paso.terapeuta_id, terapeuta_anterior)
+                             if t in libres_terapeuta and libres_terapeuta[t].cubre(desde, hasta)), None)
+        gabinete_id = next((g for g in _preferidos(catalogo.gabinetes, paso.gabinete_id, gabinete_anterior)
+                            if g in libres_gabinete and libres_gabinete[g].cubre(desde, hasta)), None)
+        if terapeuta_id is None or gabinete_id is None:
+            recurso = 'terapeuta' if terapeuta_id is None else 'gabinete'
+            conflictos.append(Conflicto(recurso, f'No hay {recurso} libre para "{tratamiento.nombre}" '
+                                                 f'de {momento.strftime("%H:%M")} a {fin.strftime("%H:%M")}.', True, None))
+        else:
+            asignaciones.append((tratamiento, terapeuta_id, gabinete_id, momento, fin))
+            terapeuta_anterior, gabinete_anterior = terapeuta_id, gabinete_id
+    return asignaciones, conflictos
+
+
+def reservar_itinerario(cliente_id, pasos, inicio, recepcionista_id=None):
+    """Reserva todos los pasos seguidos a partir de `inicio`, o ninguno.
+
+    Devuelve (citas, conflictos) como reservar_cita; si hay algún conflicto
+    bloqueante no se guarda nada y las citas devueltas son [].
+    """
+    horarios = tramos(pasos, inicio)
+    medianoche = datetime.combine(inicio.date() + timedelta(days=1), time.min)
+    if horarios and horarios[-1][2] > medianoche:
+        return [], [Conflicto('disponibilidad', f'El itinerario terminaría después de la medianoche '
+                                                f'({horarios[-1][2].strftime("%d/%m %H:%M")}); debe empezar y terminar el mismo día.',
+                              True, None)]
+
+    catalogo = catalogos()
+    libres_terapeuta, libres_gabinete = libres_por_recurso(inicio.date(), [t.id for t in catalogo.terapeutas],
+                                                           [g.id for g in catalogo.gabinetes])
+    terapeuta_ids = _candidatos(pasos, inicio, libres_terapeuta, 'terapeuta_id')
+    gabinete_ids = _candidatos(pasos, inicio, libres_gabinete, 'gabinete_id')
+    bloquear_recursos(terapeuta_ids, gabinete_ids)
+    libres_terapeuta, libres_gabinete = libres_por_recurso(inicio.date(), terapeuta_ids, gabinete_ids)
+    asignaciones, conflictos = planificar(pasos, inicio, libres_terapeuta, libres_gabinete)
+    if not pasos or conflictos:
+        db.session.rollback()
+        return [], conflictos
+
+    fin = asignaciones[-1][4]
+    cita_cliente = Cita.query.filter(Cita.cliente_id == cliente_id, *solapa(Cita, inicio, fin)).first()
+    if cita_cliente:
+        conflictos.append(Conflicto('cliente', 'Advertencia: El cliente ya tiene otra cita en un horario similar.', False, cita_cliente))
+
+    citas = [Cita(cliente_id=cliente_id, terapeuta_id=terapeuta_id, gabinete_id=gabinete_id, tratamiento_id=tratamiento.id,
+                  fecha_hora_inicio=desde, fecha_hora_fin=hasta, estado='Agendada', recepcionista_id=recepcionista_id)
+             for tratamiento, terapeuta_id, gabinete_id, desde, hasta in asignaciones]
+    db.session.add_all(citas)
+    db.session.commit()
+    return citas, conflictos
@@ -0,0 +1,174 @@
+# =================================================================
+# MÉTRICAS POR PETICIÓN
+# =================================================================
+# Con METRICAS_ACTIVAS (variable de entorno METRICAS=1) se mide cada
+# petición: tiempo total, cantidad y tiempo de consultas SQL (eventos
+# before/after_cursor_execute del Engine) y tiempo de renderizado de
+# plantillas (señales de Flask). Las peticiones más lentas que
+# METRICAS_UMBRAL_LENTO_MS se registran en el log con sus peores consultas.
+#
+# Las latencias se acumulan por endpoint en memoria del worker (las últimas
+# MUESTRAS_POR_ENDPOINT) y se publican en /admin/metrics, en HTML o en
+# formato de texto de Prometheus. Con las métricas desactivadas no se
+# registra ningún evento ni hook, así que no cuestan nada.
+import heapq
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+MUESTRAS_POR_ENDPOINT = 1000
+PEORES_CONSULTAS = 3
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class _Endpoint:
+    def __init__(self):
+        self.duraciones = deque(maxlen=MUESTRAS_POR_ENDPOINT)
+        self.peticiones = 0
+        self.segundos = 0.0
+        self.consultas = 0
+        self.segundos_sql = 0.0
+        self.segundos_plantillas = 0.0
+        self.lentas = 0
+
+
+_endpoints = defaultdict(_Endpoint)
+_cerrojo = threading.Lock()
+
+
+def activas(app):
+    return app.config.get('METRICAS_ACTIVAS', False)
+
+
+# --- Medición dentro de cada petición ---
+
+# El inicio se guarda en el contexto de ejecución de cada sentencia, que se
+# descarta con ella: si la consulta falla no queda nada pendiente en la conexión.
+def _antes_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context() and 'metricas' in g:
+        context.metricas_inicio = time.perf_counter()
+
+
+def _despues_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    inicio = getattr(context, 'metricas_inicio', None)
+    if inicio is None or not has_request_context() or 'metricas' not in g:
+        return
+    duracion = time.perf_counter() - inicio
+    medicion = g.metricas
+    medicion['consultas'] += 1
+    medicion['segundos_sql'] += duracion
+    peores = medicion['peores']
+    if len(peores) < PEORES_CONSULTAS:
+        heapq.heappush(peores, (duracion, statement))
+    elif duracion > peores[0][0]:
+        heapq.heapreplace(peores, (duracion, statement))
+
+
+def _antes_de_plantilla(sender, template, context, **extra):
+    if 'metricas' in g:
+        g.metricas['plantillas_inicio'].append(time.perf_counter())
+
+
+def _plantilla_renderizada(sender, template, context, **extra):
+    if 'metricas' in g and g.metricas['plantillas_inicio']:
+        g.metricas['segundos_plantillas'] += time.perf_counter() - g.metricas['plantillas_inicio'].pop()
+
+
+def _iniciar_peticion():
+    g.metricas = {'inicio': time.perf_counter(), 'consultas': 0, 'segundos_sql': 0.0, 'peores': [],
+                  'plantillas_inicio': [], 'segundos_plantillas': 0.0}
+
+
+def _registrar(app):
+    def _terminar_peticion(respuesta):
+        medicion = g.pop('metricas', None)
+        if medicion is None:
+            return respuesta
+        duracion = time.perf_counter() - medicion['inicio']
+        endpoint = request.endpoint or 'desconocido'
+        lenta = duracion * 1000 >= app.config['METRICAS_UMBRAL_LENTO_MS']
+        with _cerrojo:
+            datos = _endpoints[endpoint]
+            datos.duraciones.append(duracion)
+            datos.peticiones += 1
+            datos.segundos += duracion
+            datos.consultas += medicion['consultas']
+            datos.segundos_sql += medicion['segundos_sql']
+            datos.segundos_plantillas += medicion['segundos_plantillas']
+            datos.lentas += lenta
+        if lenta:
+            peores = '; '.join(f'{d * 1000:.1f} ms: {" ".join(sql.split())[:200]}'
+                               for d, sql in sorted(medicion['peores'], reverse=True))
+            app.logger.warning('Petición lenta %s %s (%s): %.1f ms, %d consultas (%.1f ms), plantillas %.1f ms. Peores: %s',
+                               request.method, request.path, endpoint, duracion * 1000, medicion['consultas'],
+                               medicion['segundos_sql'] * 1000, medicion['segundos_plantillas'] * 1000, peores)
+        return respuesta
+    return _terminar_peticion
+
+
+def instalar(app):
+    """Registra los hooks de medición si METRICAS_ACTIVAS está habilitado."""
+    if not activas(app):
+        return
+    event.listen(Engine, 'before_cursor_execute', _antes_de_consulta)
+    event.listen(Engine, 'after_cursor_execute', _despues_de_consulta)
+    before_render_template.connect(_antes_de_plantilla, app)
+    template_rendered.connect(_plantilla_renderizada, app)
+    app.before_request(_iniciar_peticion)
+    app.after_request(_registrar(app))
+
+
+# --- Consulta de lo acumulado ---
+
+def _percentil(ordenadas, p):
+    if not ordenadas:
+        return 0.0
+    return ordenadas[min(len(ordenadas) - 1, int(p * len(ordenadas)))]
+
+
+def resumen():
+    """Lista de dicts por endpoint con peticiones, percentiles (en ms) y promedios, ordenada por p95."""
+    with _cerrojo:
+        copia = [(nombre, sorted(d.duraciones), d.peticiones, d.segundos, d.consultas, d.segundos_sql,
+                  d.segundos_plantillas, d.lentas) for nombre, d in _endpoints.items()]
+    filas = []
+    for nombre, ordenadas, peticiones, segundos, consultas, segundos_sql, segundos_plantillas, lentas in copia:
+        filas.append({
+            'endpoint': nombre, 'peticiones': peticiones, 'lentas': lentas,
+            'percentiles': {p: _percentil(ordenadas, p) * 1000 for p in PERCENTILES},
+            'promedio_ms': segundos / peticiones * 1000,
+            'consultas_promedio': consultas / peticiones,
+            'sql_promedio_ms': segundos_sql / peticiones * 1000,
+            'plantillas_promedio_ms': segundos_plantillas / peticiones * 1000,
+            'segundos': segundos, 'consultas': consultas, 'segundos_sql': segundos_sql,
+            'segundos_plantillas': segundos_plantillas,
+        })
+    return sorted(filas, key=lambda f: f['percentiles'][0.95], reverse=True)
+
+
+def texto_prometheus():
+    """Las métricas en el formato de texto de Prometheus (versión 0.0.4)."""
+    filas = resumen()
+
+    def etiqueta(fila):
+        return f'endpoint="{fila["endpoint"]}",pid="{os.getpid()}"'
+
+    lineas = ['# HELP spa_peticion_segundos Duración de las peticiones por endpoint.',
+              '# TYPE spa_peticion_segundos summary']
+    for f in filas:
+        for p, valor in f['percentiles'].items():
+            lineas.append(f'spa_peticion_segundos{{{etiqueta(f)},quantile="{p}"}} {valor / 1000:.6f}')
+        lineas.append(f'spa_peticion_segundos_sum{{{etiqueta(f)}}} {f["segundos"]:.6f}')
+        lineas.append(f'spa_peticion_segundos_count{{{etiqueta(f)}}} {f["peticiones"]}')
+    for nombre, ayuda, clave in (('spa_consultas_sql_total', 'Consultas SQL ejecutadas.', 'consultas'),
+                                 ('spa_sql_segundos_total', 'Tiempo total en consultas SQL.', 'segundos_sql'),
+                                 ('spa_plantillas_segundos_total', 'Tiempo total renderizando plantillas.', 'segundos_plantillas'),
+                                 ('spa_peticiones_lentas_total', 'Peticiones por encima del umbral de lentitud.', 'lentas')):
+        lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} counter']
+        lineas += [f'{nombre}{{{etiqueta(f)}}} {f[clave]}' for f in filas]
+    return '\n'.join(lineas) + '\n'
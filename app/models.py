@@ -49,6 +49,10 @@ class Cliente(db.Model):
     email = db.Column(db.String(120))
     tipo_membresia = db.Column(db.String(50), nullable=False, default='Huésped')
     vencimiento_membresia = db.Column(db.Date, nullable=True)
+    # Columnas de búsqueda, mantenidas por app/busqueda.py: nombre en minúsculas y sin
+    # acentos, y teléfono sólo con dígitos.
+    nombre_normalizado = db.Column(db.String(100), index=True)
+    telefono_digitos = db.Column(db.String(20), index=True)
 
 class Cita(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -62,6 +66,39 @@ class Cita(db.Model):
     recepcionista_id = db.Column(db.Integer, db.ForeignKey('recepcionista.id'))
     cliente = db.relationship('Cliente', backref=db.backref('citas', lazy=True))
 
+    # True en las citas leídas de cita_historica (ver app/archivo.py); no es una columna.
+    archivada = False
+
+    # Índices compuestos para las búsquedas de solapamiento por recurso (ver app/conflictos.py).
+    # En SQLite, AUTOINCREMENT evita que se reutilice el id de una cita borrada o archivada.
+    __table_args__ = (
+        db.Index('ix_cita_terapeuta_rango', 'terapeuta_id', 'fecha_hora_inicio', 'fecha_hora_fin'),
+        db.Index('ix_cita_gabinete_rango', 'gabinete_id', 'fecha_hora_inicio', 'fecha_hora_fin'),
+        db.Index('ix_cita_cliente_rango', 'cliente_id', 'fecha_hora_inicio', 'fecha_hora_fin'),
+        db.Index('ix_cita_inicio', 'fecha_hora_inicio'),
+        {'sqlite_autoincrement': True},
+    )
+
+class CitaHistorica(db.Model):
+    # Citas finalizadas o canceladas que `flask archivar-citas` sacó de la tabla cita
+    # (ver app/archivo.py). Mismas columnas e ids que Cita; sólo se leen.
+    __tablename__ = 'cita_historica'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    fecha_hora_inicio = db.Column(db.DateTime, nullable=False)
+    fecha_hora_fin = db.Column(db.DateTime, nullable=False)
+    estado = db.Column(db.String(50), nullable=False)
+    cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=False)
+    terapeuta_id = db.Column(db.Integer, db.ForeignKey('terapeuta.id'), nullable=False)
+    gabinete_id = db.Column(db.Integer, db.ForeignKey('gabinete.id'), nullable=False)
+    tratamiento_id = db.Column(db.Integer, db.ForeignKey('tratamiento.id'), nullable=False)
+    recepcionista_id = db.Column(db.Integer, db.ForeignKey('recepcionista.id'))
+
+    __table_args__ = (
+        db.Index('ix_cita_historica_cliente', 'cliente_id', 'fecha_hora_inicio'),
+        db.Index('ix_cita_historica_terapeuta', 'terapeuta_id', 'fecha_hora_inicio'),
+        db.Index('ix_cita_historica_inicio', 'fecha_hora_inicio'),
+    )
+
 class BloqueoHorario(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     titulo = db.Column(db.String(100), nullable=False)
@@ -69,6 +106,11 @@ class BloqueoHorario(db.Model):
     fecha_hora_fin = db.Column(db.DateTime, nullable=False)
     terapeuta_id = db.Column(db.Integer, db.ForeignKey('terapeuta.id'), nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_bloqueo_terapeuta_rango', 'terapeuta_id', 'fecha_hora_inicio', 'fecha_hora_fin'),
+        db.Index('ix_bloqueo_inicio', 'fecha_hora_inicio'),
+    )
+
 # --- INICIO: CAMBIO DEL MODELO DISPONIBILIDAD ---
 # Modelo para Disponibilidad por Fecha
 class Disponibilidad(db.Model):
@@ -78,4 +120,46 @@ class Disponibilidad(db.Model):
     hora_inicio = db.Column(db.Time, nullable=False)
     hora_fin = db.Column(db.Time, nullable=False)
     terapeuta_id = db.Column(db.Integer, db.ForeignKey('terapeuta.id'), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_disponibilidad_terapeuta_fecha', 'terapeuta_id', 'fecha'),
+        db.Index('ix_disponibilidad_fecha', 'fecha'),
+    )
 # --- FIN: CAMBIO DEL MODELO DISPONIBILIDAD ---
+
+# Resumen diario de citas (día × terapeuta × gabinete × tratamiento × estado),
+# mantenido de forma incremental en app/resumen.py.
+class ResumenDiario(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.Date, nullable=False)
+    terapeuta_id = db.Column(db.Integer, db.ForeignKey('terapeuta.id'), nullable=False)
+    gabinete_id = db.Column(db.Integer, db.ForeignKey('gabinete.id'), nullable=False)
+    tratamiento_id = db.Column(db.Integer, db.ForeignKey('tratamiento.id'), nullable=False)
+    estado = db.Column(db.String(50), nullable=False)
+    cantidad = db.Column(db.Integer, nullable=False, default=0)
+    minutos = db.Column(db.Integer, nullable=False, default=0)
+    ingresos = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('fecha', 'terapeuta_id', 'gabinete_id', 'tratamiento_id', 'estado', name='uq_resumen_diario_clave'),
+    )
+
+# Contadores de versión por clave (p. ej. 'catalogos'). Se incrementan al
+# escribir y permiten a cada worker saber si sus datos en memoria siguen vigentes.
+class ContadorCambios(db.Model):
+    clave = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# Registro de cambios de citas (alta, edición, baja, cambio de estado) que
+# leen los canales SSE de la agenda de todos los workers; ver app/eventos_agenda.py.
+class EventoAgenda(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.Date, nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)
+    cita_id = db.Column(db.Integer, nullable=False)
+    datos = db.Column(db.Text)
+    creado = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        db.Index('ix_evento_agenda_fecha_id', 'fecha', 'id'),
+    )
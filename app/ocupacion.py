@@ -0,0 +1,164 @@
+# =================================================================
+# OCUPACIÓN DE FRANJAS HORARIAS
+# =================================================================
+# La grilla de la agenda va de 07:00 a 23:00 en franjas de 30 minutos.
+# Las horas se manejan como minutos enteros desde medianoche y la
+# ocupación de cada terapeuta en un día se guarda como una máscara de
+# bits (un int de Python, un bit por franja), que se construye en una
+# sola pasada y responde "¿está libre esta franja?" en O(1).
+#
+# Las disponibilidades de un terapeuta en un día pueden solaparse o ser
+# contiguas (09-13 y 13-17); Intervalos las fusiona en tramos ordenados y
+# disjuntos, y responde "¿cubre este tramo todo [a, b)?" con bisect.
+import math
+from bisect import bisect_right
+
+from app.models import Cita
+
+INICIO_GRILLA = 7 * 60
+FIN_GRILLA = 23 * 60
+PASO = 30
+NUM_FRANJAS = (FIN_GRILLA - INICIO_GRILLA) // PASO
+FRANJAS_HORARIAS = tuple(f'{m // 60:02d}:{m % 60:02d}' for m in range(INICIO_GRILLA, FIN_GRILLA, PASO))
+
+
+def minuto_del_dia(valor):
+    """Minutos desde medianoche de un datetime o time."""
+    return valor.hour * 60 + valor.minute
+
+
+def franja_de(minuto):
+    """Índice de la franja que empieza exactamente en `minuto`, o None si cae fuera de la grilla."""
+    desplazamiento = minuto - INICIO_GRILLA
+    if desplazamiento % PASO or not 0 <= desplazamiento < FIN_GRILLA - INICIO_GRILLA:
+        return None
+    return desplazamiento // PASO
+
+
+def rango_franjas(minuto_inicio, minuto_fin):
+    """Franjas [a, b) cuyo comienzo cae dentro de [minuto_inicio, minuto_fin)."""
+    a = math.ceil((minuto_inicio - INICIO_GRILLA) / PASO)
+    b = math.ceil((minuto_fin - INICIO_GRILLA) / PASO)
+    return max(a, 0), min(max(b, 0), NUM_FRANJAS)
+
+
+def franjas_solapadas(minuto_inicio, minuto_fin):
+    """Franjas [a, b) que se solapan, aunque sea en parte, con [minuto_inicio, minuto_fin)."""
+    a = (minuto_inicio - INICIO_GRILLA) // PASO
+    b = math.ceil((minuto_fin - INICIO_GRILLA) / PASO)
+    return max(a, 0), min(max(b, 0), NUM_FRANJAS)
+
+
+def mascara(a, b):
+    return ((1 << (b - a)) - 1) << a if b > a else 0
+
+
+def minutos_evento(evento):
+    """(inicio, fin) de una cita o bloqueo en minutos desde la medianoche del día en que empieza."""
+    inicio = minuto_del_dia(evento.fecha_hora_inicio)
+    return inicio, inicio + int((evento.fecha_hora_fin - evento.fecha_hora_inicio).total_seconds() // 60)
+
+
+class Intervalos:
+    """Intervalos [inicio, fin) en minutos, fusionados, ordenados y sin solapamientos."""
+
+    def __init__(self, pares=()):
+        self.inicios, self.fines = [], []
+        for inicio, fin in sorted(pares):
+            if fin <= inicio:
+                continue
+            if self.fines and inicio <= self.fines[-1]:
+                self.fines[-1] = max(self.fines[-1], fin)
+            else:
+                self.inicios.append(inicio)
+                self.fines.append(fin)
+
+    @classmethod
+    def de_disponibilidades(cls, disponibilidades):
+        return cls((minuto_del_dia(d.hora_inicio), minuto_del_dia(d.hora_fin)) for d in disponibilidades)
+
+    def cubre(self, inicio, fin):
+        """True si un único tramo fusionado contiene todo [inicio, fin) (O(log n))."""
+        i = bisect_right(self.inicios, inicio) - 1
+        return i >= 0 and self.fines[i] >= fin
+
+    def menos(self, otros):
+        """Tramos de self que no se solapan con `otros`, en un barrido lineal de ambas listas."""
+        libres, j = [], 0
+        for inicio, fin in self:
+            while j < len(otros.fines) and otros.fines[j] <= inicio:
+                j += 1
+            cursor, k = inicio, j
+            while k < len(otros.inicios) and otros.inicios[k] < fin:
+                if otros.inicios[k] > cursor:
+                    libres.append((cursor, otros.inicios[k]))
+                cursor = max(cursor, otros.fines[k])
+                k += 1
+            if cursor < fin:
+                libres.append((cursor, fin))
+        return Intervalos(libres)
+
+    def __iter__(self):
+        return zip(self.inicios, self.fines)
+
+    def __len__(self):
+        return len(self.inicios)
+
+
+def filas_evento(minuto_inicio, minuto_fin, franja_inicio):
+    """Cantidad de filas que ocupa en la grilla un evento que empieza en `franja_inicio`."""
+    filas = math.ceil((minuto_fin - minuto_inicio) / PASO) if minuto_fin > minuto_inicio else 1
+    return max(1, min(filas, NUM_FRANJAS - franja_inicio))
+
+
+class OcupacionDia:
+    """Disponibilidad y ocupación de las franjas de un día, por terapeuta.
+
+    `horarios` es {terapeuta_id: Intervalos} con la disponibilidad ya fusionada.
+    """
+
+    def __init__(self, horarios, eventos):
+        self.disponible = {}
+        self.ocupado = {}
+        self.ocultas = {}
+        self.inicios = {}
+        for terapeuta_id, intervalos in horarios.items():
+            bits = 0
+            for inicio, fin in intervalos:
+                bits |= mascara(*rango_franjas(inicio, fin))
+            self.disponible[terapeuta_id] = bits
+        for evento in eventos:
+            inicio, fin = minutos_evento(evento)
+            tid = evento.terapeuta_id
+            self.ocupado[tid] = self.ocupado.get(tid, 0) | mascara(*franjas_solapadas(inicio, fin))
+            franja = franja_de(inicio)
+            if franja is not None:
+                filas = filas_evento(inicio, fin, franja)
+                self.inicios[(tid, franja)] = (evento, filas)
+                self.ocultas[tid] = self.ocultas.get(tid, 0) | mascara(franja + 1, franja + filas)
+
+    def esta_disponible(self, terapeuta_id, franja):
+        return bool(self.disponible.get(terapeuta_id, 0) >> franja & 1)
+
+    def esta_libre(self, terapeuta_id, franja):
+        """True si el terapeuta trabaja en esa franja y no tiene cita ni bloqueo."""
+        libres = self.disponible.get(terapeuta_id, 0) & ~self.ocupado.get(terapeuta_id, 0)
+        return bool(libres >> franja & 1)
+
+    def grilla(self, terapeutas):
+        """Celdas de la grilla diaria: {franja: {terapeuta_id: celda}} como espera _agenda_grilla.html."""
+        agenda_diaria = {}
+        libres = {t.id: self.disponible.get(t.id, 0) & ~self.ocupado.get(t.id, 0) for t in terapeutas}
+        for i, franja in enumerate(FRANJAS_HORARIAS):
+            fila = {}
+            for t in terapeutas:
+                inicio = self.inicios.get((t.id, i))
+                if inicio is not None:
+                    evento, filas = inicio
+                    status = 'cita' if isinstance(evento, Cita) else 'bloqueo'
+                    fila[t.id] = {'status': status, 'evento': evento, 'render': True, 'rowspan': filas}
+                else:
+                    status = 'disponible' if libres[t.id] >> i & 1 else 'no_disponible'
+                    fila[t.id] = {'status': status, 'evento': None, 'render': not self.ocultas.get(t.id, 0) >> i & 1, 'rowspan': 1}
+            agenda_diaria[franja] = fila
+        return agenda_diaria
@@ -0,0 +1,50 @@
+# =================================================================
+# RESERVA TRANSACCIONAL DE CITAS
+# =================================================================
+# Comprobar conflictos y guardar la cita ocurre dentro de la misma
+# transacción, con los recursos bloqueados, para que dos recepcionistas
+# en workers distintos no puedan agendar el mismo hueco a la vez.
+#   - PostgreSQL: SELECT ... FOR UPDATE sobre las filas del terapeuta y
+#     del gabinete, que actúan como cerrojo por recurso.
+#   - SQLite: BEGIN IMMEDIATE, que serializa a los escritores.
+from app import db
+from app.models import Cita, Terapeuta, Gabinete
+from app.conflictos import detectar_conflictos
+
+
+def bloquear_recursos(terapeuta_ids=(), gabinete_ids=()):
+    """Abre la transacción de escritura y bloquea terapeutas y gabinetes hasta el commit/rollback."""
+    conexion = db.session.connection()
+    if conexion.dialect.name == 'sqlite':
+        # Las lecturas previas no abren transacción en pysqlite; si ya hay una
+        # de escritura abierta, ésta ya tiene el cerrojo de la base.
+        if not conexion.connection.dbapi_connection.in_transaction:
+            conexion.exec_driver_sql('BEGIN IMMEDIATE')
+        return
+    # Orden fijo (terapeutas y luego gabinetes, por id) para evitar interbloqueos.
+    if terapeuta_ids:
+        Terapeuta.query.filter(Terapeuta.id.in_(sorted(set(terapeuta_ids)))).order_by(Terapeuta.id).with_for_update().all()
+    if gabinete_ids:
+        Gabinete.query.filter(Gabinete.id.in_(sorted(set(gabinete_ids)))).order_by(Gabinete.id).with_for_update().all()
+
+
+def reservar_cita(terapeuta_id, gabinete_id, cliente_id, tratamiento_id, inicio, fin, recepcionista_id=None, cita=None):
+    """Crea (o modifica, si se pasa `cita`) una cita de forma atómica.
+
+    Devuelve (cita, conflictos). Si hay algún conflicto bloqueante no se
+    guarda nada y la cita devuelta es None.
+    """
+    bloquear_recursos([terapeuta_id], [gabinete_id])
+    conflictos = detectar_conflictos(terapeuta_id, gabinete_id, cliente_id, inicio, fin,
+                                     excluir_cita_id=cita.id if cita is not None else None)
+    if any(c.bloqueante for c in conflictos):
+        db.session.rollback()
+        return None, conflictos
+
+    if cita is None:
+        cita = Cita(estado='Agendada', recepcionista_id=recepcionista_id)
+        db.session.add(cita)
+    cita.cliente_id, cita.terapeuta_id, cita.gabinete_id = cliente_id, terapeuta_id, gabinete_id
+    cita.tratamiento_id, cita.fecha_hora_inicio, cita.fecha_hora_fin = tratamiento_id, inicio, fin
+    db.session.commit()
+    return cita, conflictos
@@ -0,0 +1,113 @@
+# =================================================================
+# RESUMEN DIARIO INCREMENTAL
+# =================================================================
+# Cada vez que se crea, modifica, elimina o cambia de estado una Cita,
+# los eventos de sesión de SQLAlchemy ajustan las filas de ResumenDiario
+# afectadas dentro de la misma transacción (resta la contribución vieja
+# y suma la nueva). `flask reconstruir-resumen` lo recalcula desde cero.
+from collections import defaultdict
+
+from sqlalchemy import event, inspect, select, delete
+from sqlalchemy.orm import Session
+
+from app import db
+from app.archivo import fuente_citas
+from app.models import Cita, Tratamiento, ResumenDiario
+
+_CAMPOS = ('fecha_hora_inicio', 'fecha_hora_fin', 'terapeuta_id', 'gabinete_id', 'tratamiento_id', 'estado')
+_CLAVE_SESION = 'resumen_diario_deltas'
+
+
+def _contribucion(valores):
+    """(clave, minutos) con que una cita suma al resumen."""
+    inicio, fin = valores['fecha_hora_inicio'], valores['fecha_hora_fin']
+    clave = (inicio.date(), int(valores['terapeuta_id']), int(valores['gabinete_id']), int(valores['tratamiento_id']), valores['estado'])
+    return clave, int((fin - inicio).total_seconds() // 60)
+
+
+def _valores_actuales(cita):
+    return {campo: getattr(cita, campo) for campo in _CAMPOS}
+
+
+def _valores_anteriores(cita):
+    estado = inspect(cita)
+    valores = {}
+    for campo in _CAMPOS:
+        historia = estado.attrs[campo].history
+        # Si el atributo cambió sin haberse cargado antes no se conoce el valor viejo;
+        # en ese caso el resumen puede desviarse hasta la próxima reconstrucción.
+        valores[campo] = historia.deleted[0] if historia.deleted else getattr(cita, campo)
+    return valores
+
+
+def _acumular(deltas, valores, signo):
+    if any(valores[campo] is None for campo in _CAMPOS):
+        return
+    clave, minutos = _contribucion(valores)
+    cantidad_previa, minutos_previos = deltas[clave]
+    deltas[clave] = (cantidad_previa + signo, minutos_previos + signo * minutos)
+
+
+@event.listens_for(Session, 'before_flush')
+def _registrar_cambios(session, flush_context, instances):
+    deltas = session.info[_CLAVE_SESION] = defaultdict(lambda: (0, 0))
+    for cita in session.new:
+        if isinstance(cita, Cita):
+            _acumular(deltas, _valores_actuales(cita), +1)
+    for cita in session.dirty:
+        if isinstance(cita, Cita) and session.is_modified(cita, include_collections=False):
+            _acumular(deltas, _valores_anteriores(cita), -1)
+            _acumular(deltas, _valores_actuales(cita), +1)
+    for cita in session.deleted:
+        if isinstance(cita, Cita):
+            _acumular(deltas, _valores_anteriores(cita), -1)
+
+
+@event.listens_for(Session, 'after_flush')
+def _aplicar_cambios(session, flush_context):
+    deltas = {clave: d for clave, d in session.info.pop(_CLAVE_SESION, {}).items() if d != (0, 0)}
+    if deltas:
+        aplicar_deltas(session.connection(), deltas)
+
+
+def _insert_con_suma(conexion):
+    """INSERT ... ON CONFLICT DO UPDATE que suma sobre la fila existente (SQLite y PostgreSQL)."""
+    if conexion.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    tabla = ResumenDiario.__table__
+    sentencia = insert(tabla)
+    return sentencia.on_conflict_do_update(
+        index_elements=['fecha', 'terapeuta_id', 'gabinete_id', 'tratamiento_id', 'estado'],
+        set_={'cantidad': tabla.c.cantidad + sentencia.excluded.cantidad,
+              'minutos': tabla.c.minutos + sentencia.excluded.minutos,
+              'ingresos': tabla.c.ingresos + sentencia.excluded.ingresos})
+
+
+def aplicar_deltas(conexion, deltas):
+    """Suma {clave: (cantidad, minutos)} a ResumenDiario usando la conexión de la transacción actual."""
+    tratamiento_ids = {clave[3] for clave in deltas}
+    precios = dict(conexion.execute(select(Tratamiento.id, Tratamiento.precio).where(Tratamiento.id.in_(tratamiento_ids))).all())
+    filas = [{'fecha': fecha, 'terapeuta_id': terapeuta_id, 'gabinete_id': gabinete_id, 'tratamiento_id': tratamiento_id,
+              'estado': estado, 'cantidad': cantidad, 'minutos': minutos, 'ingresos': cantidad * (precios.get(tratamiento_id) or 0)}
+             for (fecha, terapeuta_id, gabinete_id, tratamiento_id, estado), (cantidad, minutos) in deltas.items()]
+    conexion.execute(_insert_con_suma(conexion), filas)
+    conexion.execute(delete(ResumenDiario.__table__).where(ResumenDiario.cantidad <= 0,
+                                                           ResumenDiario.fecha.in_({clave[0] for clave in deltas})))
+
+
+def reconstruir_resumen(tamano_lote=5000):
+    """Borra ResumenDiario y lo recalcula a partir de todas las citas, incluidas las archivadas.
+    Devuelve la cantidad de filas."""
+    cita = fuente_citas()
+    deltas = defaultdict(lambda: (0, 0))
+    consulta = select(*(getattr(cita, campo) for campo in _CAMPOS)).execution_options(yield_per=tamano_lote)
+    for fila in db.session.execute(consulta):
+        _acumular(deltas, dict(zip(_CAMPOS, fila)), +1)
+    conexion = db.session.connection()
+    conexion.execute(delete(ResumenDiario.__table__))
+    if deltas:
+        aplicar_deltas(conexion, deltas)
+    db.session.commit()
+    return len(deltas)
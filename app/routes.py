@@ -1,18 +1,36 @@
 # =================================================================
 # 1. IMPORTACIONES
 # =================================================================
-import pandas as pd
-from sqlalchemy import or_
-from io import BytesIO
+import os
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta, date
 from functools import wraps
 
-from flask import render_template, request, redirect, url_for, flash, send_file
+from flask import render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, abort
 from flask_login import login_user, logout_user, current_user, login_required
 
-from app import app, db, login
+from app import app, db, login, metricas
 from app.models import Recepcionista, Cita, Cliente, Terapeuta, Gabinete, Tratamiento, BloqueoHorario, Disponibilidad
 from app.forms import LoginForm, RegistrationForm, ChangePasswordForm, EditClientForm
+from app.agenda_datos import (citas_en_rango, eventos_en_rango, horarios_por_terapeuta, horarios_en_rango,
+                              rango_de_vista, dias_de_rango, CAMPOS_EVENTO)
+from app.cambios_agenda import version_de_dias
+from app.eventos_agenda import publicar, flujo_eventos, reservar_canal, liberar_canal
+from app.huecos import buscar_huecos, HORIZONTE_MAXIMO, LIMITE_HUECOS
+from app.itinerarios import reservar_itinerario, Paso
+from app.carga_masiva import filas_de_patron, filas_de_archivo, cargar, ErrorCarga, DIAS_SEMANA
+from app.reservas import reservar_cita
+from app.calendario import (FiltroAgenda, SIN_FILTRO, LIMITE_POR_DIA, eventos_calendario, grilla_semanal, semanas_del_mes,
+                            compacto)
+from app.identidad import cargar_usuario, es_admin
+from app.fragmentos import fragmento
+from app.archivo import fuente_citas, hay_historicas
+from app.catalogos import catalogos
+from app.busqueda import buscar_clientes, sugerencias, LIMITE_SUGERENCIAS
+from app.analitica import resumen_estados, ingresos_por, valor_cliente, clientes_mas_valiosos
+from app.exportacion import (COLUMNAS, TAMANO_PAGINA, hay_citas, pagina_reporte, codificar_cursor, decodificar_cursor,
+                             respuesta_csv, respuesta_excel)
+from app.ocupacion import OcupacionDia, FRANJAS_HORARIAS
 
 
 # =================================================================
@@ -20,16 +38,28 @@ from app.forms import LoginForm, RegistrationForm, ChangePasswordForm, EditClien
 # =================================================================
 @login.user_loader
 def load_user(id):
-    return Recepcionista.query.get(int(id))
+    # Identidad armada desde la sesión firmada; ver app/identidad.py.
+    return cargar_usuario(id)
 
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not current_user.is_admin:
+        # La identidad de la sesión puede tener hasta TTL_VERSION segundos; el rol se confirma en la base.
+        if not current_user.is_admin or not es_admin(current_user):
             return render_template('unauthorized.html'), 403
         return f(*args, **kwargs)
     return decorated_function
 
+PLANTILLAS_VISTA = {'grilla_diaria': '_agenda_grilla.html', 'vista_columnas': '_agenda_columnas.html', 'semana': '_agenda_semana.html',
+                    'mes': '_agenda_mes.html'}
+
+def informar_conflictos(conflictos):
+    """Muestra los conflictos como mensajes flash. Devuelve True si alguno impide agendar."""
+    bloqueantes = [c for c in conflictos if c.bloqueante]
+    for c in bloqueantes or conflictos:
+        flash(c.mensaje, 'danger' if c.bloqueante else 'warning')
+    return bool(bloqueantes)
+
 
 # =================================================================
 # 3. RUTAS DE AUTENTICACIÓN
@@ -67,10 +97,11 @@ def dashboard():
     ahora = datetime.now()
     hoy_inicio = ahora.replace(hour=0, minute=0, second=0, microsecond=0)
     hoy_fin = hoy_inicio + timedelta(days=1)
-    citas_hoy = Cita.query.filter(Cita.fecha_hora_inicio.between(hoy_inicio, hoy_fin)).order_by(Cita.fecha_hora_inicio).all()
-    total_citas = len(citas_hoy)
-    citas_finalizadas = sum(1 for c in citas_hoy if c.estado == 'Finalizada')
-    citas_canceladas = sum(1 for c in citas_hoy if c.estado == 'Cancelada')
+    citas_hoy = citas_en_rango(hoy_inicio, hoy_fin)
+    estados = resumen_estados(hoy_inicio, hoy_fin)
+    total_citas = sum(estados.values())
+    citas_finalizadas = estados.get('Finalizada', 0)
+    citas_canceladas = estados.get('Cancelada', 0)
     citas_pendientes = total_citas - citas_finalizadas - citas_canceladas
     proxima_cita = next((c for c in citas_hoy if c.fecha_hora_inicio > ahora and c.estado not in ['Finalizada', 'Cancelada']), None)
     return render_template('dashboard.html', title="Dashboard", total_citas=total_citas, citas_finalizadas=citas_finalizadas,
@@ -81,109 +112,168 @@ def dashboard():
 @login_required
 def agenda():
     vista = request.args.get('vista', 'grilla_diaria', type=str)
+    if vista not in PLANTILLAS_VISTA:
+        vista = 'grilla_diaria'
     fecha_str = request.args.get('fecha', datetime.now().strftime('%Y-%m-%d'), type=str)
     fecha_dt = datetime.strptime(fecha_str, '%Y-%m-%d')
     
-    todos_los_terapeutas = Terapeuta.query.order_by(Terapeuta.nombre).all()
-    
-    franjas_horarias = []
-    hora_temp = fecha_dt.replace(hour=7, minute=0)
-    while hora_temp.hour < 23:
-        franjas_horarias.append(hora_temp.strftime('%H:%M'))
-        hora_temp += timedelta(minutes=30)
+    catalogo = catalogos()
+    filtro = filtro_de_agenda() if vista in ('semana', 'mes') else SIN_FILTRO
     
     context = {
         "vista_actual": vista,
         "fecha_actual": fecha_dt,
-        "todos_los_terapeutas": todos_los_terapeutas,
-        "gabinetes": Gabinete.query.order_by(Gabinete.nombre).all(),
-        "tratamientos": Tratamiento.query.order_by(Tratamiento.nombre).all(),
-        "clientes": Cliente.query.order_by(Cliente.nombre).all(),
-        "franjas_horarias": franjas_horarias,
+        "todos_los_terapeutas": catalogo.terapeutas,
+        "gabinetes": catalogo.gabinetes,
+        "tratamientos": catalogo.tratamientos,
+        "franjas_horarias": FRANJAS_HORARIAS,
+        "filtro": filtro,
+        "filtros_url": {k: v for k, v in filtro._asdict().items() if v},
     }
-
+    version = version_de_vista(vista, fecha_dt, catalogo.version, filtro)
+    if request.args.get('parcial') and request.if_none_match.contains(version):
+        # Refresco desde el navegador sin cambios: ni consultas ni HTML.
+        return app.response_class(status=304)
+    # La clave cambia con cualquier modificación de los días mostrados (ver app/fragmentos.py),
+    # así que si el HTML ya está guardado no hace falta consultar ni renderizar nada más.
+    clave = f'{vista}|{fecha_str}|{filtro.terapeuta_id}|{filtro.gabinete_id}|{filtro.tratamiento_id}|{version}'
+    contenido = fragmento(clave, lambda: render_template(PLANTILLAS_VISTA[vista], **context, **datos_de_vista(vista, fecha_dt, catalogo, filtro)))
+
+    if request.args.get('parcial'):
+        # Sólo el contenido de la vista, para el refresco incremental desde el navegador.
+        respuesta = app.make_response(contenido)
+        respuesta.set_etag(version)
+        respuesta.headers['Cache-Control'] = 'no-cache'
+        return respuesta
+    return render_template('agenda.html', contenido_agenda=contenido, version_agenda=version, **context)
+
+def datos_de_vista(vista, fecha_dt, catalogo, filtro):
+    """Variables que necesita la plantilla parcial de cada vista de la agenda."""
+    todos_los_terapeutas = catalogo.terapeutas
     if vista == 'grilla_diaria':
         inicio_dia = fecha_dt.replace(hour=0, minute=0, second=0)
         fin_dia = inicio_dia + timedelta(days=1)
         
-        terapeutas_disponibles_ids = {d.terapeuta_id for d in Disponibilidad.query.filter_by(fecha=fecha_dt.date()).all()}
-        terapeutas_para_vista = [t for t in todos_los_terapeutas if t.id in terapeutas_disponibles_ids]
+        horarios_dia = horarios_por_terapeuta(fecha_dt.date())
+        terapeutas_para_vista = [t for t in todos_los_terapeutas if t.id in horarios_dia]
         
         agenda_diaria = {}
         if terapeutas_para_vista:
-            citas_dia = Cita.query.filter(Cita.fecha_hora_inicio.between(inicio_dia, fin_dia)).all()
-            bloqueos_dia = BloqueoHorario.query.filter(BloqueoHorario.fecha_hora_inicio.between(inicio_dia, fin_dia)).all()
-            
-            for franja in franjas_horarias:
-                agenda_diaria[franja] = {t.id: {'status': 'no_disponible', 'evento': None, 'render': True, 'rowspan': 1} for t in terapeutas_para_vista}
-            
-            for terapeuta in terapeutas_para_vista:
-                disponibilidades_dia = Disponibilidad.query.filter_by(terapeuta_id=terapeuta.id, fecha=fecha_dt.date()).all()
-                if disponibilidades_dia:
-                    for franja in franjas_horarias:
-                        hora_franja = datetime.strptime(franja, '%H:%M').time()
-                        for d in disponibilidades_dia:
-                            if d.hora_inicio <= hora_franja < d.hora_fin:
-                                agenda_diaria[franja][terapeuta.id]['status'] = 'disponible'
-                                break 
-            
-            for evento in sorted(citas_dia + bloqueos_dia, key=lambda x: x.fecha_hora_inicio):
-                if evento.terapeuta_id in {t.id for t in terapeutas_para_vista}:
-                    duracion = (evento.fecha_hora_fin - evento.fecha_hora_inicio).total_seconds() / 60
-                    rowspan = int(duracion / 30) if duracion > 0 else 1
-                    franja_inicio_str = evento.fecha_hora_inicio.strftime('%H:%M')
-                    if franja_inicio_str in agenda_diaria:
-                        status = 'cita' if isinstance(evento, Cita) else 'bloqueo'
-                        agenda_diaria[franja_inicio_str][evento.terapeuta_id] = {'status': status, 'evento': evento, 'render': True, 'rowspan': rowspan}
-                        hora_iter = evento.fecha_hora_inicio + timedelta(minutes=30)
-                        while hora_iter < evento.fecha_hora_fin:
-                            franja_temp_str = hora_iter.strftime('%H:%M')
-                            if franja_temp_str in agenda_diaria:
-                                agenda_diaria[franja_temp_str][evento.terapeuta_id]['render'] = False
-                            hora_iter += timedelta(minutes=30)
+            ocupacion = OcupacionDia(horarios_dia, eventos_en_rango(inicio_dia, fin_dia))
+            agenda_diaria = ocupacion.grilla(terapeutas_para_vista)
         
-        context.update({"terapeutas": terapeutas_para_vista, "agenda_diaria": agenda_diaria})
+        return {"terapeutas": terapeutas_para_vista, "agenda_diaria": agenda_diaria}
 
-    elif vista == 'vista_columnas':
+    if vista == 'vista_columnas':
         inicio_dia = fecha_dt.replace(hour=0, minute=0, second=0)
         fin_dia = inicio_dia + timedelta(days=1)
-        terapeutas_disponibles_ids = {d.terapeuta_id for d in Disponibilidad.query.filter_by(fecha=fecha_dt.date()).all()}
-        citas = Cita.query.filter(Cita.fecha_hora_inicio.between(inicio_dia, fin_dia)).order_by(Cita.fecha_hora_inicio).all()
-        bloqueos = BloqueoHorario.query.filter(BloqueoHorario.fecha_hora_inicio.between(inicio_dia, fin_dia)).all()
-        eventos = sorted(citas + bloqueos, key=lambda x: x.fecha_hora_inicio)
-        context.update({"terapeutas_disponibles_ids": terapeutas_disponibles_ids, "eventos": eventos, "terapeutas": todos_los_terapeutas})
-
-    elif vista == 'semana':
-        start_of_week = fecha_dt - timedelta(days=fecha_dt.weekday())
-        end_of_week = start_of_week + timedelta(days=7)
-        dias_de_la_semana = [start_of_week + timedelta(days=i) for i in range(7)]
-        
-        citas_semana = Cita.query.filter(Cita.fecha_hora_inicio.between(start_of_week, end_of_week)).all()
-        bloqueos_semana = BloqueoHorario.query.filter(BloqueoHorario.fecha_hora_inicio.between(start_of_week, end_of_week)).all()
-        eventos_semana = sorted(citas_semana + bloqueos_semana, key=lambda x: x.fecha_hora_inicio)
-        
-        agenda_semanal = {franja: {i: {'eventos': [], 'render': True, 'rowspan': 1} for i in range(7)} for franja in franjas_horarias}
+        terapeutas_disponibles_ids = set(horarios_por_terapeuta(fecha_dt.date()))
+        eventos = eventos_en_rango(inicio_dia, fin_dia)
+        return {"terapeutas_disponibles_ids": terapeutas_disponibles_ids, "eventos": eventos, "terapeutas": todos_los_terapeutas}
+
+    inicio, fin = rango_de_vista(vista, fecha_dt)
+    eventos = eventos_calendario(inicio, fin, filtro)
+    datos = {"nombres_terapeutas": {t.id: t.nombre for t in todos_los_terapeutas}}
+    if vista == 'semana':
+        datos.update({"dias_de_la_semana": [inicio + timedelta(days=i) for i in range(7)],
+                      "grilla_semanal": grilla_semanal(inicio.date(), eventos)})
+    else:
+        datos.update({"semanas": semanas_del_mes(inicio, fin, eventos), "limite_por_dia": LIMITE_POR_DIA})
+    return datos
 
-        for evento in eventos_semana:
-            dia_idx = evento.fecha_hora_inicio.weekday()
-            franja_inicio_str = evento.fecha_hora_inicio.strftime('%H:%M')
-            
-            if franja_inicio_str in agenda_semanal:
-                if evento not in agenda_semanal[franja_inicio_str][dia_idx]['eventos']:
-                    agenda_semanal[franja_inicio_str][dia_idx]['eventos'].append(evento)
-                    duracion = (evento.fecha_hora_fin - evento.fecha_hora_inicio).total_seconds() / 60
-                    rowspan = int(duracion / 30) if duracion > 0 else 1
-                    agenda_semanal[franja_inicio_str][dia_idx]['rowspan'] = max(agenda_semanal[franja_inicio_str][dia_idx]['rowspan'], rowspan)
-                    hora_iter = evento.fecha_hora_inicio + timedelta(minutes=30)
-                    while hora_iter < evento.fecha_hora_fin:
-                        franja_temp_str = hora_iter.strftime('%H:%M')
-                        if franja_temp_str in agenda_semanal:
-                            agenda_semanal[franja_temp_str][dia_idx]['render'] = False
-                        hora_iter += timedelta(minutes=30)
-                        
-        context.update({"dias_de_la_semana": dias_de_la_semana, "agenda_semanal": agenda_semanal})
-    
-    return render_template('agenda.html', **context)
+def filtro_de_agenda():
+    """Filtros de terapeuta, gabinete y tratamiento de las vistas de semana y mes."""
+    return FiltroAgenda(request.args.get('terapeuta_id', type=int), request.args.get('gabinete_id', type=int),
+                        request.args.get('tratamiento_id', type=int))
+
+def version_de_vista(vista, fecha_dt, version_catalogos, filtro):
+    """ETag de una vista: cambia con los días mostrados, los catálogos y los filtros aplicados."""
+    inicio, fin = rango_de_vista(vista, fecha_dt)
+    return version_de_dias(dias_de_rango(inicio, fin), vista, version_catalogos, *filtro)
+
+@app.route('/api/agenda')
+@login_required
+def api_agenda():
+    vista = request.args.get('vista', 'grilla_diaria', type=str)
+    if vista not in PLANTILLAS_VISTA:
+        return jsonify({'error': 'Vista inválida.'}), 400
+    try:
+        fecha_dt = datetime.strptime(request.args.get('fecha', datetime.now().strftime('%Y-%m-%d'), type=str), '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'Fecha inválida.'}), 400
+    catalogo = catalogos()
+    filtro = filtro_de_agenda()
+    version = version_de_vista(vista, fecha_dt, catalogo.version, filtro)
+    if request.if_none_match.contains(version):
+        respuesta = app.response_class(status=304)
+    else:
+        inicio, fin = rango_de_vista(vista, fecha_dt)
+        horarios = horarios_en_rango(inicio.date(), fin.date())
+        respuesta = jsonify({
+            'fecha': fecha_dt.strftime('%Y-%m-%d'),
+            'vista': vista,
+            'version': version,
+            'terapeutas': [[t.id, t.nombre] for t in catalogo.terapeutas],
+            'disponibilidad': {f.isoformat(): {tid: [list(tramo) for tramo in intervalos] for tid, intervalos in por_terapeuta.items()}
+                               for f, por_terapeuta in horarios.items()},
+            'campos': CAMPOS_EVENTO,
+            'eventos': [compacto(e, catalogo) for e in eventos_calendario(inicio, fin, filtro)],
+        })
+    respuesta.set_etag(version)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta
+
+@app.route('/api/agenda/eventos')
+@login_required
+def api_agenda_eventos():
+    vista = request.args.get('vista', 'grilla_diaria', type=str)
+    try:
+        fecha_dt = datetime.strptime(request.args.get('fecha', datetime.now().strftime('%Y-%m-%d'), type=str), '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'Fecha inválida.'}), 400
+    if not reservar_canal():
+        # Sin canales en este worker: con 204 EventSource no reintenta y la página sigue por sondeo.
+        return app.response_class(status=204)
+    inicio, fin = rango_de_vista(vista, fecha_dt)
+    despues_de = request.headers.get('Last-Event-ID', type=int)
+    respuesta = Response(stream_with_context(flujo_eventos(inicio.date(), fin.date(), despues_de)),
+                         mimetype='text/event-stream')
+    respuesta.call_on_close(liberar_canal)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.headers['X-Accel-Buffering'] = 'no'
+    return respuesta
+
+@app.route('/api/huecos')
+@login_required
+def api_huecos():
+    catalogo = catalogos()
+    try:
+        tratamiento = catalogo.tratamientos_por_id[request.args.get('tratamiento_id', type=int)]
+        desde = datetime.strptime(request.args.get('desde', datetime.now().strftime('%Y-%m-%d')), '%Y-%m-%d').date()
+        hasta = datetime.strptime(request.args['hasta'], '%Y-%m-%d').date() if request.args.get('hasta') else desde + timedelta(days=13)
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Tratamiento o fechas inválidos.'}), 400
+    if hasta < desde or (hasta - desde).days >= HORIZONTE_MAXIMO:
+        return jsonify({'error': f'El rango debe tener entre 1 y {HORIZONTE_MAXIMO} días.'}), 400
+
+    terapeutas = catalogo.terapeutas
+    terapeuta_id = request.args.get('terapeuta_id', type=int)
+    especialidad = request.args.get('especialidad', '').strip().lower()
+    if terapeuta_id:
+        terapeutas = [t for t in terapeutas if t.id == terapeuta_id]
+    elif especialidad:
+        terapeutas = [t for t in terapeutas if especialidad in (t.especialidad or '').lower()]
+    gabinetes = catalogo.gabinetes
+    gabinete_id = request.args.get('gabinete_id', type=int)
+    if gabinete_id:
+        gabinetes = [g for g in gabinetes if g.id == gabinete_id]
+    limite = min(request.args.get('limite', LIMITE_HUECOS, type=int), 50)
+
+    huecos = buscar_huecos(tratamiento.duracion, terapeutas, gabinetes, desde, hasta, limite)
+    return jsonify({'tratamiento': tratamiento.nombre, 'duracion': tratamiento.duracion,
+                    'huecos': [{'inicio': h.inicio.isoformat(timespec='minutes'), 'fin': h.fin.isoformat(timespec='minutes'),
+                                'terapeuta_id': h.terapeuta.id, 'terapeuta': h.terapeuta.nombre,
+                                'gabinete_id': h.gabinete.id, 'gabinete': h.gabinete.nombre} for h in huecos]})
 
 @app.route('/citas/nueva', methods=['POST'])
 @login_required
@@ -201,49 +291,45 @@ def nueva_cita():
             return redirect(url_for('agenda', fecha=fecha or datetime.now().strftime('%Y-%m-%d')))
 
         fecha_hora_inicio = datetime.strptime(f"{fecha} {hora}", '%Y-%m-%d %H:%M')
-        tratamiento = Tratamiento.query.get(tratamiento_id)
+        tratamiento = catalogos().tratamientos_por_id[int(tratamiento_id)]
         fecha_hora_fin = fecha_hora_inicio + timedelta(minutes=tratamiento.duracion)
 
-        disponibilidad_valida = False
-        disponibilidades_dia = Disponibilidad.query.filter_by(terapeuta_id=terapeuta_id, fecha=fecha_hora_inicio.date()).all()
-        for d in disponibilidades_dia:
-            if d.hora_inicio <= fecha_hora_inicio.time() and d.hora_fin >= fecha_hora_fin.time():
-                disponibilidad_valida = True
-                break
-        
-        if not disponibilidad_valida:
-            flash(f'El terapeuta no tiene disponibilidad definida para ese horario.', 'danger')
-            return redirect(url_for('agenda', fecha=fecha))
-
-        bloqueo_existente = BloqueoHorario.query.filter(BloqueoHorario.terapeuta_id == terapeuta_id, BloqueoHorario.fecha_hora_inicio < fecha_hora_fin, BloqueoHorario.fecha_hora_fin > fecha_hora_inicio).first()
-        if bloqueo_existente:
-            flash(f'El horario seleccionado está bloqueado por: "{bloqueo_existente.titulo}".', 'danger')
+        cita, conflictos = reservar_cita(terapeuta_id, int(gabinete_id), int(cliente_id), int(tratamiento_id),
+                                         fecha_hora_inicio, fecha_hora_fin, recepcionista_id=current_user.id)
+        if informar_conflictos(conflictos):
             return redirect(url_for('agenda', fecha=fecha))
-
-        cita_terapeuta_existente = Cita.query.filter(Cita.terapeuta_id == terapeuta_id, Cita.fecha_hora_inicio < fecha_hora_fin, Cita.fecha_hora_fin > fecha_hora_inicio).first()
-        if cita_terapeuta_existente:
-            flash('El terapeuta ya tiene otra cita en ese horario.', 'danger')
-            return redirect(url_for('agenda', fecha=fecha))
-
-        cita_gabinete_existente = Cita.query.filter(Cita.gabinete_id == gabinete_id, Cita.fecha_hora_inicio < fecha_hora_fin, Cita.fecha_hora_fin > fecha_hora_inicio).first()
-        if cita_gabinete_existente:
-            gabinete_obj = Gabinete.query.get(gabinete_id)
-            flash(f'Error: El gabinete "{gabinete_obj.nombre}" ya está ocupado.', 'danger')
-            return redirect(url_for('agenda', fecha=fecha))
-
-        cita_cliente_existente = Cita.query.filter(Cita.cliente_id == cliente_id, Cita.fecha_hora_inicio < fecha_hora_fin, Cita.fecha_hora_fin > fecha_hora_inicio).first()
-        if cita_cliente_existente:
-            flash(f'Advertencia: El cliente ya tiene otra cita en un horario similar.', 'warning')
-        
-        nueva_cita = Cita(fecha_hora_inicio=fecha_hora_inicio, fecha_hora_fin=fecha_hora_fin, cliente_id=cliente_id, terapeuta_id=terapeuta_id, gabinete_id=gabinete_id, tratamiento_id=tratamiento_id, estado='Agendada', recepcionista_id=current_user.id)
-        db.session.add(nueva_cita)
-        db.session.commit()
+        publicar('creada', cita)
         flash('¡Cita agendada con éxito!', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Ocurrió un error al agendar la cita: {str(e)}', 'danger')
     return redirect(url_for('agenda', fecha=request.form.get('fecha')))
 
+@app.route('/citas/itinerario', methods=['POST'])
+@login_required
+def nueva_cita_itinerario():
+    fecha = request.form.get('fecha')
+    try:
+        cliente_id = request.form.get('cliente_id')
+        hora = request.form.get('hora')
+        tratamiento_ids = [int(t) for t in request.form.getlist('tratamiento_ids') if t]
+        if not all([cliente_id, fecha, hora, tratamiento_ids]):
+            flash('Cliente, fecha, hora y al menos un tratamiento son obligatorios.', 'danger')
+            return redirect(url_for('agenda', fecha=fecha or datetime.now().strftime('%Y-%m-%d')))
+
+        inicio = datetime.strptime(f"{fecha} {hora}", '%Y-%m-%d %H:%M')
+        pasos = [Paso(tid, None, None) for tid in tratamiento_ids]
+        citas, conflictos = reservar_itinerario(int(cliente_id), pasos, inicio, recepcionista_id=current_user.id)
+        if informar_conflictos(conflictos):
+            return redirect(url_for('agenda', fecha=fecha))
+        for cita in citas:
+            publicar('creada', cita)
+        flash(f'Itinerario agendado: {len(citas)} citas de {inicio.strftime("%H:%M")} a {citas[-1].fecha_hora_fin.strftime("%H:%M")}.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Ocurrió un error al agendar el itinerario: {str(e)}', 'danger')
+    return redirect(url_for('agenda', fecha=fecha))
+
 @app.route('/citas/editar/<int:id>', methods=['POST'])
 @login_required
 def editar_cita(id):
@@ -254,43 +340,14 @@ def editar_cita(id):
         cliente_id, gabinete_id, tratamiento_id = request.form.get('cliente_id'), request.form.get('gabinete_id'), request.form.get('tratamiento_id')
         
         fecha_hora_inicio = datetime.strptime(f"{fecha} {hora}", '%Y-%m-%d %H:%M')
-        tratamiento = Tratamiento.query.get(tratamiento_id)
+        tratamiento = catalogos().tratamientos_por_id[int(tratamiento_id)]
         fecha_hora_fin = fecha_hora_inicio + timedelta(minutes=tratamiento.duracion)
 
-        disponibilidad_valida = False
-        disponibilidades_dia = Disponibilidad.query.filter_by(terapeuta_id=terapeuta_id, fecha=fecha_hora_inicio.date()).all()
-        for d in disponibilidades_dia:
-            if d.hora_inicio <= fecha_hora_inicio.time() and d.hora_fin >= fecha_hora_fin.time():
-                disponibilidad_valida = True
-                break
-        
-        if not disponibilidad_valida:
-            flash(f'El terapeuta no tiene disponibilidad definida para ese horario.', 'danger')
-            return redirect(url_for('agenda', fecha=fecha))
-
-        bloqueo_existente = BloqueoHorario.query.filter(BloqueoHorario.terapeuta_id == terapeuta_id, BloqueoHorario.fecha_hora_inicio < fecha_hora_fin, BloqueoHorario.fecha_hora_fin > fecha_hora_inicio).first()
-        if bloqueo_existente:
-            flash(f'El horario seleccionado está bloqueado por: "{bloqueo_existente.titulo}".', 'danger')
-            return redirect(url_for('agenda', fecha=fecha))
-
-        cita_terapeuta_existente = Cita.query.filter(Cita.id != id, Cita.terapeuta_id == terapeuta_id, Cita.fecha_hora_inicio < fecha_hora_fin, Cita.fecha_hora_fin > fecha_hora_inicio).first()
-        if cita_terapeuta_existente:
-            flash('El terapeuta ya tiene otra cita en ese horario.', 'danger')
+        cita, conflictos = reservar_cita(terapeuta_id, int(gabinete_id), int(cliente_id), int(tratamiento_id),
+                                         fecha_hora_inicio, fecha_hora_fin, cita=cita_a_editar)
+        if informar_conflictos(conflictos):
             return redirect(url_for('agenda', fecha=fecha))
-
-        cita_gabinete_existente = Cita.query.filter(Cita.id != id, Cita.gabinete_id == gabinete_id, Cita.fecha_hora_inicio < fecha_hora_fin, Cita.fecha_hora_fin > fecha_hora_inicio).first()
-        if cita_gabinete_existente:
-            gabinete_obj = Gabinete.query.get(gabinete_id)
-            flash(f'Error: El gabinete "{gabinete_obj.nombre}" ya está ocupado.', 'danger')
-            return redirect(url_for('agenda', fecha=fecha))
-
-        cita_cliente_existente = Cita.query.filter(Cita.id != id, Cita.cliente_id == cliente_id, Cita.fecha_hora_inicio < fecha_hora_fin, Cita.fecha_hora_fin > fecha_hora_inicio).first()
-        if cita_cliente_existente:
-            flash(f'Advertencia: El cliente ya tiene otra cita en un horario similar.', 'warning')
-
-        cita_a_editar.cliente_id, cita_a_editar.terapeuta_id, cita_a_editar.gabinete_id = int(cliente_id), int(terapeuta_id), int(gabinete_id)
-        cita_a_editar.tratamiento_id, cita_a_editar.fecha_hora_inicio, cita_a_editar.fecha_hora_fin = int(tratamiento_id), fecha_hora_inicio, fecha_hora_fin
-        db.session.commit()
+        publicar('editada', cita, fecha_anterior=datetime.strptime(fecha_original, '%Y-%m-%d').date())
         flash('Cita actualizada con éxito!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -305,6 +362,7 @@ def eliminar_cita(id):
     try:
         db.session.delete(cita_a_eliminar)
         db.session.commit()
+        publicar('eliminada', cita_a_eliminar)
         flash('Cita eliminada correctamente.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -321,6 +379,7 @@ def cambiar_estado_cita(id):
         if nuevo_estado:
             cita.estado = nuevo_estado
             db.session.commit()
+            publicar('estado', cita)
             flash('Estado de la cita actualizado con éxito.', 'info')
     except Exception as e:
         db.session.rollback()
@@ -379,13 +438,19 @@ def gestionar_clientes():
     q = request.args.get('q', '', type=str)
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
-    query = Cliente.query
-    if q:
-        query = query.filter(or_(Cliente.nombre.ilike(f'%{q}%'), Cliente.telefono.like(f'%{q}%')))
+    query = buscar_clientes(q)
     clientes_paginados = query.order_by(Cliente.nombre).paginate(page=page, per_page=per_page, error_out=False)
     form = EditClientForm(original_telefono=None)
     return render_template('manage_clientes.html', clientes_paginados=clientes_paginados, form=form, title='Gestionar Clientes', query_busqueda=q, per_page=per_page)
 
+@app.route('/api/clientes/buscar')
+@login_required
+def api_buscar_clientes():
+    q = request.args.get('q', '', type=str)
+    limite = min(max(request.args.get('limite', LIMITE_SUGERENCIAS, type=int), 1), 50)
+    # Formato de resultados que espera Select2.
+    return jsonify({'results': [{'id': c.id, 'text': f'{c.nombre} - {c.telefono}'} for c in sugerencias(q, limite)]})
+
 # --- INICIO: RUTA EDITAR CLIENTE REFACTORIZADA ---
 @app.route('/clientes/editar/<int:id>', methods=['POST'])
 @login_required
@@ -418,7 +483,7 @@ def editar_cliente(id):
 @login_required
 def eliminar_cliente(id):
     cliente_a_eliminar = Cliente.query.get_or_404(id)
-    if cliente_a_eliminar.citas:
+    if cliente_a_eliminar.citas or hay_historicas(cliente_id=id):
         flash('Este cliente no se puede eliminar porque tiene citas en su historial.', 'danger')
     else:
         db.session.delete(cliente_a_eliminar)
@@ -430,9 +495,10 @@ def eliminar_cliente(id):
 @login_required
 def detalle_cliente(cliente_id):
     cliente = Cliente.query.get_or_404(cliente_id)
-    citas = Cita.query.filter_by(cliente_id=cliente.id).order_by(Cita.fecha_hora_inicio.desc()).all()
-    total_gastado = sum(c.tratamiento.precio for c in citas if c.estado == 'Finalizada' and c.tratamiento.precio)
-    citas_finalizadas = sum(1 for c in citas if c.estado == 'Finalizada')
+    cita = fuente_citas()
+    citas = (db.session.query(cita).options(joinedload(cita.tratamiento), joinedload(cita.terapeuta))
+             .filter(cita.cliente_id == cliente.id).order_by(cita.fecha_hora_inicio.desc()).all())
+    citas_finalizadas, total_gastado = valor_cliente(cliente.id)
     return render_template('detalle_cliente.html', title=f"Detalle de {cliente.nombre}", cliente=cliente, citas=citas,
                            total_gastado=total_gastado, citas_finalizadas=citas_finalizadas)
 
@@ -458,7 +524,7 @@ def gestionar_terapeutas():
 @admin_required
 def eliminar_terapeuta(id):
     terapeuta_a_eliminar = Terapeuta.query.get_or_404(id)
-    if terapeuta_a_eliminar.citas or terapeuta_a_eliminar.bloqueos or terapeuta_a_eliminar.disponibilidades:
+    if terapeuta_a_eliminar.citas or hay_historicas(terapeuta_id=id) or terapeuta_a_eliminar.bloqueos or terapeuta_a_eliminar.disponibilidades:
         flash('No se puede eliminar un terapeuta con citas, disponibilidades o bloqueos asociados.', 'danger')
         return redirect(url_for('gestionar_terapeutas'))
         
@@ -524,6 +590,41 @@ def detalle_terapeuta_config(terapeuta_id):
                            bloqueos=bloqueos,
                            title=f"Configurar a {terapeuta.nombre}")
 
+@app.route('/configuracion/horarios/carga_masiva', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def carga_masiva_horarios():
+    if request.method == 'POST':
+        tipo = request.form.get('tipo', 'disponibilidad')
+        try:
+            if request.form.get('form_type') == 'archivo':
+                archivo = request.files.get('archivo')
+                if not archivo or not archivo.filename:
+                    flash('Selecciona un archivo CSV o XLSX.', 'danger')
+                    return redirect(url_for('carga_masiva_horarios'))
+                filas = filas_de_archivo(archivo.stream, archivo.filename)
+            else:
+                filas = filas_de_patron(
+                    [int(t) for t in request.form.getlist('terapeuta_ids')],
+                    datetime.strptime(request.form.get('desde'), '%Y-%m-%d').date(),
+                    datetime.strptime(request.form.get('hasta'), '%Y-%m-%d').date(),
+                    [int(d) for d in request.form.getlist('dias_semana')],
+                    datetime.strptime(request.form.get('hora_inicio'), '%H:%M').time(),
+                    datetime.strptime(request.form.get('hora_fin'), '%H:%M').time(),
+                    request.form.get('titulo'))
+            guardadas = cargar(tipo, filas)
+            flash(f'Se cargaron {guardadas} horarios.', 'success')
+        except ErrorCarga as e:
+            db.session.rollback()
+            flash('No se guardó ningún horario. ' + ' '.join(e.errores), 'danger')
+        except (ValueError, TypeError) as e:
+            db.session.rollback()
+            flash(f'Datos inválidos: {str(e)}', 'danger')
+        return redirect(url_for('carga_masiva_horarios'))
+
+    return render_template('carga_masiva.html', terapeutas=catalogos().terapeutas, dias_semana=DIAS_SEMANA,
+                           title="Carga masiva de horarios")
+
 @app.route('/configuracion/terapeutas/disponibilidad/eliminar/<int:id>', methods=['POST'])
 @login_required
 @admin_required
@@ -638,6 +739,22 @@ def eliminar_usuario(id):
     flash('Usuario eliminado correctamente.', 'success')
     return redirect(url_for('gestionar_usuarios'))
 
+@app.route('/admin/metrics')
+def admin_metricas():
+    if not metricas.activas(app):
+        abort(404)
+    token = app.config['METRICAS_TOKEN']
+    con_token = token and request.headers.get('Authorization') == f'Bearer {token}'
+    if not con_token:
+        if not current_user.is_authenticated:
+            return app.login_manager.unauthorized()
+        if not current_user.is_admin or not es_admin(current_user):
+            return render_template('unauthorized.html'), 403
+    if con_token or request.args.get('formato') == 'prometheus':
+        return Response(metricas.texto_prometheus(), mimetype='text/plain; version=0.0.4')
+    return render_template('admin_metricas.html', filas=metricas.resumen(), percentiles=metricas.PERCENTILES,
+                           umbral=app.config['METRICAS_UMBRAL_LENTO_MS'], pid=os.getpid(), title="Métricas")
+
 @app.route('/admin/crear_usuario', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -667,18 +784,80 @@ def reportes():
             return redirect(url_for('reportes'))
         fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d')
         fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-        citas_query = Cita.query.filter(Cita.fecha_hora_inicio.between(fecha_inicio, fecha_fin)).order_by(Cita.fecha_hora_inicio).all()
-        if not citas_query:
+        if not hay_citas(fecha_inicio, fecha_fin):
             flash('No se encontraron citas en el rango de fechas seleccionado.', 'info')
             return redirect(url_for('reportes'))
-        datos_reporte = [{'Fecha': c.fecha_hora_inicio.strftime('%Y-%m-%d'), 'Hora': c.fecha_hora_inicio.strftime('%H:%M'), 'Cliente': c.cliente.nombre, 'Teléfono Cliente': c.cliente.telefono, 'Tratamiento': c.tratamiento.nombre, 'Duración (min)': c.tratamiento.duracion, 'Terapeuta': c.terapeuta.nombre, 'Gabinete': c.gabinete.nombre, 'Estado': c.estado, 'Agendado Por': c.agendado_por.username if c.agendado_por else 'Sistema'} for c in citas_query]
-        df = pd.DataFrame(datos_reporte)
         if formato == 'excel':
-            output = BytesIO()
-            df.to_excel(output, index=False, sheet_name='Reporte Citas')
-            output.seek(0)
-            return send_file(output, download_name='reporte_citas.xlsx', as_attachment=True)
+            return respuesta_excel(fecha_inicio, fecha_fin)
+        elif formato == 'csv':
+            return respuesta_csv(fecha_inicio, fecha_fin)
         else:
-            tabla_html = df.to_html(classes='table table-striped table-hover', index=False, border=0)
-            return render_template('reporte_resultado.html', tabla_html=tabla_html, title="Resultado del Reporte")
+            # La tabla se completa desde el navegador, página por página, con /reportes/datos.
+            return render_template('reporte_resultado.html', columnas=COLUMNAS, fecha_inicio=fecha_inicio_str,
+                                   fecha_fin=fecha_fin_str, title="Resultado del Reporte")
     return render_template('reportes.html', title="Generar Reportes")
+
+@app.route('/reportes/datos')
+@login_required
+def reportes_datos():
+    try:
+        fecha_inicio = datetime.strptime(request.args.get('fecha_inicio', ''), '%Y-%m-%d')
+        fecha_fin = datetime.strptime(request.args.get('fecha_fin', ''), '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+        despues = decodificar_cursor(request.args.get('despues'))
+    except ValueError:
+        return jsonify({'error': 'Parámetros inválidos.'}), 400
+    limite = min(max(request.args.get('limite', TAMANO_PAGINA, type=int), 1), 1000)
+    filas, siguiente = pagina_reporte(fecha_inicio, fecha_fin, despues=despues, limite=limite)
+    return jsonify({'filas': filas, 'siguiente': codificar_cursor(siguiente)})
+
+@app.route('/analitica')
+@login_required
+def analitica():
+    hoy = date.today()
+    fecha_inicio_str = request.args.get('fecha_inicio', hoy.replace(day=1).strftime('%Y-%m-%d'), type=str)
+    fecha_fin_str = request.args.get('fecha_fin', hoy.strftime('%Y-%m-%d'), type=str)
+    try:
+        fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d')
+        fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d') + timedelta(days=1)
+    except ValueError:
+        abort(400)
+    return render_template('analitica.html', title="Analítica",
+                           fecha_inicio=fecha_inicio_str, fecha_fin=fecha_fin_str,
+                           estados=resumen_estados(fecha_inicio, fecha_fin),
+                           por_terapeuta=ingresos_por('terapeuta', fecha_inicio, fecha_fin),
+                           por_tratamiento=ingresos_por('tratamiento', fecha_inicio, fecha_fin),
+                           por_gabinete=ingresos_por('gabinete', fecha_inicio, fecha_fin),
+                           por_dia=ingresos_por('dia', fecha_inicio, fecha_fin),
+                           mejores_clientes=clientes_mas_valiosos(fecha_inicio, fecha_fin))
+
+@app.route('/analitica/ocupacion')
+@login_required
+def analitica_ocupacion():
+    # NumPy se importa recién al usar esta página, para no sumarlo al arranque de cada worker.
+    from app.utilizacion import DIMENSIONES, MAXIMO_DIAS, DIAS_SEMANA, HORAS, calcular, mapa, resumen_por_recurso, color, respuesta_excel
+    hoy = date.today()
+    fecha_inicio_str = request.args.get('fecha_inicio', (hoy - timedelta(days=90)).strftime('%Y-%m-%d'), type=str)
+    fecha_fin_str = request.args.get('fecha_fin', hoy.strftime('%Y-%m-%d'), type=str)
+    dimension = request.args.get('dimension', 'terapeuta')
+    if dimension not in DIMENSIONES:
+        dimension = 'terapeuta'
+    try:
+        fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d')
+        fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d') + timedelta(days=1)
+    except ValueError:
+        abort(400)
+    if fecha_fin <= fecha_inicio or (fecha_fin - fecha_inicio).days > MAXIMO_DIAS:
+        flash(f'El rango debe tener entre 1 y {MAXIMO_DIAS} días.', 'warning')
+        return redirect(url_for('analitica_ocupacion'))
+
+    utilizacion = calcular(dimension, fecha_inicio, fecha_fin)
+    if request.args.get('formato') == 'excel':
+        return respuesta_excel(utilizacion, f'ocupacion_{dimension}_{fecha_inicio_str}_{fecha_fin_str}.xlsx')
+    ids = [id_recurso for id_recurso, _ in utilizacion.recursos]
+    recurso_id = request.args.get('recurso_id', type=int)
+    indice = ids.index(recurso_id) if recurso_id in ids else None
+    return render_template('ocupacion.html', title="Ocupación", fecha_inicio=fecha_inicio_str, fecha_fin=fecha_fin_str,
+                           dimension=dimension, recursos=utilizacion.recursos,
+                           recurso_id=recurso_id if indice is not None else None,
+                           mapa=mapa(utilizacion, indice), resumen=resumen_por_recurso(utilizacion),
+                           dias=DIAS_SEMANA, horas=HORAS, color=color)
@@ -0,0 +1,233 @@
+# =================================================================
+# OCUPACIÓN POR DÍA DE LA SEMANA Y HORA
+# =================================================================
+# Cuánto de su tiempo disponible está ocupado cada terapeuta o gabinete,
+# por día de la semana y hora, en un rango de fechas cualquiera.
+#
+# Citas, disponibilidades y bloqueos se leen con una consulta cada una y
+# se convierten en arrays de NumPy (recurso, minuto de inicio, minuto de
+# fin, contados desde el inicio del rango). Cada intervalo se reparte en
+# las horas que toca con bincount y una suma acumulada, sin recorrer las
+# citas en Python; después las horas del rango se pliegan en una matriz
+# recurso × día de la semana × hora.
+#
+# Disponible de un terapeuta: sus disponibilidades menos sus bloqueos.
+# Disponible de un gabinete: las horas en que al menos un terapeuta
+# trabaja (los gabinetes no tienen horario propio). Las citas canceladas
+# no ocupan. Los minutos se cuentan en todo el día, pero las matrices
+# sólo muestran las horas de la grilla de la agenda.
+import tempfile
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+from flask import send_file
+from sqlalchemy import select, extract, func, cast, Integer
+
+from app import db
+from app.archivo import fuente_citas
+from app.catalogos import catalogos
+from app.models import Disponibilidad, BloqueoHorario
+from app.ocupacion import INICIO_GRILLA, FIN_GRILLA
+
+DIMENSIONES = ('terapeuta', 'gabinete')
+DIAS_SEMANA = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
+HORAS = list(range(INICIO_GRILLA // 60, FIN_GRILLA // 60))
+MAXIMO_DIAS = 3 * 366
+
+# recursos: [(id, nombre)]; ocupados y disponibles: minutos, arrays (recurso, día de la semana, HORAS).
+Utilizacion = namedtuple('Utilizacion', ['dimension', 'inicio', 'fin', 'recursos', 'ocupados', 'disponibles'])
+FilaRecurso = namedtuple('FilaRecurso', ['nombre', 'horas_ocupadas', 'horas_disponibles', 'porcentaje'])
+
+
+def _indices(ids, valores):
+    """Posición de cada valor en `ids` (ordenado) y máscara de los que están."""
+    posiciones = np.searchsorted(ids, valores)
+    encontrados = posiciones < len(ids)
+    encontrados[encontrados] = ids[posiciones[encontrados]] == valores[encontrados]
+    return posiciones, encontrados
+
+
+def _minutos_desde(columna, inicio):
+    """Minutos enteros entre `inicio` y una columna DateTime, calculados en la base (así no se
+    crea un datetime de Python por fila)."""
+    if db.engine.dialect.name == 'sqlite':
+        return cast(func.round((func.julianday(columna) - func.julianday(inicio)) * 1440), Integer)
+    return cast(func.floor(extract('epoch', columna - inicio) / 60), Integer)
+
+
+def _dias_desde(columna, inicio):
+    if db.engine.dialect.name == 'sqlite':
+        return cast(func.julianday(columna) - func.julianday(inicio), Integer)
+    return columna - inicio
+
+
+def _enteros(valores):
+    return np.fromiter(valores, dtype=np.int64, count=len(valores))
+
+
+def _repartir(recurso, desde, hasta, n_recursos, n_horas):
+    """Suma los minutos de cada intervalo [desde, hasta) en las horas que toca: array (n_recursos, n_horas)."""
+    desde, hasta = np.clip(desde, 0, n_horas * 60), np.clip(hasta, 0, n_horas * 60)
+    validos = hasta > desde
+    recurso, desde, hasta = recurso[validos], desde[validos], hasta[validos]
+    # Una columna de más por recurso para los intervalos que terminan justo al final del rango.
+    ancho = n_horas + 1
+    total = n_recursos * ancho
+    h0, h1 = desde // 60, hasta // 60
+    fila = recurso * ancho
+    misma = h0 == h1
+    minutos = np.zeros(total)
+    minutos += np.bincount(fila[misma] + h0[misma], weights=hasta[misma] - desde[misma], minlength=total)
+    varias = ~misma
+    fila, h0, h1, desde, hasta = fila[varias], h0[varias], h1[varias], desde[varias], hasta[varias]
+    minutos += np.bincount(fila + h0, weights=(h0 + 1) * 60 - desde, minlength=total)
+    minutos += np.bincount(fila + h1, weights=hasta - h1 * 60, minlength=total)
+    # Horas completas entre la primera y la última: +60 al entrar y -60 al salir, y suma acumulada.
+    escalones = (np.bincount(fila + h0 + 1, minlength=total) - np.bincount(fila + h1, minlength=total)) * 60
+    minutos += np.cumsum(escalones.reshape(n_recursos, ancho), axis=1).ravel()
+    return minutos.reshape(n_recursos, ancho)[:, :n_horas]
+
+
+def _por_dia_de_semana(por_hora, inicio):
+    """(recursos, días × 24) -> (recursos, 7, HORAS), sumando los días del mismo día de la semana."""
+    n_recursos = por_hora.shape[0]
+    por_dia = por_hora.reshape(n_recursos, -1, 24).transpose(1, 0, 2)
+    dias_semana = (inicio.weekday() + np.arange(por_dia.shape[0])) % 7
+    semana = np.zeros((7, n_recursos, 24))
+    np.add.at(semana, dias_semana, por_dia)
+    return semana.transpose(1, 0, 2)[:, :, HORAS[0]:HORAS[-1] + 1]
+
+
+def _columnas(consulta):
+    """Ejecuta un SELECT de tres columnas enteras (recurso, desde, hasta) y las devuelve como arrays.
+    Se ejecuta en la conexión, sin el procesamiento de filas del ORM."""
+    filas = db.session.connection().execute(consulta).fetchall()
+    return tuple(_enteros(columna) for columna in (zip(*filas) if filas else ((), (), ())))
+
+
+def _en_recursos(ids, recurso, desde, hasta):
+    """Cambia el id de recurso por su posición en `ids`, descartando los que no están."""
+    posiciones, encontrados = _indices(ids, recurso)
+    return posiciones[encontrados], desde[encontrados], hasta[encontrados]
+
+
+def _citas(columna_recurso, inicio, fin):
+    cita = fuente_citas(inicio)
+    return _columnas(select(getattr(cita, columna_recurso), _minutos_desde(cita.fecha_hora_inicio, inicio),
+                            _minutos_desde(cita.fecha_hora_fin, inicio))
+                     .where(cita.fecha_hora_inicio < fin, cita.fecha_hora_fin > inicio, cita.estado != 'Cancelada'))
+
+
+def _disponibilidades(inicio, fin):
+    d = Disponibilidad
+    dia = _dias_desde(d.fecha, inicio.date()) * 1440
+    return _columnas(select(d.terapeuta_id,
+                            cast(dia + extract('hour', d.hora_inicio) * 60 + extract('minute', d.hora_inicio), Integer),
+                            cast(dia + extract('hour', d.hora_fin) * 60 + extract('minute', d.hora_fin), Integer))
+                     .where(d.fecha >= inicio.date(), d.fecha < fin.date()))
+
+
+def _bloqueos(inicio, fin):
+    b = BloqueoHorario
+    return _columnas(select(b.terapeuta_id, _minutos_desde(b.fecha_hora_inicio, inicio), _minutos_desde(b.fecha_hora_fin, inicio))
+                     .where(b.fecha_hora_inicio < fin, b.fecha_hora_fin > inicio))
+
+
+def calcular(dimension, inicio, fin):
+    """Minutos ocupados y disponibles por recurso, día de la semana y hora entre los días [inicio, fin).
+    Hace 3 consultas (2 para gabinetes), más los catálogos si no están en caché."""
+    catalogo = catalogos()
+    recursos = sorted((r.id, r.nombre) for r in (catalogo.terapeutas if dimension == 'terapeuta' else catalogo.gabinetes))
+    ids = np.array([i for i, _ in recursos], dtype=np.int64)
+    n_horas = (fin - inicio).days * 24
+
+    ocupados = _repartir(*_en_recursos(ids, *_citas(f'{dimension}_id', inicio, fin)), len(ids), n_horas)
+
+    terapeutas = np.array(sorted(t.id for t in catalogo.terapeutas), dtype=np.int64)
+    # Las disponibilidades de un terapeuta pueden solaparse: ninguna hora tiene más de 60 minutos.
+    trabajo = np.minimum(_repartir(*_en_recursos(terapeutas, *_disponibilidades(inicio, fin)), len(terapeutas), n_horas), 60)
+    if dimension == 'terapeuta':
+        bloqueados = _repartir(*_en_recursos(terapeutas, *_bloqueos(inicio, fin)), len(terapeutas), n_horas)
+        disponibles = np.clip(trabajo - bloqueados, 0, None)
+    else:
+        abierto = trabajo.max(axis=0) if len(terapeutas) else np.zeros(n_horas)
+        disponibles = np.broadcast_to(abierto, (len(ids), n_horas))
+
+    return Utilizacion(dimension, inicio, fin, recursos,
+                       _por_dia_de_semana(ocupados, inicio), _por_dia_de_semana(disponibles, inicio))
+
+
+def _porcentaje(ocupados, disponibles):
+    """Ocupados / disponibles en %, NaN donde no hubo tiempo disponible."""
+    ocupados, disponibles = np.asarray(ocupados, dtype=float), np.asarray(disponibles, dtype=float)
+    resultado = np.full(np.shape(disponibles), np.nan)
+    np.divide(ocupados * 100, disponibles, out=resultado, where=disponibles > 0)
+    return resultado
+
+
+def mapa(utilizacion, indice=None):
+    """Matriz 7 × HORAS de porcentajes (None sin disponibilidad) de un recurso o, sin índice, de todos."""
+    if indice is None:
+        ocupados, disponibles = utilizacion.ocupados.sum(axis=0), utilizacion.disponibles.sum(axis=0)
+    else:
+        ocupados, disponibles = utilizacion.ocupados[indice], utilizacion.disponibles[indice]
+    return [[None if np.isnan(p) else round(float(p), 1) for p in fila] for fila in _porcentaje(ocupados, disponibles)]
+
+
+def resumen_por_recurso(utilizacion):
+    """Horas ocupadas, horas disponibles y % de cada recurso en todo el rango."""
+    ocupados, disponibles = utilizacion.ocupados.sum(axis=(1, 2)), utilizacion.disponibles.sum(axis=(1, 2))
+    porcentajes = _porcentaje(ocupados, disponibles)
+    return [FilaRecurso(nombre, round(float(o) / 60, 1), round(float(d) / 60, 1), None if np.isnan(p) else round(float(p), 1))
+            for (_, nombre), o, d, p in zip(utilizacion.recursos, ocupados, disponibles, porcentajes)]
+
+
+def color(porcentaje):
+    """Color de fondo de una celda del mapa: de blanco (0%) a rojo (100% o más)."""
+    if porcentaje is None:
+        return 'f1f3f5'
+    intensidad = min(max(porcentaje, 0), 100) / 100
+    return f'ff{round(255 - 200 * intensidad):02x}{round(255 - 200 * intensidad):02x}'
+
+
+def respuesta_excel(utilizacion, nombre='ocupacion.xlsx'):
+    """XLSX con una hoja de resumen, el mapa de todos los recursos y uno por recurso."""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import PatternFill
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet('Resumen')
+    titulo = 'Terapeuta' if utilizacion.dimension == 'terapeuta' else 'Gabinete'
+    hoja.append([f'Ocupación del {utilizacion.inicio:%d/%m/%Y} al {utilizacion.fin - timedelta(days=1):%d/%m/%Y}'])
+    hoja.append([titulo, 'Horas ocupadas', 'Horas disponibles', 'Ocupación (%)'])
+    for fila in resumen_por_recurso(utilizacion):
+        hoja.append(list(fila))
+
+    def hoja_mapa(nombre_hoja, matriz):
+        hoja = libro.create_sheet(nombre_hoja)
+        hoja.append(['Día'] + [f'{h:02d}:00' for h in HORAS])
+        for dia, fila in zip(DIAS_SEMANA, matriz):
+            celdas = [dia]
+            for porcentaje in fila:
+                celda = WriteOnlyCell(hoja, value=porcentaje)
+                celda.fill = PatternFill('solid', fgColor=color(porcentaje))
+                celdas.append(celda)
+            hoja.append(celdas)
+
+    hoja_mapa('Todos', mapa(utilizacion))
+    usados = {'Resumen', 'Todos'}
+    for indice, (id_recurso, nombre_recurso) in enumerate(utilizacion.recursos):
+        # Excel no admite []:*?/\ en el nombre de una hoja y lo limita a 31 caracteres.
+        nombre_hoja = ''.join(c for c in nombre_recurso if c not in '[]:*?/\\')[:25] or titulo
+        if nombre_hoja in usados:
+            nombre_hoja = f'{nombre_hoja} ({id_recurso})'
+        usados.add(nombre_hoja)
+        hoja_mapa(nombre_hoja, mapa(utilizacion, indice))
+
+    archivo = tempfile.TemporaryFile(suffix='.xlsx')
+    libro.save(archivo)
+    archivo.seek(0)
+    return send_file(archivo, download_name=nombre, as_attachment=True,
+                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
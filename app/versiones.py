@@ -0,0 +1,38 @@
+# =================================================================
+# CONTADORES DE VERSIÓN
+# =================================================================
+# Una fila de ContadorCambios por clave. Quien escribe incrementa la
+# versión dentro de su propia transacción; quien guarda datos en memoria
+# compara la versión que tenía con la actual para saber si debe recargar.
+from sqlalchemy import select
+
+from app import db
+from app.models import ContadorCambios
+
+
+def _insert_con_incremento(conexion):
+    if conexion.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    tabla = ContadorCambios.__table__
+    return insert(tabla).on_conflict_do_update(index_elements=['clave'], set_={'version': tabla.c.version + 1})
+
+
+def incrementar(conexion, claves):
+    """Suma 1 a la versión de cada clave (creándola si no existe) en la conexión dada."""
+    claves = sorted(set(claves))
+    if claves:
+        conexion.execute(_insert_con_incremento(conexion), [{'clave': clave, 'version': 1} for clave in claves])
+
+
+def version_actual(clave):
+    return db.session.execute(select(ContadorCambios.version).where(ContadorCambios.clave == clave)).scalar() or 0
+
+
+def versiones_actuales(claves):
+    """{clave: versión} para varias claves en una sola consulta (0 si nunca se incrementó)."""
+    claves = list(claves)
+    filas = dict(db.session.execute(select(ContadorCambios.clave, ContadorCambios.version)
+                                    .where(ContadorCambios.clave.in_(claves))).all())
+    return {clave: filas.get(clave, 0) for clave in claves}
@@ -0,0 +1,17 @@
+# =================================================================
+# CONFIGURACIÓN DE GUNICORN
+# =================================================================
+# gunicorn la lee sola al correr `gunicorn run:app` desde esta carpeta.
+# Workers con hilos (gthread): un canal SSE abierto de la agenda ocupa un
+# hilo y no un worker entero. Cada worker atiende a lo sumo la mitad de
+# sus hilos como canales (AGENDA_SSE_CANALES, ver app/eventos_agenda.py);
+# el resto queda para las peticiones normales. Sin esta configuración
+# (p. ej. workers síncronos) los canales quedan desactivados y la agenda
+# se refresca por sondeo.
+import os
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+os.environ.setdefault('AGENDA_SSE_CANALES', str(threads // 2))
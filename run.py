@@ -1,3 +1,4 @@
+import os
 from app import app, db
 from app.models import Recepcionista, Gabinete, Tratamiento, Cliente, Cita, Terapeuta
 import click
@@ -6,13 +7,178 @@ import click
 def make_shell_context():
     return {'db': db, 'Recepcionista': Recepcionista, 'Gabinete': Gabinete, 'Tratamiento': Tratamiento, 'Cliente': Cliente, 'Cita': Cita, 'Terapeuta': Terapeuta}
 
-# --- INICIO: NUEVO COMANDO PARA CREAR LAS TABLAS ---
+def crear_indices():
+    for tabla in db.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            indice.create(bind=db.engine, checkfirst=True)
+
+def preparar_esquema():
+    """Crea las tablas e índices que falten, migra la tabla cita a ids que no se reutilizan (SQLite)
+    y prepara la búsqueda de clientes. Es idempotente."""
+    from app.archivo import asegurar_ids_crecientes
+    from app.busqueda import preparar_busqueda
+    db.create_all()
+    asegurar_ids_crecientes()
+    crear_indices()
+    preparar_busqueda()
+
 @app.cli.command("init-db")
 def init_db_command():
-    """Crea todas las tablas de la base de datos."""
-    db.create_all()
-    print("Base de datos inicializada y tablas creadas.")
-# --- FIN: NUEVO COMANDO ---
+    """Crea o actualiza el esquema de la base. Correr una vez en cada despliegue, antes de iniciar los workers."""
+    preparar_esquema()
+    print("Base de datos inicializada: tablas, índices y búsqueda de clientes al día.")
+
+@app.cli.command("crear-indices")
+def crear_indices_command():
+    """Crea en una base existente los índices definidos en los modelos que aún no existan."""
+    crear_indices()
+    print("Índices verificados y creados.")
+
+@app.cli.command("crear-admin-inicial")
+def crear_admin_inicial_command():
+    """Si no hay usuarios, crea el administrador definido en DEFAULT_ADMIN_USER y DEFAULT_ADMIN_PASS."""
+    if Recepcionista.query.first():
+        print("Ya existen usuarios; no se crea el administrador inicial.")
+        return
+    admin_user = os.environ.get('DEFAULT_ADMIN_USER')
+    admin_pass = os.environ.get('DEFAULT_ADMIN_PASS')
+    if not (admin_user and admin_pass):
+        print("ADVERTENCIA: No se encontraron las variables de entorno DEFAULT_ADMIN_USER o DEFAULT_ADMIN_PASS. No se pudo crear el admin.")
+        raise SystemExit(1)
+    admin = Recepcionista(username=admin_user, is_admin=True)
+    admin.set_password(admin_pass)
+    db.session.add(admin)
+    db.session.commit()
+    print(f"Usuario administrador '{admin_user}' creado con éxito.")
+
+@app.cli.command("reconstruir-resumen")
+def reconstruir_resumen_command():
+    """Recalcula desde cero la tabla ResumenDiario a partir de todas las citas."""
+    from app.resumen import reconstruir_resumen
+    filas = reconstruir_resumen()
+    print(f"Resumen diario reconstruido: {filas} filas.")
+
+@app.cli.command("archivar-citas")
+@click.option("--antes-de", "antes_de", type=click.DateTime(formats=["%Y-%m-%d"]), default=None,
+              help="Fecha límite (por defecto, el inicio de la ventana de días recientes).")
+def archivar_citas_command(antes_de):
+    """Mueve a cita_historica las citas finalizadas o canceladas anteriores a la fecha dada."""
+    from app.archivo import archivar, limite_caliente
+    try:
+        movidas = archivar(antes_de or limite_caliente())
+    except ValueError as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    print(f"Se archivaron {movidas} citas.")
+
+@app.cli.command("cargar-horarios")
+@click.argument("archivo", type=click.Path(exists=True, dir_okay=False))
+@click.option("--tipo", type=click.Choice(["disponibilidad", "bloqueo"]), default="disponibilidad")
+def cargar_horarios_command(archivo, tipo):
+    """Carga disponibilidades o bloqueos desde un CSV/XLSX en una sola transacción."""
+    from app.carga_masiva import filas_de_archivo, cargar, ErrorCarga
+    try:
+        with open(archivo, 'rb') as f:
+            filas = filas_de_archivo(f, archivo)
+        print(f"Se cargaron {cargar(tipo, filas)} horarios.")
+    except ErrorCarga as e:
+        print("No se guardó ningún horario:")
+        for error in e.errores:
+            print(f"  {error}")
+
+@app.cli.command("generar-datos")
+@click.option("--terapeutas", default=30, show_default=True)
+@click.option("--gabinetes", default=15, show_default=True)
+@click.option("--tratamientos", default=12, show_default=True)
+@click.option("--clientes", default=5000, show_default=True)
+@click.option("--dias", default=730, show_default=True, help="Días de agenda a generar, terminando 60 días después de hoy.")
+@click.option("--ocupacion", default=0.6, show_default=True, help="Probabilidad de ocupar cada hueco libre (0 a 1).")
+@click.option("--semilla", default=42, show_default=True)
+def generar_datos_command(terapeutas, gabinetes, tratamientos, clientes, dias, ocupacion, semilla):
+    """Llena la base con datos sintéticos de un spa para pruebas de rendimiento."""
+    from app.datos_sinteticos import generar
+    totales = generar(terapeutas, gabinetes, tratamientos, clientes, dias, ocupacion, semilla)
+    print("Datos generados: " + ", ".join(f"{n} {tabla}" for tabla, n in totales.items()))
+
+@app.cli.command("benchmark")
+@click.option("--repeticiones", default=10, show_default=True)
+@click.option("--usuario", default=None, help="Usuario con el que se navega (por defecto, el primer administrador).")
+@click.option("--salida", default="benchmark.json", show_default=True, help="Archivo JSON donde se guarda el resultado.")
+@click.option("--comparar", "anterior", default=None, type=click.Path(exists=True, dir_okay=False),
+              help="JSON de una corrida anterior; termina con error si algo empeoró más de un 20%.")
+def benchmark_command(repeticiones, usuario, salida, anterior):
+    """Mide latencia, consultas y memoria de las rutas principales y guarda el resultado en JSON.
+    Termina con error si, en una base temporal, las consultas de la agenda crecen con las citas del día."""
+    import json
+    from app.benchmark import ejecutar, guardar, comparar, consultas_agenda_temporal, consultas_que_crecen
+    resultado = ejecutar(repeticiones, usuario)
+    try:
+        resultado['consultas_agenda'] = consultas_agenda_temporal()
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    guardar(resultado, salida)
+    print(f"Resultado guardado en {salida}.")
+    crecen = consultas_que_crecen(resultado)
+    for vista in crecen:
+        print(f"CONSULTAS QUE CRECEN CON LAS CITAS {vista}")
+    if crecen:
+        raise SystemExit(1)
+    if anterior:
+        with open(anterior, encoding='utf-8') as f:
+            regresiones = comparar(json.load(f), resultado)
+        for regresion in regresiones:
+            print(f"REGRESIÓN {regresion}")
+        if regresiones:
+            raise SystemExit(1)
+        print("Sin regresiones respecto de la corrida anterior.")
+
+@app.cli.command("consultas-agenda", hidden=True)
+def consultas_agenda_command():
+    """Imprime en JSON las consultas de cada vista de la agenda en el día con más citas (lo usa `flask benchmark`)."""
+    import json
+    from app.benchmark import consultas_agenda, cliente_autenticado
+    print(json.dumps(consultas_agenda(cliente_autenticado())))
+
+def doble_reserva_temporal(hilos, intentos):
+    from app.benchmark import doble_reserva_temporal
+    try:
+        print(doble_reserva_temporal(hilos, intentos), end="")
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+
+@app.cli.command("benchmark-concurrencia")
+@click.option("--hilos", default=8, show_default=True)
+@click.option("--segundos", default=5, show_default=True)
+@click.option("--escrituras", default=0.25, show_default=True, help="Proporción de operaciones que escriben (0 a 1).")
+@click.option("--intentos", default=25, show_default=True, help="Reservas que intenta cada hilo en la prueba de doble reserva.")
+def benchmark_concurrencia_command(hilos, segundos, escrituras, intentos):
+    """Compara el rendimiento concurrente de SQLite con y sin el perfil del motor (WAL) y comprueba,
+    en una base temporal, que reservas simultáneas no dejan citas superpuestas."""
+    from app.benchmark import concurrencia_sqlite
+    concurrencia_sqlite(hilos, segundos, escrituras)
+    doble_reserva_temporal(hilos, intentos)
+
+@app.cli.command("doble-reserva")
+@click.option("--hilos", default=8, show_default=True)
+@click.option("--intentos", default=25, show_default=True, help="Reservas que intenta cada hilo.")
+@click.option("--en-esta-base", is_flag=True,
+              help="Correr sobre la base configurada (crea y borra citas) en lugar de una temporal con datos sintéticos.")
+def doble_reserva_command(hilos, intentos, en_esta_base):
+    """Prueba de estrés: reservas simultáneas de los mismos recursos no deben dejar citas superpuestas."""
+    if not en_esta_base:
+        doble_reserva_temporal(hilos, intentos)
+        return
+    from app.benchmark import doble_reserva
+    try:
+        resultado = doble_reserva(hilos, intentos)
+    except ValueError as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    if resultado['solapamientos']:
+        print("ERROR: reservas simultáneas dejaron citas superpuestas.")
+        raise SystemExit(1)
 
 @app.cli.command("create-admin")
 @click.argument("username")
@@ -30,4 +196,7 @@ def create_admin(username, password):
     print(f"¡Éxito! Usuario administrador '{username}' creado correctamente.")
 
 if __name__ == '__main__':
+    # Servidor de desarrollo: deja la base lista sin tener que correr init-db a mano.
+    with app.app_context():
+        preparar_esquema()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file